@@ -1,28 +1,259 @@
+from __future__ import annotations
+
+import hashlib
+import importlib.util
+import time
+from typing import TYPE_CHECKING
+
 import streamlit as st
-import pandas as pd
-from streamlit_folium import folium_static
 
-try:
-    from streamlit_geolocation import streamlit_geolocation
-except Exception:
-    streamlit_geolocation = None
+from data.watcher import POLL_SECONDS, WATCH_DIR, FolderWatcher
+from map.render_cache import RenderCache, map_to_html
+from utils import perf
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from map.clustering import ClusterLevels
+
+
+# Arranque a frio: ao importar a app só entra o Streamlit. pandas / numpy /
+# data.* entram no 1.º rerun com ficheiros, folium no 1.º mapa e a
+# geolocalização quando se carrega no botão. Custo por módulo:
+# `python -m benchmarks.startup`.
+HAS_GEOLOCATION = importlib.util.find_spec("streamlit_geolocation") is not None
+
+MAP_WIDTH = 1600
+MAP_HEIGHT = 650
+
+PROX_ALL = "Todos"
+PROX_RADIUS = "Num raio (km)"
+PROX_NEAREST = "Mais próximos (N)"
+
+
+@st.cache_resource
+def _render_cache() -> RenderCache:
+    # uma só instância por processo: sessões no mesmo estado reaproveitam o HTML
+    return RenderCache()
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _cluster_levels(key: str, _df: pd.DataFrame, _delta=None) -> ClusterLevels:
+    # hierarquia de clusters por zoom: uma vez por dataset (filtros = só contagens)
+    from data.canonical import COLOR_COL
+    from map.clustering import ClusterLevels
+
+    perf.executed("cluster_levels")
+    if _delta is not None:
+        # alertas atualizados: só as linhas novas entram na grelha
+        added = _df.iloc[len(_delta.keep):]
+        return _cluster_levels(_delta.prev_key, _delta.prev_df).patched(
+            _delta.keep,
+            added["Latitudine"].to_numpy(),
+            added["Longitudine"].to_numpy(),
+            added[COLOR_COL].cat.codes.to_numpy(),
+            codes=added["Cod Site"].to_numpy(),
+        )
+    return ClusterLevels(
+        _df["Latitudine"].to_numpy(),
+        _df["Longitudine"].to_numpy(),
+        _df[COLOR_COL].cat.codes.to_numpy(),
+        codes=_df["Cod Site"].to_numpy(),
+    )
+
+
+def _prewarm(loc_bytes: bytes, alert_bytes: bytes, key: str):
+    # corre na thread do watcher: quando publica, as caches por dataset já estão quentes
+    from data.data_loader import dataset_index, load_dataset, metrics_cube, site_index, text_index
+
+    df, issues_all, changes, delta = load_dataset(loc_bytes, alert_bytes, key)
+    dataset_index(key, df)
+    metrics_cube(key, df)
+    site_index(key, df)
+    text_index(key, df)
+    _cluster_levels(key, df, delta)
+    return df, issues_all, changes, delta
+
+
+@st.cache_resource
+def _watcher() -> FolderWatcher:
+    from data.data_loader import lease_dataset
+
+    return FolderWatcher(WATCH_DIR, _prewarm, lease=lease_dataset).start()
+
+
+@st.fragment(run_every=POLL_SECONDS)
+def _watch_status(watcher: FolderWatcher, shown_key: str | None) -> None:
+    status = watcher.status()
+    if status["locations"]:
+        st.caption(f"📂 {status['locations']} + {status['alerts']}")
+    if status["loading"]:
+        st.caption(f"⏳ A carregar {' + '.join(status['loading'])}...")
+    if status["error"]:
+        st.warning(status["error"])
+
+    # versão nova publicada -> rerun da app inteira com ela
+    current = watcher.current
+    if current is not None and current.key != shown_key:
+        # fecha a recolha deste rerun (a linha-resumo); sem painel: o fragmento não escreve na sidebar
+        perf.end_run()
+        st.rerun()
+
+
+def _teams(edited: pd.DataFrame) -> list[tuple[str, float, float]]:
+    # linhas do editor com coordenadas válidas; nome vazio -> "Equipa N"
+    import pandas as pd
+
+    teams = []
+    for i, row in enumerate(edited.itertuples(index=False)):
+        lat = pd.to_numeric(row.Latitude, errors="coerce")
+        lon = pd.to_numeric(row.Longitude, errors="coerce")
+        if pd.notna(lat) and pd.notna(lon):
+            name = str(row.Equipa).strip() if pd.notna(row.Equipa) and str(row.Equipa).strip() else f"Equipa {i + 1}"
+            teams.append((name, float(lat), float(lon)))
+    return teams
+
+
+def _dispatch(df: pd.DataFrame, teams: list[tuple[str, float, float]], balanced: bool):
+    """Atribui cada site DOWN (não cada alerta) a uma equipa; devolve (df com a equipa, resumo por equipa).
+
+    Os restantes (ONAIR, sem estado) ficam sem equipa: TEAM_COL = -1, "Equipa" vazia.
+    """
+    import numpy as np
+    import pandas as pd
+
+    from data.canonical import STATUS_COL, STATUS_DOWN, TEAM_COL
+    from utils.dispatch import dispatch
+
+    down = (df[STATUS_COL] == STATUS_DOWN).to_numpy()
+    sites = df[down].drop_duplicates("Cod Site")
+    capacity = -(-len(sites) // len(teams)) if balanced else None
+    with perf.span("dispatch", sites=len(sites), teams=len(teams)):
+        team, km = dispatch(
+            sites["Latitudine"].to_numpy(),
+            sites["Longitudine"].to_numpy(),
+            [t[1] for t in teams],
+            [t[2] for t in teams],
+            capacity=capacity,
+        )
+
+    names = np.array([t[0] for t in teams], dtype=object)
+    # -1 = linha fora do despacho -> último elemento (sem equipa)
+    row_site = np.where(down, pd.Index(sites["Cod Site"]).get_indexer(df["Cod Site"]), -1)
+    df = df.assign(**{
+        "Equipa": np.append(names[team], "")[row_site],
+        "Distância equipa (km)": np.append(km, np.nan)[row_site].round(2),
+        TEAM_COL: np.append(team, -1)[row_site],
+    })
+
+    summary = (
+        pd.DataFrame({"Equipa": names[team], "km": km})
+        .groupby("Equipa", sort=False)["km"]
+        .agg(Sites="size", **{"km (total)": "sum", "km (máx.)": "max"})
+        .reindex(list(dict.fromkeys(names)), fill_value=0)
+        .round(1)
+    )
+    return df, summary
+
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def _down_since(snapshot_id: int | None) -> pd.Series:
+    # muda só quando entra um snapshot novo no histórico
+    from data.data_loader import history_store
+
+    return history_store().down_since()
+
+
+def _history_panel(history, df: pd.DataFrame) -> None:
+    import pandas as pd
+
+    from data.canonical import norm_code
+
+    info = history.summary()
+    if not info["snapshots"]:
+        st.info("Ainda não há snapshots no histórico.")
+        return
+    first, last = (pd.to_datetime(info[k], unit="s").strftime("%Y-%m-%d %H:%M") for k in ("first", "last"))
+    st.caption(f"{info['snapshots']} snapshots ({first} → {last}), {info['events']} mudanças gravadas.")
+
+    days = st.select_slider("Período (dias)", options=[1, 7, 30, 90], value=7, key="history_days")
+    end = time.time()
+    start = end - days * 86400
+    h1, h2 = st.columns(2)
+    with perf.span("history.downtime"):
+        down = history.downtime(start, end, sites=df["Cod Site"].unique())
+    h1.markdown("**Horas em DOWN (sites visíveis)**")
+    h1.dataframe(
+        down.round({"down_h": 1}).head(200).rename(
+            columns={"cod_site": "Cod Site", "lant": "Lant", "down_h": "Horas DOWN", "periodos": "Períodos"}
+        ),
+        hide_index=True,
+    )
+    with perf.span("history.transitions"):
+        flaps = history.transitions(start, end, by="lant")
+    h2.markdown("**Lants com mais mudanças de estado**")
+    h2.dataframe(
+        flaps.head(50).rename(
+            columns={"lant": "Lant", "transicoes": "Mudanças", "para_down": "Para DOWN", "sites": "Sites"}
+        ),
+        hide_index=True,
+    )
+
+    site = norm_code(st.text_input("Linha temporal de um Cod Site", key="history_site"))
+    if site:
+        st.dataframe(history.timeline(site), hide_index=True)
+
+
+def _build_map(df, df_merged, ds_key, delta, map_lat, map_lon, route_order, teams=None, color_by=None):
+    from map.map_builder import build_map
+
+    use_cluster = st.session_state.use_cluster
+    with perf.span("build_map", sites=len(df)):
+        return build_map(
+            df=df,
+            user_lat=map_lat,
+            user_lon=map_lon,
+            use_cluster=use_cluster,
+            route_order=route_order,
+            mode="geojson",
+            cluster_levels=(
+                perf.cached_call("cluster_levels", _cluster_levels, ds_key, df_merged, delta)
+                if use_cluster and not teams and color_by is None
+                else None
+            ),
+            teams=teams,
+            color_by=color_by,
+        )
+
 
-from data.data_loader import prepare_merged_df
-from map.map_builder import build_map
+def _finish_run(run: perf.Run | None) -> None:
+    total_ms = None if run is None else (time.perf_counter() - run.t0) * 1000
+    perf.end_run()
+    # pode correr antes da checkbox existir (paragens no início do rerun)
+    if run is None or not st.session_state.get("perf_debug", False):
+        return
 
+    import pandas as pd
 
-def _norm_code(x) -> str:
-    """Normaliza códigos tipo Lant vindos do Excel: '12345.0' -> '12345', trim, uppercase."""
-    if x is None:
-        return ""
-    s = str(x).strip()
-    if s.endswith(".0") and s.replace(".0", "").isdigit():
-        s = s[:-2]
-    return s.strip().upper()
+    from data.data_loader import dataset_store
+
+    with st.sidebar.expander("⏱️ Desempenho (este rerun)", expanded=True):
+        st.caption(f"Total: **{total_ms:.0f} ms**")
+        if run.spans:
+            spans = pd.DataFrame(sorted(run.spans, key=lambda r: r["start_ms"]))
+            spans["span"] = ["· " * d + n for d, n in zip(spans["depth"], spans["span"])]
+            st.dataframe(spans[["span", "ms"]], hide_index=True)
+        if run.counters:
+            st.dataframe(pd.Series(run.counters, name="n").sort_index())
+        if run.frames:
+            st.dataframe(pd.DataFrame(run.frames.values()).set_index("frame"))
+        st.json(_render_cache().stats())
+        st.json(dataset_store().stats())
 
 
 def main():
     st.set_page_config(layout="wide", page_title="TaskForce MasterChain (No-JS)")
+    run = perf.begin_run(st.session_state.get("perf_debug", False))
     st.title("TASKFORCE MASTERCHAIN - ALERTS MAP (No-JS)")
 
     # -----------------------------
@@ -44,6 +275,18 @@ def main():
         st.session_state.user_lat = None
     if "user_lon" not in st.session_state:
         st.session_state.user_lon = None
+    if "prox_mode" not in st.session_state:
+        st.session_state.prox_mode = PROX_ALL
+    if "prox_km" not in st.session_state:
+        st.session_state.prox_km = 15.0
+    if "prox_n" not in st.session_state:
+        st.session_state.prox_n = 20
+    if "prox_status" not in st.session_state:
+        st.session_state.prox_status = []
+    if "text_query" not in st.session_state:
+        st.session_state.text_query = ""
+    if "dispatch_on" not in st.session_state:
+        st.session_state.dispatch_on = False
 
     # -----------------------------
     # SIDEBAR: LOCALIZAÇÃO
@@ -51,13 +294,15 @@ def main():
     st.sidebar.header("Localização")
     manual = st.sidebar.toggle("Inserir localização manualmente", value=False)
 
-    if manual or streamlit_geolocation is None:
-        if streamlit_geolocation is None:
+    if manual or not HAS_GEOLOCATION:
+        if not HAS_GEOLOCATION:
             st.sidebar.warning("Geolocalização não disponível aqui. Usa modo manual.")
         st.session_state.user_lat = st.sidebar.number_input("Latitude", value=38.722300, format="%.6f")
         st.session_state.user_lon = st.sidebar.number_input("Longitude", value=-9.139300, format="%.6f")
     else:
         if st.sidebar.button("📍 Atualizar localização"):
+            from streamlit_geolocation import streamlit_geolocation
+
             loc = streamlit_geolocation() or {}
             lat_tmp = loc.get("latitude")
             lon_tmp = loc.get("longitude")
@@ -69,35 +314,125 @@ def main():
 
     if st.session_state.user_lat is None or st.session_state.user_lon is None:
         st.info("Permite localização no browser (ou usa modo manual) para continuar.")
+        _finish_run(run)
         st.stop()
 
     user_lat = float(st.session_state.user_lat)
     user_lon = float(st.session_state.user_lon)
 
     # -----------------------------
-    # UPLOADS
+    # SIDEBAR: CACHE
     # -----------------------------
-    st.subheader("Uploads")
-    file_loc = st.file_uploader("📍 Base localizações (.xlsx)", type=["xlsx"])
-    file_alert = st.file_uploader("🚨 Base alertas (.xlsx) - sheet 'TOATE ALERTELE'", type=["xlsx"])
+    st.sidebar.header("Cache")
+    if st.sidebar.button("🧹 Limpar cache de ficheiros"):
+        from data.data_loader import clear_caches
 
-    if not (file_loc and file_alert):
-        st.info("Carrega as duas bases para começar.")
-        st.stop()
+        n = clear_caches()
+        _render_cache().clear()
+        st.sidebar.success(f"Cache limpa ({n} ficheiros removidos).")
+    st.sidebar.checkbox("Diagnóstico de desempenho", key="perf_debug")
+
+    # -----------------------------
+    # UPLOADS / PASTA VIGIADA
+    # -----------------------------
+    if WATCH_DIR:
+        # uma versão por rerun: se entretanto for publicada outra, fica para o próximo
+        watcher = _watcher()
+        published = watcher.current
+        st.sidebar.header("Dados")
+        with st.sidebar:
+            _watch_status(watcher, None if published is None else published.key)
+        if published is None:
+            st.info(f"A aguardar / preparar os livros em `{WATCH_DIR}`...")
+            _finish_run(run)
+            st.stop()
+        ds_key = published.key
+    else:
+        st.subheader("Uploads")
+        file_loc = st.file_uploader("📍 Base localizações (.xlsx)", type=["xlsx"])
+        file_alert = st.file_uploader("🚨 Base alertas (.xlsx) - sheet 'TOATE ALERTELE'", type=["xlsx"])
 
-    loc_bytes = file_loc.getvalue()
-    alert_bytes = file_alert.getvalue()
+        if not (file_loc and file_alert):
+            st.info("Carrega as duas bases para começar.")
+            _finish_run(run)
+            st.stop()
+
+        from data.data_loader import dataset_key
+
+        loc_bytes = file_loc.getvalue()
+        alert_bytes = file_alert.getvalue()
+        ds_key = dataset_key(loc_bytes, alert_bytes)
 
     # -----------------------------
     # LOAD + MERGE
     # -----------------------------
+    # só agora (há dados): pandas / numpy e o pipeline
+    with perf.span("imports"):
+        import numpy as np
+        import pandas as pd
+
+        from data.canonical import (
+            HISTORY_COL,
+            STATUS_DOWN,
+            STATUS_ONAIR,
+            STATUSES,
+            TEAM_COLORS,
+            display_columns,
+            norm_code,
+        )
+        from data.data_loader import (
+            dataset_index,
+            distance_order,
+            history_store,
+            lease_dataset,
+            load_dataset,
+            metrics_cube,
+            site_index,
+            snap_position,
+            text_index,
+            travel_provider,
+        )
+        from data.history import DOWN_BUCKETS, HISTORY_COLORS, NOT_DOWN_COLOR, down_buckets
+        from data.indexes import select
+        from utils.route_opt import optimize_route, route_length_km
+
+    # a sessão segura o seu dataset no store partilhado (solta-o ao mudar de dataset / terminar);
+    # pedido antes do load para se prender à entrada logo que é inserida
+    lease = st.session_state.get("dataset_lease")
+    if lease is None or lease.key != ds_key:
+        st.session_state.dataset_lease = lease_dataset(ds_key)
+
     with st.spinner("A ler e cruzar dados..."):
-        df_base, issues_all = prepare_merged_df(loc_bytes, alert_bytes, user_lat, user_lon)
+        # df_merged é partilhado e nunca alterado: os filtros são máscaras sobre ele
+        if WATCH_DIR:
+            df_merged, issues_all, changes, delta = published.dataset
+        else:
+            df_merged, issues_all, changes, delta = perf.cached_call(
+                "load_dataset", load_dataset, loc_bytes, alert_bytes, ds_key
+            )
+        index = perf.cached_call("dataset_index", dataset_index, ds_key, df_merged)
+        cube = perf.cached_call("metrics_cube", metrics_cube, ds_key, df_merged)
+        texts = perf.cached_call("text_index", text_index, ds_key, df_merged)
+        dist, order, dist_source = perf.cached_call(
+            "distance_order", distance_order, ds_key, df_merged, user_lat, user_lon, delta
+        )
+
+    routing = travel_provider().status()
+    if routing["provider"] != "geodesic":
+        if routing["available"]:
+            st.sidebar.caption("🛣️ Distâncias por estrada; sites ordenados por tempo de condução.")
+        else:
+            st.sidebar.warning(f"Motor de rotas indisponível ({routing['error']}): distâncias em linha reta.")
 
-    if df_base.empty:
+    if df_merged.empty:
         st.error("Após cruzamento, não há sites (Cod Site vs Site code). Verifica os ficheiros.")
+        _finish_run(run)
         st.stop()
 
+    if changes:
+        with st.expander(f"🔄 Alterações nos alertas: {changes.summary()}"):
+            st.dataframe(changes.changelog(), hide_index=True)
+
     # inicializa issues (uma vez)
     if not st.session_state.selected_issues:
         st.session_state.selected_issues = issues_all
@@ -122,6 +457,13 @@ def main():
     )
 
     st.sidebar.header("Pesquisa / Filtros")
+    # fora do formulário: filtra logo ao carregar Enter
+    st.sidebar.text_input(
+        "🔎 Pesquisa (Cod Site, Issue, comentários)",
+        key="text_query",
+        placeholder="ex.: bater furat",
+        help="Todos os termos têm de aparecer; cada termo vale como início de palavra. Sem acentos/maiúsculas.",
+    )
     with st.sidebar.form("filters_form"):
         lant_code = st.text_input("Pesquisar por Lant (opcional)", value=st.session_state.lant_code).strip()
 
@@ -135,6 +477,21 @@ def main():
             default=st.session_state.selected_issues
         )
 
+        st.markdown("**Proximidade**")
+        prox_mode = st.radio(
+            "Mostrar",
+            options=[PROX_ALL, PROX_RADIUS, PROX_NEAREST],
+            index=[PROX_ALL, PROX_RADIUS, PROX_NEAREST].index(st.session_state.prox_mode),
+            horizontal=True,
+        )
+        prox_km = st.number_input("Raio (km)", min_value=0.1, value=float(st.session_state.prox_km), step=1.0)
+        prox_n = st.number_input("N sites mais próximos", min_value=1, value=int(st.session_state.prox_n), step=1)
+        prox_status = st.multiselect(
+            "Só estes estados (vazio = todos)",
+            options=STATUSES,
+            default=st.session_state.prox_status,
+        )
+
         apply_btn = st.form_submit_button("Aplicar")
 
     if apply_btn:
@@ -143,36 +500,132 @@ def main():
         st.session_state.show_table = show_table
         st.session_state.show_comments = show_comments
         st.session_state.selected_issues = selected_issues
+        st.session_state.prox_mode = prox_mode
+        st.session_state.prox_km = float(prox_km)
+        st.session_state.prox_n = int(prox_n)
+        st.session_state.prox_status = prox_status
         st.session_state.route_sites = []  # limpa rota ao mexer em filtros
 
+    # -----------------------------
+    # SIDEBAR: DESPACHO (várias equipas)
+    # -----------------------------
+    st.sidebar.header("Despacho (equipas)")
+    teams = []
+    balanced = False
+    if st.sidebar.toggle("Distribuir sites DOWN pelas equipas", key="dispatch_on"):
+        if "teams_init" not in st.session_state:
+            st.session_state.teams_init = pd.DataFrame(
+                {"Equipa": ["Equipa 1"], "Latitude": [user_lat], "Longitude": [user_lon]}
+            )
+        edited = st.sidebar.data_editor(
+            st.session_state.teams_init, num_rows="dynamic", hide_index=True, key="teams_editor"
+        )
+        balanced = st.sidebar.checkbox("Equilibrar carga (máx. ⌈sites DOWN / equipas⌉ por equipa)", key="dispatch_balanced")
+        teams = _teams(edited)
+        if not teams:
+            st.sidebar.warning("Indica pelo menos uma equipa com latitude e longitude.")
+
+    # -----------------------------
+    # SIDEBAR: HISTÓRICO (SQLite partilhado)
+    # -----------------------------
+    history = history_store()
+    history_colors = False
+    if history is not None:
+        st.sidebar.header("Histórico")
+        history_colors = st.sidebar.toggle(
+            "Colorir por tempo em DOWN", key="history_colors", disabled=bool(teams),
+            help="Cor = há quanto tempo o site está DOWN seguido (snapshots do histórico).",
+        ) and not teams
+        if history_colors:
+            legend = [(NOT_DOWN_COLOR, "Não está DOWN")] + [(c, label) for _, label, c in DOWN_BUCKETS]
+            st.sidebar.markdown(
+                "<div style=\"line-height:1.8;\">" + "".join(
+                    f'<span style="display:inline-block;width:12px;height:12px;background:{c};'
+                    f'border-radius:50%;margin-right:8px;"></span>{label}<br>'
+                    for c, label in legend
+                ) + "</div>",
+                unsafe_allow_html=True,
+            )
+        st.sidebar.toggle("Mostrar histórico", key="show_history")
+
     # -----------------------------
     # APLICAR FILTROS (ORDEM IMPORTA)
     # 1) LANT primeiro (para garantir chain inteira)
     # 2) Issues depois (opcional)
+    # 3) Proximidade (índice espacial, sobre o que sobrou)
     # -----------------------------
-    df = df_base.copy()
+    mask = index.all()
 
     # ---- LANT (FORTE) ----
-    lant_val = _norm_code(st.session_state.lant_code)
+    lant_val = norm_code(st.session_state.lant_code)
 
     if lant_val:
-        if "Lant" not in df.columns:
+        if not index.has_lant:
             st.warning("Coluna 'Lant' não encontrada no ficheiro de alertas.")
-            df = df.iloc[0:0].copy()
+            mask[:] = False
         else:
-            # normalizar coluna Lant no DF
-            df["Lant"] = df["Lant"].map(_norm_code)
-            df_lant = df[df["Lant"] == lant_val].copy()
-
-            if df_lant.empty:
+            mask &= index.lant_mask(lant_val)
+            if not mask.any():
                 st.warning(f"Nenhum site encontrado para Lant '{lant_val}'.")
-                df = df.iloc[0:0].copy()
-            else:
-                df = df_lant
 
-    # ---- ISSUES (se vazio -> não filtra) ----
-    if st.session_state.selected_issues:
-        df = df[df["Issue"].astype(str).isin(st.session_state.selected_issues)].copy()
+    # ---- ISSUES (se vazio ou todas -> não filtra; mantém sites sem Issue) ----
+    issues_filter = None
+    if st.session_state.selected_issues and set(st.session_state.selected_issues) != set(issues_all):
+        issues_filter = list(st.session_state.selected_issues)
+        mask &= index.issue_mask(issues_filter)
+
+    # ---- PESQUISA DE TEXTO (índice invertido) ----
+    text_terms = None
+    text_mask = texts.search(st.session_state.text_query)
+    if text_mask is not None:
+        text_terms = tuple(texts.terms(st.session_state.text_query))
+        mask &= text_mask
+        if not mask.any():
+            suggestions = texts.suggest(text_terms[-1], limit=5)
+            hint = f" Sugestões: {', '.join(suggestions)}" if suggestions else ""
+            st.warning(f"Nenhum site corresponde à pesquisa '{st.session_state.text_query}'.{hint}")
+
+    # ---- PROXIMIDADE (raio / N mais próximos) ----
+    prox_key = None
+    if st.session_state.prox_mode != PROX_ALL and mask.any():
+        prox_mask = mask.copy()
+        if st.session_state.prox_status:
+            prox_mask &= index.status_mask(st.session_state.prox_status)
+
+        q_lat, q_lon = snap_position(user_lat, user_lon)
+        spatial = perf.cached_call("site_index", site_index, ds_key, df_merged)
+        with perf.span("proximity", mode=st.session_state.prox_mode):
+            if st.session_state.prox_mode == PROX_RADIUS:
+                pos, _ = spatial.radius(q_lat, q_lon, st.session_state.prox_km, mask=prox_mask)
+                prox_key = ("r", st.session_state.prox_km, tuple(st.session_state.prox_status))
+            else:
+                pos, _ = spatial.nearest(q_lat, q_lon, st.session_state.prox_n, mask=prox_mask)
+                prox_key = ("n", st.session_state.prox_n, tuple(st.session_state.prox_status))
+
+        mask = np.zeros_like(mask)
+        mask[pos] = True
+
+    # única materialização (ordenada por distância); o índice = posição em df_merged
+    with perf.span("select"):
+        df = select(df_merged, mask, dist, order)
+    perf.frame("filtered", df)
+
+    dispatch_summary = None
+    if teams and not df.empty:
+        df, dispatch_summary = _dispatch(df, teams, balanced)
+
+    color_by = None
+    history_key = None
+    if history_colors and not df.empty:
+        # o snapshot deste ficheiro pode ainda estar a ser gravado
+        history.flush()
+        history_key = history.last_snapshot()
+        since = perf.cached_call("down_since", _down_since, history_key)
+        buckets = down_buckets(df["Cod Site"], since)
+        df = df.assign(**{HISTORY_COL: buckets})
+        # o tempo passa e um site muda de faixa: a chave do mapa são as próprias faixas
+        history_key = hashlib.sha1(buckets.astype(np.int8).tobytes()).hexdigest()
+        color_by = (HISTORY_COL, HISTORY_COLORS)
 
     # -----------------------------
     # ROTA (SEM JAVA) - aparece se houver sites
@@ -180,7 +633,7 @@ def main():
     route_order = []
     if not df.empty and lant_val:
         st.sidebar.header("Ligações (Chain)")
-        sites_lant = sorted(df["Cod Site"].astype(str).str.strip().str.upper().unique().tolist())
+        sites_lant = sorted(df["Cod Site"].unique().tolist())
 
         route_sites = st.sidebar.multiselect(
             "Seleciona sites pela ordem (1→2→3...)",
@@ -191,41 +644,109 @@ def main():
         if st.sidebar.button("Aplicar ligações"):
             st.session_state.route_sites = route_sites
 
-    valid_sites = set(df["Cod Site"].astype(str).str.upper()) if not df.empty else set()
+        # Ordem automática: vizinho mais próximo + 2-opt/Or-opt a partir da posição atual
+        if st.sidebar.button("⚡ Otimizar rota"):
+            sites = df.drop_duplicates("Cod Site")
+            tour, _ = optimize_route(
+                sites["Latitudine"].to_numpy(),
+                sites["Longitudine"].to_numpy(),
+                start=(user_lat, user_lon),
+            )
+            st.session_state.route_sites = sites["Cod Site"].iloc[tour].tolist()
+            _finish_run(run)
+            st.rerun()
+
+    valid_sites = set(df["Cod Site"]) if not df.empty else set()
     route_order = [s for s in st.session_state.route_sites if s.upper() in valid_sites]
 
+    if route_order:
+        coords = df.drop_duplicates("Cod Site").set_index("Cod Site").loc[route_order]
+        route_km = route_length_km(
+            coords["Latitudine"].to_numpy(),
+            coords["Longitudine"].to_numpy(),
+            start=(user_lat, user_lon),
+        )
+        st.sidebar.caption(f"Comprimento da rota: **{route_km:.1f} km** (desde a tua posição)")
+
     # -----------------------------
     # MÉTRICAS
     # -----------------------------
-    total = len(df)
-    onair = (df["Tip Alarma"].astype(str).str.strip().str.lower() == "onair").sum() if not df.empty else 0
-    down = (df["Tip Alarma"].astype(str).str.strip().str.lower() == "down").sum() if not df.empty else 0
+    # Contagens do cubo (Lant, Issue, Tip Alarma, GW): soma de células, não de linhas.
+    # A proximidade e a pesquisa de texto não são dimensões do cubo -> entram como máscara de linhas.
+    if prox_key is None and text_terms is None:
+        cube_filter = {"lant": lant_val or None, "issues": issues_filter}
+    else:
+        cube_filter = {"mask": mask}
+    counts = cube.status_counts(**cube_filter)
 
     c1, c2, c3 = st.columns(3)
-    c1.metric("Sites no mapa", int(total))
-    c2.metric("OnAir", int(onair))
-    c3.metric("Down", int(down))
+    c1.metric("Sites no mapa", counts["total"])
+    c2.metric("OnAir", counts[STATUS_ONAIR])
+    c3.metric("Down", counts[STATUS_DOWN])
+
+    if counts[STATUS_DOWN]:
+        with st.expander("📉 DOWN por Issue / Lant", expanded=False):
+            b1, b2 = st.columns(2)
+            b1.dataframe(cube.breakdown("Issue", status=STATUS_DOWN, **cube_filter))
+            if cube.has_lant:
+                b2.dataframe(cube.breakdown("Lant", status=STATUS_DOWN, **cube_filter))
 
     if lant_val:
         st.caption(f"Filtro Lant ativo: **{lant_val}**")
+    if text_terms:
+        st.caption(f"Pesquisa: **{' + '.join(text_terms)}**")
+
+    if dispatch_summary is not None:
+        with st.expander(f"🚚 Despacho: {len(teams)} equipas", expanded=True):
+            colors = [TEAM_COLORS[i % len(TEAM_COLORS)] for i in range(len(dispatch_summary))]
+            st.dataframe(
+                dispatch_summary.assign(Cor="●").style.apply(
+                    lambda _: [f"color: {c}" for c in colors], subset=["Cor"], axis=0
+                )
+            )
+
+    if history is not None and st.session_state.get("show_history") and not df.empty:
+        with st.expander("📈 Histórico", expanded=True):
+            _history_panel(history, df)
 
     # -----------------------------
     # MAPA (BLINDADO)
     # -----------------------------
     if df.empty:
         st.warning("Nenhum site corresponde aos filtros aplicados.")
+        _finish_run(run)
         st.stop()
 
+    # Chave do HTML: tudo o que muda o mapa (tabela/comentários não entram)
+    map_lat, map_lon = snap_position(user_lat, user_lon)
+    issues_key = None if issues_filter is None else tuple(sorted(issues_filter))
+    map_key = (
+        ds_key,
+        lant_val,
+        issues_key,
+        bool(st.session_state.use_cluster),
+        prox_key,
+        text_terms,
+        tuple(route_order),
+        map_lat,
+        map_lon,
+        "geojson",
+        (tuple(teams), balanced) if teams else None,
+        history_key,
+        dist_source,
+    )
+
     try:
         with st.spinner("A renderizar mapa..."):
-            mapa = build_map(
-                df=df,
-                user_lat=user_lat,
-                user_lon=user_lon,
-                use_cluster=st.session_state.use_cluster,
-                route_order=route_order
-            )
-            folium_static(mapa, width=1600, height=650)
+            def render():
+                return map_to_html(_build_map(
+                    df, df_merged, ds_key, delta, map_lat, map_lon, route_order, teams, color_by
+                ))
+
+            # distâncias parciais (o motor caiu a meio) não ficam na cache do HTML
+            html = _render_cache().get_or_render(map_key, render) if dist_source else render()
+            # HTML gerado por nós (folium), não vem do utilizador
+            st.iframe(html, width=MAP_WIDTH, height=MAP_HEIGHT + 10)
     except Exception as e:
         st.error("Erro ao renderizar o mapa.")
         st.exception(e)
@@ -235,7 +756,7 @@ def main():
     # -----------------------------
     if st.session_state.show_table:
         st.subheader("📊 Tabela")
-        st.dataframe(df.reset_index(drop=True))
+        st.dataframe(df[display_columns(df)].reset_index(drop=True))
 
     # -----------------------------
     # COMENTÁRIOS (OPCIONAL)
@@ -245,17 +766,15 @@ def main():
         if "Comments" not in df.columns:
             st.info("Coluna 'Comments' não encontrada.")
         else:
-            df_comments = df[["Cod Site", "Issue", "Comments"]].copy()
-            df_comments["Comments"] = df_comments["Comments"].astype(str).str.strip()
-            df_comments = df_comments[
-                df_comments["Comments"].ne("") &
-                df_comments["Comments"].str.lower().ne("nan")
-            ]
+            # Comments já normalizados no load ("" = sem comentário)
+            df_comments = df.loc[df["Comments"].ne(""), ["Cod Site", "Issue", "Comments"]]
             if df_comments.empty:
                 st.info("Sem comentários para os sites visíveis.")
             else:
                 st.dataframe(df_comments.reset_index(drop=True))
 
+    _finish_run(run)
+
 
 if __name__ == "__main__":
     main()
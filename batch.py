@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+from data.canonical import STATUS_COL, STATUS_DOWN, STATUS_ONAIR, display_columns, norm_code
+from data.data_loader import merge_workbooks, order_by_distance
+from data.indexes import select
+from map.map_builder import build_map
+from map.render_cache import map_to_html
+from utils import perf
+
+
+# Modo headless: snapshots (HTML do mapa + tabela de sites) por Lant, Issue, ...
+# Os livros são lidos e cruzados uma vez no processo principal; os workers
+# herdam o DF por fork (copy-on-write, sem cópia) e cada tarefa só recebe
+# o valor do grupo + as posições das suas linhas.
+#
+#   python batch.py locatii.xlsx alerte.xlsx --out snapshots/ --by Lant
+
+GROUP_COLUMNS = ("Lant", "Issue", "Tip Alarma", "GW")
+FORMATS = ("csv", "parquet")
+
+# estado partilhado com os workers (preenchido antes de criar o pool)
+_DATA: dict = {}
+
+
+def _slug(value: str) -> str:
+    return re.sub(r"[^\w.-]+", "_", value, flags=re.UNICODE).strip("_") or "_"
+
+
+def _init_worker(data: dict | None) -> None:
+    # com fork os workers já têm _DATA; sem fork recebem-no (uma vez por worker)
+    if data is not None:
+        _DATA.update(data)
+
+
+def _render_group(value: str, name: str, positions: np.ndarray) -> dict:
+    t0 = time.perf_counter()
+    df, dist, order = _DATA["df"], _DATA["dist"], _DATA["order"]
+    opts = _DATA["opts"]
+
+    if dist is not None:
+        mask = np.zeros(len(df), dtype=bool)
+        mask[positions] = True
+        sub = select(df, mask, dist, order)
+        lat, lon = opts["lat"], opts["lon"]
+    else:
+        sub = df.take(np.sort(positions))
+        lat, lon = float(sub["Latitudine"].mean()), float(sub["Longitudine"].mean())
+
+    out_dir = Path(opts["out"])
+    html_path = out_dir / f"{name}.html"
+    html_path.write_text(
+        map_to_html(build_map(sub, lat, lon, use_cluster=opts["cluster"], mode="geojson", show_user=dist is not None)),
+        encoding="utf-8",
+    )
+
+    table = sub[display_columns(sub)].reset_index(drop=True)
+    table_path = out_dir / f"{name}.{opts['format']}"
+    if opts["format"] == "parquet":
+        table.to_parquet(table_path, index=False)
+    else:
+        # utf-8-sig: o Excel abre os diacríticos corretamente
+        table.to_csv(table_path, index=False, encoding="utf-8-sig")
+
+    status = sub[STATUS_COL]
+    return {
+        "value": value,
+        "sites": len(sub),
+        "onair": int((status == STATUS_ONAIR).sum()),
+        "down": int((status == STATUS_DOWN).sum()),
+        "html": html_path.name,
+        "table": table_path.name,
+        "seconds": round(time.perf_counter() - t0, 3),
+    }
+
+
+def _groups(df, by: str, only: list[str] | None) -> dict[str, np.ndarray]:
+    # índice do DF cruzado = posições (RangeIndex)
+    groups = {str(k): v for k, v in df.groupby(by, observed=True, sort=True).indices.items()}
+    groups.pop("", None)
+    if only:
+        # Lant normalizado como nos dados cruzados ("12345.0" -> "12345", espaços, maiúsculas)
+        wanted = {norm_code(v) if by == "Lant" else str(v).strip() for v in only}
+        groups = {k: v for k, v in groups.items() if k in wanted}
+    return groups
+
+
+def run(
+    loc_path: Path,
+    alert_path: Path,
+    out: Path,
+    by: str = "Lant",
+    only: list[str] | None = None,
+    fmt: str = "csv",
+    workers: int | None = None,
+    position: tuple[float, float] | None = None,
+    cluster: bool = False,
+) -> dict:
+    t0 = time.perf_counter()
+    df, _ = merge_workbooks(loc_path.read_bytes(), alert_path.read_bytes())
+    if by not in df.columns:
+        raise ValueError(f"Coluna '{by}' não existe nos dados cruzados. Colunas: {list(df.columns)}")
+
+    dist = order = None
+    if position is not None:
+        dist, order = order_by_distance(df, *position)
+
+    groups = _groups(df, by, only)
+    group_dir = out / _slug(by)
+    group_dir.mkdir(parents=True, exist_ok=True)
+
+    names: dict[str, str] = {}
+    for value in groups:
+        name = _slug(value)
+        while name in names.values():
+            name += "_"
+        names[value] = name
+
+    _DATA.clear()
+    _DATA.update(
+        df=df,
+        dist=dist,
+        order=order,
+        opts={
+            "out": str(group_dir),
+            "format": fmt,
+            "cluster": cluster,
+            "lat": None if position is None else position[0],
+            "lon": None if position is None else position[1],
+        },
+    )
+    load_s = time.perf_counter() - t0
+
+    workers = workers or os.cpu_count() or 1
+    results = []
+    if workers == 1 or len(groups) <= 1:
+        for value, pos in groups.items():
+            results.append(_render_group(value, names[value], pos))
+    else:
+        fork = "fork" in mp.get_all_start_methods()
+        ctx = mp.get_context("fork" if fork else None)
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(groups)),
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(None if fork else dict(_DATA),),
+        ) as pool:
+            futures = [pool.submit(_render_group, v, names[v], pos) for v, pos in groups.items()]
+            results = [f.result() for f in futures]
+
+    summary = {
+        "generated": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "locations": str(loc_path),
+        "alerts": str(alert_path),
+        "by": by,
+        "format": fmt,
+        "position": position,
+        "sites": len(df),
+        "load_seconds": round(load_s, 3),
+        "total_seconds": round(time.perf_counter() - t0, 3),
+        "groups": results,
+    }
+    (group_dir / "index.json").write_text(json.dumps(summary, indent=2, ensure_ascii=False), encoding="utf-8")
+    return summary
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Gera mapas HTML + tabelas de sites por Lant / Issue (sem Streamlit).")
+    p.add_argument("locations", type=Path, help="base de localizações (.xlsx)")
+    p.add_argument("alerts", type=Path, help="base de alertas (.xlsx, sheet 'TOATE ALERTELE')")
+    p.add_argument("--out", type=Path, default=Path("snapshots"))
+    p.add_argument("--by", choices=GROUP_COLUMNS, default="Lant")
+    p.add_argument("--only", nargs="+", help="só estes valores do grupo")
+    p.add_argument("--format", choices=FORMATS, default="csv")
+    p.add_argument("--workers", type=int, help="processos (por omissão: nº de CPUs)")
+    p.add_argument("--lat", type=float, help="posição de partida (ordena por distância e mostra o marcador)")
+    p.add_argument("--lon", type=float)
+    p.add_argument("--cluster", action="store_true", help="agrupar marcadores (MarkerCluster)")
+    args = p.parse_args(argv)
+
+    if (args.lat is None) != (args.lon is None):
+        p.error("--lat e --lon vão juntos")
+    position = None if args.lat is None else (args.lat, args.lon)
+
+    perf.begin_run()
+    summary = run(
+        args.locations,
+        args.alerts,
+        args.out,
+        by=args.by,
+        only=args.only,
+        fmt=args.format,
+        workers=args.workers,
+        position=position,
+        cluster=args.cluster,
+    )
+    perf.end_run()
+
+    print(
+        f"{len(summary['groups'])} grupos ({summary['by']}) em {summary['total_seconds']:.1f}s "
+        f"-> {args.out / _slug(summary['by'])}",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
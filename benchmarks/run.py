@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import os
+
+# medir sempre o caminho frio: sem cache em disco (antes de importar data.*)
+os.environ.setdefault("TASKFORCE_DISK_CACHE", "0")
+
+import argparse
+import gc
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import SIZES, make_workbooks
+from data.data_loader import _distance_order, _read_alerts, _read_locations, dataset_key, load_merged_df, positioned_df
+from map.clustering import ClusterLevels
+from map.map_builder import RENDER_MODES, build_map
+from map.render_cache import map_to_html
+from utils.dispatch import dispatch
+from utils.geo_utils import compute_distances_km
+
+
+# Cada etapa do pipeline da app medida em separado, em N repetições
+# (tempo) + 1 execução sob tracemalloc (pico de memória Python/NumPy).
+# As caches do Streamlit são limpas antes de cada repetição.
+
+DEFAULT_REPEAT = 3
+# centro da caixa sintética
+USER_POS = (45.9, 25.0)
+# equipas para o despacho (posições aleatórias na caixa sintética)
+DISPATCH_TEAMS = 24
+MB = 1024 * 1024
+
+
+def _measure(fn, repeat: int, setup=None) -> tuple[dict, object]:
+    times = []
+    out = None
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        gc.collect()
+        t0 = time.perf_counter()
+        out = fn(arg)
+        times.append(time.perf_counter() - t0)
+
+    arg = setup() if setup else None
+    gc.collect()
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    fn(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = {
+        "seconds_min": round(min(times), 6),
+        "seconds_median": round(statistics.median(times), 6),
+        "peak_mb": round((peak - base) / MB, 3),
+    }
+    return stats, out
+
+
+def _frame_mb(df: pd.DataFrame) -> float:
+    return round(df.memory_usage(deep=True).sum() / MB, 3)
+
+
+def bench_size(n_sites: int, repeat: int = DEFAULT_REPEAT, modes=("geojson",), seed: int = 0) -> dict:
+    t0 = time.perf_counter()
+    loc_bytes, alert_bytes, info = make_workbooks(n_sites, seed=seed)
+    info["generate_seconds"] = round(time.perf_counter() - t0, 3)
+    stages = {}
+
+    stages["read_locations"], df_loc = _measure(lambda _: _read_locations(loc_bytes), repeat, _read_locations.clear)
+    stages["read_locations"]["frame_mb"] = _frame_mb(df_loc)
+    stages["read_alerts"], df_alert = _measure(lambda _: _read_alerts(alert_bytes), repeat, _read_alerts.clear)
+    stages["read_alerts"]["frame_mb"] = _frame_mb(df_alert)
+
+    # leituras já em cache -> só o cruzamento
+    stages["merge"], (df_merged, _) = _measure(
+        lambda _: load_merged_df(loc_bytes, alert_bytes), repeat, load_merged_df.clear
+    )
+    stages["merge"]["frame_mb"] = _frame_mb(df_merged)
+    stages["merge"]["rows"] = len(df_merged)
+
+    key = dataset_key(loc_bytes, alert_bytes)
+    stages["position"], df = _measure(
+        lambda _: positioned_df(key, df_merged, *USER_POS), repeat, _distance_order.clear
+    )
+
+    lats = df_merged["Latitudine"].to_numpy()
+    lons = df_merged["Longitudine"].to_numpy()
+    for method in ("ellipsoidal", "haversine"):
+        stages[f"compute_distances_km[{method}]"], _ = _measure(
+            lambda _: compute_distances_km(*USER_POS, lats, lons, method=method), repeat
+        )
+
+    rng = np.random.default_rng(seed)
+    team_lats = rng.uniform(43.6, 48.2, DISPATCH_TEAMS)
+    team_lons = rng.uniform(20.3, 29.7, DISPATCH_TEAMS)
+    capacity = -(-len(lats) // DISPATCH_TEAMS)
+    for name, cap in (("nearest", None), ("balanced", capacity)):
+        stages[f"dispatch[{name}]"], _ = _measure(
+            lambda _, cap=cap: dispatch(lats, lons, team_lats, team_lons, capacity=cap), repeat
+        )
+
+    color_codes = df_merged["_cor"].cat.codes.to_numpy()
+    stages["cluster_levels"], levels = _measure(
+        lambda _: ClusterLevels(lats, lons, color_codes, codes=df_merged["Cod Site"].to_numpy()), repeat
+    )
+
+    for mode in modes:
+        def build(_, mode=mode):
+            return build_map(df, *USER_POS, use_cluster=True, mode=mode, cluster_levels=levels if mode == "geojson" else None)
+
+        stages[f"build_map[{mode}]"], _ = _measure(build, repeat)
+        stages[f"map_html[{mode}]"], html = _measure(map_to_html, repeat, setup=lambda: build(None))
+        stages[f"map_html[{mode}]"]["html_mb"] = round(len(html.encode("utf-8")) / MB, 3)
+
+    return {**info, "stages": stages}
+
+
+def compare(current: dict, previous: dict) -> list[str]:
+    """Linhas 'etapa: antes -> agora (x razão)' para os tamanhos em comum."""
+    prev = {r["sites"]: r["stages"] for r in previous.get("results", [])}
+    lines = []
+    for r in current["results"]:
+        old = prev.get(r["sites"])
+        if not old:
+            continue
+        for stage, s in r["stages"].items():
+            if stage in old and old[stage]["seconds_min"] > 0:
+                ratio = s["seconds_min"] / old[stage]["seconds_min"]
+                lines.append(
+                    f"{r['sites']:>7} {stage:<34} {old[stage]['seconds_min']:>9.4f}s -> {s['seconds_min']:>9.4f}s  x{ratio:.2f}"
+                )
+    return lines
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark do pipeline (leitura, cruzamento, distâncias, mapa).")
+    p.add_argument("--sites", type=int, nargs="+", default=list(SIZES))
+    p.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    p.add_argument("--modes", nargs="+", choices=RENDER_MODES, default=["geojson"],
+                   help="modos do build_map ('markers' é lento acima de ~10k sites)")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--out", type=Path, help="ficheiro JSON (por omissão: stdout)")
+    p.add_argument("--compare", type=Path, help="JSON de uma execução anterior")
+    args = p.parse_args(argv)
+
+    results = []
+    for n in args.sites:
+        print(f"[bench] {n} sites...", file=sys.stderr)
+        results.append(bench_size(n, repeat=args.repeat, modes=args.modes, seed=args.seed))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        args.out.write_text(text, encoding="utf-8")
+    else:
+        print(text)
+
+    if args.compare:
+        for line in compare(report, json.loads(args.compare.read_text(encoding="utf-8"))):
+            print(line, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
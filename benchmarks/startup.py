@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+
+# Arranque a frio: cada alvo é importado num interpretador novo com
+# `python -X importtime`, N vezes; por módulo fica a mediana do tempo próprio
+# e do acumulado (com os submódulos). Serve para ver o que cada etapa custa
+# a carregar e apanhar regressões (p.ex. um import pesado que volta ao topo
+# da app).
+#
+#   python -m benchmarks.startup
+#   python -m benchmarks.startup --out startup.json --compare old.json --check
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# app = página inicial (uploads); o resto = o que cada etapa importa ao 1.º uso
+DEFAULT_TARGETS = ("app", "data.data_loader", "map.map_builder")
+DEFAULT_REPEAT = 5
+DEFAULT_TOP = 15
+
+# pesados que `import app` não pode trazer (entram na etapa que os usa)
+DEFERRED = ("pandas", "numpy", "pyarrow", "folium", "branca", "jinja2", "geopy", "streamlit_geolocation")
+
+_LINE_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| \s*(\S+)$")
+
+
+def import_times(target: str) -> dict[str, tuple[int, int]]:
+    """{módulo: (próprio µs, acumulado µs)} de um `import target` num processo novo."""
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [str(ROOT), os.environ.get("PYTHONPATH")]))}
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {target} falhou:\n{proc.stderr[-2000:]}")
+
+    out = {}
+    for line in proc.stderr.splitlines():
+        m = _LINE_RE.match(line)
+        if m:
+            out[m.group(3)] = (int(m.group(1)), int(m.group(2)))
+    return out
+
+
+def bench_target(target: str, repeat: int = DEFAULT_REPEAT, top: int = DEFAULT_TOP) -> dict:
+    runs = [import_times(target) for _ in range(repeat)]
+    totals = [r[target][1] for r in runs]
+
+    self_us = defaultdict(list)
+    cum_us = defaultdict(list)
+    for r in runs:
+        for mod, (s, c) in r.items():
+            self_us[mod].append(s)
+            cum_us[mod].append(c)
+    med_self = {m: statistics.median(v) for m, v in self_us.items()}
+    med_cum = {m: statistics.median(v) for m, v in cum_us.items()}
+
+    # por pacote de topo (pandas, folium, ...): soma dos tempos próprios
+    packages = defaultdict(float)
+    for mod, us in med_self.items():
+        packages[mod.split(".")[0]] += us
+
+    return {
+        "target": target,
+        "seconds_min": round(min(totals) / 1e6, 4),
+        "seconds_median": round(statistics.median(totals) / 1e6, 4),
+        "modules_loaded": len(med_self),
+        "packages_ms": {p: round(us / 1e3, 1) for p, us in sorted(packages.items(), key=lambda kv: -kv[1])},
+        "modules": [
+            {"module": m, "self_ms": round(med_self[m] / 1e3, 2), "cumulative_ms": round(med_cum[m] / 1e3, 2)}
+            for m in sorted(med_self, key=lambda m: -med_self[m])[:top]
+        ],
+        "deferred_loaded": sorted(p for p in DEFERRED if p in packages),
+    }
+
+
+def compare(current: dict, previous: dict) -> list[str]:
+    """Linhas 'alvo / pacote: antes -> agora' para os alvos em comum."""
+    prev = {r["target"]: r for r in previous.get("results", [])}
+    lines = []
+    for r in current["results"]:
+        old = prev.get(r["target"])
+        if not old:
+            continue
+        ratio = r["seconds_min"] / old["seconds_min"] if old["seconds_min"] else float("nan")
+        lines.append(f"{r['target']:<24} {old['seconds_min']:>8.3f}s -> {r['seconds_min']:>8.3f}s  x{ratio:.2f}")
+        for pkg in sorted(set(r["packages_ms"]) | set(old["packages_ms"])):
+            a, b = old["packages_ms"].get(pkg, 0.0), r["packages_ms"].get(pkg, 0.0)
+            if abs(b - a) >= 5:
+                lines.append(f"  {pkg:<22} {a:>8.1f}ms -> {b:>8.1f}ms")
+    return lines
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Custo de import (arranque a frio) por módulo.")
+    p.add_argument("--targets", nargs="+", default=list(DEFAULT_TARGETS))
+    p.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    p.add_argument("--top", type=int, default=DEFAULT_TOP, help="módulos mais caros a listar")
+    p.add_argument("--out", type=Path, help="ficheiro JSON (por omissão: stdout)")
+    p.add_argument("--compare", type=Path, help="JSON de uma execução anterior")
+    p.add_argument("--check", action="store_true",
+                   help=f"sai com erro se `import app` carregar algum de {', '.join(DEFERRED)}")
+    args = p.parse_args(argv)
+
+    results = []
+    for target in args.targets:
+        print(f"[startup] {target}...", file=sys.stderr)
+        results.append(bench_target(target, repeat=args.repeat, top=args.top))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        args.out.write_text(text, encoding="utf-8")
+    else:
+        print(text)
+
+    if args.compare:
+        for line in compare(report, json.loads(args.compare.read_text(encoding="utf-8"))):
+            print(line, file=sys.stderr)
+
+    if args.check:
+        app = next((r for r in results if r["target"] == "app"), None) or bench_target("app", repeat=1)
+        if app["deferred_loaded"]:
+            print(f"[startup] `import app` carrega: {', '.join(app['deferred_loaded'])}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
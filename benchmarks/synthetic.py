@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import argparse
+import io
+from pathlib import Path
+
+import numpy as np
+from openpyxl import Workbook
+
+from data.data_loader import _resolve_alerts, _resolve_locations
+from data.xlsx_reader import normalize_header
+
+
+# Livros sintéticos com o formato dos reais: base de localizações (1 folha)
+# e alertas com a folha "TOATE ALERTELE" depois de uma folha de resumo.
+# Os cabeçalhos variam (maiúsculas, espaços, quebras de linha, unidades)
+# como nos exports, e há colunas extra que os resolvers têm de ignorar.
+
+SIZES = (1_000, 10_000, 100_000)
+
+# caixa aproximada da Roménia
+LAT_RANGE = (43.6, 48.2)
+LON_RANGE = (20.3, 29.7)
+
+ALERT_RATIO = 0.8
+ORPHAN_RATIO = 0.02
+SITES_PER_LANT = 400
+
+LOC_HEADERS = {
+    "Cod Site": ["Cod Site", " COD SITE ", "cod  site", "COD\nSITE"],
+    "Latitudine": ["Latitudine", "LATITUDINE\n(WGS84)", " latitude ", "Lat"],
+    "Longitudine": ["Longitudine", "LONGITUDINE (WGS84)", "longitude", "Lng"],
+}
+ALERT_HEADERS = {
+    "Cod Site": ["Site code", "SITE CODE ", "site\ncode", "Cod Site"],
+    "Issue": ["Issue", "ISSUE", " issue "],
+    "Tip Alarma": ["Tip Alarma", "TIP ALARMA", "Tip\nAlarma"],
+    "GW": ["GW", "GW/NGW", "GW / NGW"],
+    "Comments": ["Comments", "COMMENTS ", "comments"],
+    "Lant": ["Lant", "LANT CODE", "Lant\ncode"],
+}
+
+ISSUES = [
+    "Power", "Transmission", "Theft  of battery", "FALLEN TOWER", "Forbidden tower",
+    "INFRA", "Fallen mast", "Cooling", "Access", "",
+]
+TIPS = ["OnAir", "ONAIR", "Down", "down ", "Other", "Pending"]
+COMMENTS = ["", "", "Gerador avariado, ação amanhã", "Baterie furată  ", "Acces interzis\nproprietar", "Técnico no local"]
+
+
+def _messy(rng: np.random.Generator, variants: dict[str, list[str]]) -> dict[str, str]:
+    return {k: v[int(rng.integers(len(v)))] for k, v in variants.items()}
+
+
+def _workbook(sheets: list[tuple[str, list[str], list[list]]]) -> bytes:
+    wb = Workbook(write_only=True)
+    for name, header, rows in sheets:
+        ws = wb.create_sheet(name)
+        ws.append(header)
+        for r in rows:
+            ws.append(r)
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+def make_workbooks(n_sites: int, seed: int = 0) -> tuple[bytes, bytes, dict]:
+    """(bytes de localizações, bytes de alertas, info) para `n_sites` sites."""
+    rng = np.random.default_rng(seed)
+    codes = np.array([f"BV{i:06d}" for i in range(n_sites)], dtype=object)
+
+    # --- localizações ---
+    loc_h = _messy(rng, LOC_HEADERS)
+    lats = rng.uniform(*LAT_RANGE, n_sites).round(6)
+    lons = rng.uniform(*LON_RANGE, n_sites).round(6)
+    judete = np.array(["Brașov", "Cluj", "Iași", "Timiș", "Constanța"], dtype=object)
+    loc_header = ["Nr", loc_h["Cod Site"], "Site name", "Județ", loc_h["Latitudine"], loc_h["Longitudine"], "Altitudine"]
+    loc_rows = [
+        [i + 1, c, f"Site {c}", j, la, lo, int(a)]
+        for i, (c, j, la, lo, a) in enumerate(zip(
+            codes, judete[rng.integers(len(judete), size=n_sites)], lats, lons, rng.integers(0, 2000, n_sites),
+        ))
+    ]
+    # linhas sem coordenadas (descartadas no parse)
+    for i in rng.choice(n_sites, size=max(1, n_sites // 500), replace=False):
+        loc_rows[i][4] = None
+
+    # --- alertas: a maioria dos sites + alguns códigos sem localização ---
+    alerted = codes[rng.random(n_sites) < ALERT_RATIO]
+    orphans = np.array([f"XX{i:06d}" for i in range(int(n_sites * ORPHAN_RATIO))], dtype=object)
+    a_codes = np.concatenate([alerted, orphans])
+    m = len(a_codes)
+
+    al_h = _messy(rng, ALERT_HEADERS)
+    n_lants = max(1, n_sites // SITES_PER_LANT)
+    lant = (1000 + rng.integers(n_lants, size=m)).astype(float)
+    lant_vals = [None if rng.random() < 0.05 else v for v in lant.tolist()]
+    issues = np.array(ISSUES, dtype=object)[rng.integers(len(ISSUES), size=m)]
+    tips = np.array(TIPS, dtype=object)[rng.integers(len(TIPS), size=m)]
+    gws = np.where(rng.random(m) < 0.15, "GW", "NGW")
+    comments = np.array(COMMENTS, dtype=object)[rng.integers(len(COMMENTS), size=m)]
+
+    al_header = [al_h["Cod Site"], "Regiune", al_h["Issue"], al_h["Tip Alarma"], al_h["GW"], al_h["Comments"], al_h["Lant"], "Data"]
+    al_rows = [
+        [c, "Centru", i or None, t, g, k or None, l, "2024-01-01"]
+        for c, i, t, g, k, l in zip(a_codes, issues, tips, gws, comments, lant_vals)
+    ]
+
+    # os resolvers têm de encontrar todas as colunas apesar do ruído
+    assert set(_resolve_locations(normalize_header(loc_header)).values()) == set(LOC_HEADERS)
+    assert set(_resolve_alerts(normalize_header(al_header)).values()) == set(ALERT_HEADERS)
+
+    loc_bytes = _workbook([("Baza", loc_header, loc_rows)])
+    alert_bytes = _workbook([
+        ("Sumar", ["Total"], [[m]]),
+        ("TOATE ALERTELE", al_header, al_rows),
+    ])
+    info = {
+        "sites": n_sites,
+        "alerts": m,
+        "loc_headers": loc_h,
+        "alert_headers": al_h,
+        "loc_bytes": len(loc_bytes),
+        "alert_bytes": len(alert_bytes),
+    }
+    return loc_bytes, alert_bytes, info
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Gera livros sintéticos (localizações + TOATE ALERTELE).")
+    p.add_argument("--sites", type=int, nargs="+", default=list(SIZES))
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--out-dir", type=Path, default=Path("."))
+    args = p.parse_args(argv)
+
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+    for n in args.sites:
+        loc, alert, _ = make_workbooks(n, seed=args.seed)
+        (args.out_dir / f"locatii_{n}.xlsx").write_bytes(loc)
+        (args.out_dir / f"alerte_{n}.xlsx").write_bytes(alert)
+        print(f"{n} sites -> {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import threading
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from data.canonical import ROW_COL
+
+
+# Atualização incremental do ficheiro de alertas (re-exportado várias vezes
+# por dia com poucas linhas diferentes). As linhas com a mesma assinatura
+# (xlsx_reader.SheetRows) que na versão anterior reaproveitam a linha já
+# normalizada; só as restantes são convertidas. O DF cruzado mantém as
+# linhas que não mudaram, pela mesma ordem, e acrescenta as novas no fim:
+# MergedDelta descreve isso para remendar distâncias e clusters.
+
+CHANGE_COLUMNS = ["Issue", "Tip Alarma", "GW", "Comments", "Lant"]
+
+ADDED = "Novo"
+REMOVED = "Removido"
+CHANGED = "Alterado"
+
+
+class HeaderChanged(ValueError):
+    """O cabeçalho da folha mudou: as linhas não são comparáveis, recarregar tudo."""
+
+
+def concat_frames(a: pd.DataFrame, b: pd.DataFrame) -> pd.DataFrame:
+    """Concatena mantendo as colunas categóricas (união das categorias)."""
+    cols = {}
+    for c in a.columns:
+        if isinstance(a[c].dtype, pd.CategoricalDtype):
+            cols[c] = pd.Series(union_categoricals([a[c], b[c]], ignore_order=True))
+        else:
+            cols[c] = pd.concat([a[c], b[c]], ignore_index=True)
+    return pd.DataFrame(cols)
+
+
+class AlertChanges:
+    """Diferenças por Cod Site entre duas versões dos alertas."""
+
+    def __init__(self, added: pd.DataFrame, removed: pd.DataFrame, changed: pd.DataFrame):
+        self.added = added
+        self.removed = removed
+        # formato longo: Cod Site, Coluna, Antes, Depois
+        self.changed = changed
+
+    def __bool__(self) -> bool:
+        return bool(len(self.added) or len(self.removed) or len(self.changed))
+
+    def summary(self) -> str:
+        return (
+            f"{len(self.added)} novos · {len(self.removed)} removidos · "
+            f"{self.changed['Cod Site'].nunique() if len(self.changed) else 0} alterados"
+        )
+
+    def changelog(self) -> pd.DataFrame:
+        def whole(df, kind, side):
+            desc = df["Issue"].astype(str) + " · " + df["Tip Alarma"].astype(str)
+            return pd.DataFrame({
+                "Cod Site": df["Cod Site"].astype(str).to_numpy(),
+                "Mudança": kind,
+                "Coluna": "",
+                "Antes": desc.to_numpy() if side == "Antes" else "",
+                "Depois": desc.to_numpy() if side == "Depois" else "",
+            })
+
+        changed = self.changed.assign(**{"Mudança": CHANGED})
+        out = pd.concat(
+            [whole(self.added, ADDED, "Depois"), whole(self.removed, REMOVED, "Antes"), changed],
+            ignore_index=True,
+        )
+        return out[["Cod Site", "Mudança", "Coluna", "Antes", "Depois"]].sort_values(
+            ["Cod Site", "Mudança"], kind="stable", ignore_index=True
+        )
+
+
+def _classify(removed: pd.DataFrame, new: pd.DataFrame) -> AlertChanges:
+    # chave = (Cod Site, nº da ocorrência) para códigos repetidos
+    r = removed.assign(_k=removed.groupby("Cod Site", observed=True).cumcount())
+    n = new.assign(_k=new.groupby("Cod Site", observed=True).cumcount())
+    keys = ["Cod Site", "_k"]
+    cols = [c for c in CHANGE_COLUMNS if c in r.columns and c in n.columns]
+
+    r = r.astype({c: str for c in ["Cod Site", *cols]})
+    n = n.astype({c: str for c in ["Cod Site", *cols]})
+    both = r[keys + cols].merge(n[keys + cols], on=keys, suffixes=(" antes", " depois"))
+    matched = pd.MultiIndex.from_frame(both[keys])
+
+    rows = []
+    for c in cols:
+        diff = both[both[f"{c} antes"] != both[f"{c} depois"]]
+        rows.append(pd.DataFrame({
+            "Cod Site": diff["Cod Site"].to_numpy(),
+            "Coluna": c,
+            "Antes": diff[f"{c} antes"].to_numpy(),
+            "Depois": diff[f"{c} depois"].to_numpy(),
+        }))
+    changed = pd.concat(rows, ignore_index=True) if rows else pd.DataFrame(columns=["Cod Site", "Coluna", "Antes", "Depois"])
+
+    def only(df):
+        k = pd.MultiIndex.from_frame(df[keys])
+        return df[~k.isin(matched)].drop(columns="_k")
+
+    return AlertChanges(added=only(n), removed=only(r), changed=changed)
+
+
+def refresh_alerts(
+    old: pd.DataFrame,
+    old_header: list[str],
+    old_rows: list[tuple[int, bytes]],
+    new_header: list[str],
+    new_rows: list[tuple[int, bytes]],
+    read: Callable[[list[int]], pd.DataFrame],
+):
+    """Nova versão dos alertas a partir da anterior.
+
+    `old` = alertas normalizados da versão anterior (com ROW_COL);
+    `*_rows` = (nº da linha, assinatura); `read(números)` normaliza só essas linhas.
+    Devolve (alertas novos, AlertChanges, {linha antiga: linha nova} das que não
+    mudaram, linhas novas/alteradas já normalizadas).
+    """
+    if old_header != new_header:
+        raise HeaderChanged("Cabeçalho diferente da versão anterior.")
+
+    pool: dict[bytes, list[int]] = {}
+    for number, sig in old_rows:
+        pool.setdefault(sig, []).append(number)
+
+    parsed_before = set(old[ROW_COL].tolist())
+    renumber: dict[int, int] = {}
+    unknown: list[int] = []
+    for number, sig in new_rows:
+        same = pool.get(sig)
+        if same:
+            old_number = same.pop(0)
+            # linha igual que antes foi descartada (vazia / sem código) -> descartada outra vez
+            if old_number in parsed_before:
+                renumber[old_number] = number
+        else:
+            unknown.append(number)
+
+    delta = read(unknown) if unknown else old.iloc[:0]
+
+    keep = old[ROW_COL].isin(renumber).to_numpy()
+    kept = old[keep].reset_index(drop=True)
+    kept[ROW_COL] = kept[ROW_COL].map(renumber).astype("int64")
+
+    alerts = concat_frames(kept, delta.reset_index(drop=True))
+    changes = _classify(old[~keep], delta)
+    return alerts, changes, renumber, delta
+
+
+class MergedDelta:
+    """Como o DF cruzado novo deriva do anterior: linhas `keep` (posições antigas) + `n_added` no fim."""
+
+    def __init__(self, prev_key: str, prev_df: pd.DataFrame, keep: np.ndarray, n_added: int):
+        self.prev_key = prev_key
+        self.prev_df = prev_df
+        self.keep = keep
+        self.n_added = n_added
+
+    @property
+    def added(self) -> np.ndarray:
+        return np.arange(len(self.keep), len(self.keep) + self.n_added)
+
+
+def patch_merged(
+    prev_key: str,
+    prev: pd.DataFrame,
+    df_loc: pd.DataFrame,
+    renumber: dict[int, int],
+    delta: pd.DataFrame,
+) -> tuple[pd.DataFrame, MergedDelta]:
+    keep = np.flatnonzero(prev[ROW_COL].isin(renumber).to_numpy())
+    kept = prev.take(keep).reset_index(drop=True)
+    kept[ROW_COL] = kept[ROW_COL].map(renumber).astype("int64")
+
+    added = df_loc.merge(delta, on="Cod Site", how="inner")[list(prev.columns)]
+    merged = concat_frames(kept, added)
+    return merged, MergedDelta(prev_key, prev, keep, len(added))
+
+
+class AlertVersion:
+    """Versão carregada (cruzada) dos alertas para uma base de localizações."""
+
+    def __init__(self, key, alert_bytes, alerts, merged, changes=None, delta=None, signatures=None):
+        self.key = key
+        # os bytes só ficam enquanto as assinaturas não forem calculadas
+        self.alert_bytes = alert_bytes if signatures is None else None
+        self.alerts = alerts
+        self.merged = merged
+        self.issues_all = sorted(x for x in merged["Issue"].unique().tolist() if x)
+        # inclui os bytes do ficheiro: trocados depois pelas assinaturas (mais pequenas)
+        self.nbytes = int(
+            merged.memory_usage(deep=True).sum() + alerts.memory_usage(deep=True).sum() + len(self.alert_bytes or b"")
+        )
+        self.changes = changes
+        self.delta = delta
+        # (cabeçalho, [(nº da linha, assinatura)]): calculado só quando for preciso comparar
+        self.signatures = signatures
+        self._lock = threading.Lock()
+
+    def row_signatures(self, compute: Callable[[bytes], tuple]) -> tuple:
+        """`signatures`, calculadas uma só vez com compute(alert_bytes).
+
+        Vários refreshes a partir desta versão podem correr em paralelo (watcher
+        + upload): os bytes só saem depois de as assinaturas ficarem guardadas.
+        """
+        with self._lock:
+            if self.signatures is None:
+                self.signatures = compute(self.alert_bytes)
+                self.alert_bytes = None
+            return self.signatures
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import re
+
+import numpy as np
+import pandas as pd
+
+
+# Normalização feita UMA vez no load (vetorizada); app e mapa reutilizam
+# as colunas já tipadas em vez de normalizar célula a célula em cada rerun.
+
+BLACK_ISSUES = {
+    "FALLEN TOWER",
+    "FORBIDDEN TOWER",
+    "FALLEN MAST",
+    "INFRA",
+}
+
+STATUS_ONAIR = "ONAIR"
+STATUS_DOWN = "DOWN"
+STATUS_OTHER = "OUTRO"
+STATUSES = [STATUS_ONAIR, STATUS_DOWN, STATUS_OTHER]
+
+# ordem = código da categoria
+COLORS = ["green", "red", "black", "gray"]
+
+# Colunas internas (derivadas) começam por "_" e não aparecem na tabela
+COLOR_COL = "_cor"
+STATUS_COL = "_estado"
+GW_COL = "_gw"
+# nº da linha Excel do alerta (identifica a linha entre versões do ficheiro)
+ROW_COL = "_row"
+# modo despacho: índice da equipa atribuída (cor = TEAM_COLORS[i % len]);
+# -1 = sem equipa (só os sites DOWN são distribuídos), cor NO_TEAM_COLOR
+TEAM_COL = "_equipa"
+TEAM_COLORS = [
+    "#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b",
+    "#e377c2", "#17becf", "#bcbd22", "#393b79", "#ad494a", "#7f7f7f",
+]
+NO_TEAM_COLOR = "#d9d9d9"
+# cor por tempo seguido em DOWN (índice em data.history.HISTORY_COLORS)
+HISTORY_COL = "_historico"
+
+CATEGORY_COLS = ["Issue", "Tip Alarma", "GW"]
+
+_CODE_FLOAT_RE = re.compile(r"^(\d+)\.0$")
+
+
+def norm_code(x) -> str:
+    """Normaliza códigos tipo Lant vindos do Excel: '12345.0' -> '12345', trim, uppercase."""
+    if x is None or (isinstance(x, float) and np.isnan(x)):
+        return ""
+    s = re.sub(r"\s+", " ", str(x)).strip().upper()
+    return _CODE_FLOAT_RE.sub(r"\1", s)
+
+
+def norm_text_series(s: pd.Series) -> pd.Series:
+    s = s.astype(object).where(s.notna(), "")
+    return s.astype(str).str.replace(r"\s+", " ", regex=True).str.strip()
+
+
+def norm_code_series(s: pd.Series) -> pd.Series:
+    return norm_text_series(s).str.upper().str.replace(_CODE_FLOAT_RE, r"\1", regex=True)
+
+
+def _per_category(s: pd.Series, fn) -> np.ndarray:
+    # calcula sobre as categorias (poucas) e espalha pelas linhas via códigos
+    cat = s.astype("category")
+    vals = [fn(str(c).upper()) for c in cat.cat.categories] + [fn("")]
+    return np.asarray(vals, dtype=object)[cat.cat.codes.to_numpy()]
+
+
+def add_status_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Cor / estado / GW pré-calculados (idempotente)."""
+    if COLOR_COL in df.columns and STATUS_COL in df.columns and GW_COL in df.columns:
+        return df
+
+    df = df.copy()
+    status = _per_category(df["Tip Alarma"], lambda u: u if u in (STATUS_ONAIR, STATUS_DOWN) else STATUS_OTHER)
+    black = _per_category(df["Issue"], lambda u: u in BLACK_ISSUES).astype(bool)
+
+    color = np.where(
+        black,
+        "black",
+        np.select([status == STATUS_ONAIR, status == STATUS_DOWN], ["green", "red"], default="gray"),
+    )
+
+    df[STATUS_COL] = pd.Categorical(status, categories=STATUSES)
+    df[COLOR_COL] = pd.Categorical(color, categories=COLORS)
+    df[GW_COL] = _per_category(df["GW"], lambda u: u == "GW").astype(bool)
+    return df
+
+
+def canonicalize_alerts(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    df["Cod Site"] = norm_code_series(df["Cod Site"])
+    for c in CATEGORY_COLS:
+        df[c] = norm_text_series(df[c]).astype("category")
+    if "Comments" in df.columns:
+        df["Comments"] = norm_text_series(df["Comments"])
+    if "Lant" in df.columns:
+        df["Lant"] = norm_code_series(df["Lant"]).astype("category")
+    return add_status_columns(df)
+
+
+def display_columns(df: pd.DataFrame) -> list[str]:
+    return [c for c in df.columns if not str(c).startswith("_")]
@@ -1,27 +1,37 @@
 from __future__ import annotations
 
-import re
-from io import BytesIO
+import hashlib
+import sqlite3
+
+import numpy as np
 import pandas as pd
 import streamlit as st
 
-from utils.geo_utils import compute_distances_km
+from data.alert_refresh import AlertChanges, AlertVersion, MergedDelta, patch_merged, refresh_alerts
+from data.canonical import ROW_COL, canonicalize_alerts, norm_code_series
+from data.dataset_store import DatasetStore, Lease
+from data.disk_cache import CACHE_DIR, cached_frame, clear_disk_cache
+from data.history import ENABLED as HISTORY_ENABLED, HistoryStore
+from data.indexes import DatasetIndex, MetricsCube, TextIndex
+from data.xlsx_reader import SheetRows, read_projected
+from utils import perf
+from utils.geo_utils import distances_km
+from utils.spatial_index import SiteIndex
+from utils.travel_time import ROUTING_LIMIT, provider_from_env, travel_from
 
 
-def _normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
-    df.columns = (
-        df.columns.astype(str)
-        .str.replace("\n", " ", regex=False)
-        .str.replace("\r", " ", regex=False)
-        .str.replace(r"\s+", " ", regex=True)
-        .str.strip()
-    )
-    return df
+# Subir sempre que a normalização de _parse_* mudar (invalida a cache em disco)
+PARSER_VERSION = "4"
+
+ALERT_SHEET = "TOATE ALERTELE"
 
+# Posição do utilizador: arredondamento + nº de posições guardadas (LRU)
+POSITION_DECIMALS = 4
+POSITION_CACHE_SIZE = 32
 
-def _pick_col(df: pd.DataFrame, candidates: list[str]) -> str | None:
-    cols = list(df.columns)
+
+def _pick_col(df: pd.DataFrame | list[str], candidates: list[str]) -> str | None:
+    cols = list(df.columns) if isinstance(df, pd.DataFrame) else list(df)
     cols_upper = {c.upper().strip(): c for c in cols}
 
     for cand in candidates:
@@ -38,102 +48,339 @@ def _pick_col(df: pd.DataFrame, candidates: list[str]) -> str | None:
     return None
 
 
-def _norm_cell(x) -> str:
-    s = "" if x is None else str(x)
-    s = s.replace("\n", " ").replace("\r", " ")
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
-
-
-@st.cache_data(show_spinner=False)
-def _read_locations(loc_bytes: bytes) -> pd.DataFrame:
-    df = pd.read_excel(BytesIO(loc_bytes))
-    df = _normalize_columns(df)
-
-    cod = _pick_col(df, ["Cod Site", "COD SITE", "CODSITE", "SITE", "SITE CODE", "CODE"])
-    lat = _pick_col(df, ["Latitudine", "LATITUDINE", "LATITUDE", "LAT"])
-    lon = _pick_col(df, ["Longitudine", "LONGITUDINE", "LONGITUDE", "LON", "LNG"])
+def _resolve_locations(cols: list[str]) -> dict[str, str]:
+    cod = _pick_col(cols, ["Cod Site", "COD SITE", "CODSITE", "SITE", "SITE CODE", "CODE"])
+    lat = _pick_col(cols, ["Latitudine", "LATITUDINE", "LATITUDE", "LAT"])
+    lon = _pick_col(cols, ["Longitudine", "LONGITUDINE", "LONGITUDE", "LON", "LNG"])
 
     if not cod or not lat or not lon:
-        raise ValueError(f"Base de localizações inválida. Colunas: {list(df.columns)}")
-
-    df = df.rename(columns={cod: "Cod Site", lat: "Latitudine", lon: "Longitudine"})
-    df = df.dropna(subset=["Cod Site", "Latitudine", "Longitudine"])
+        raise ValueError(f"Base de localizações inválida. Colunas: {cols}")
 
-    df["Cod Site"] = df["Cod Site"].astype(str).str.strip().str.upper()
-    df["Latitudine"] = pd.to_numeric(df["Latitudine"], errors="coerce")
-    df["Longitudine"] = pd.to_numeric(df["Longitudine"], errors="coerce")
-    df = df.dropna(subset=["Latitudine", "Longitudine"])
+    return {cod: "Cod Site", lat: "Latitudine", lon: "Longitudine"}
 
-    return df
 
-
-@st.cache_data(show_spinner=False)
-def _read_alerts(alert_bytes: bytes) -> pd.DataFrame:
-    xls = pd.ExcelFile(BytesIO(alert_bytes))
-
-    sheet = None
-    for name in xls.sheet_names:
-        if str(name).strip().upper() == "TOATE ALERTELE":
-            sheet = name
-            break
-    if sheet is None:
-        sheet = xls.sheet_names[0]
-
-    df = pd.read_excel(BytesIO(alert_bytes), sheet_name=sheet)
-    df = _normalize_columns(df)
-
-    cod = _pick_col(df, ["Site code", "SITE CODE", "Cod Site", "COD SITE", "SITE", "CODE"])
-    issue = _pick_col(df, ["Issue", "ISSUE"])
-    tip = _pick_col(df, ["Tip Alarma", "TIP ALARMA", "STATUS", "TYPE"])
-    gw = _pick_col(df, ["GW", "GW/NGW", "GW / NGW"])
-    comments = _pick_col(df, ["Comments", "COMMENT", "NOTES", "NOTE", "OBS"])
-    lant = _pick_col(df, ["Lant", "LANT", "LANT CODE", "LANTCODE"])
+def _resolve_alerts(cols: list[str]) -> dict[str, str]:
+    cod = _pick_col(cols, ["Site code", "SITE CODE", "Cod Site", "COD SITE", "SITE", "CODE"])
+    issue = _pick_col(cols, ["Issue", "ISSUE"])
+    tip = _pick_col(cols, ["Tip Alarma", "TIP ALARMA", "STATUS", "TYPE"])
+    gw = _pick_col(cols, ["GW", "GW/NGW", "GW / NGW"])
+    comments = _pick_col(cols, ["Comments", "COMMENT", "NOTES", "NOTE", "OBS"])
+    lant = _pick_col(cols, ["Lant", "LANT", "LANT CODE", "LANTCODE"])
 
     if not cod or not issue or not tip or not gw:
-        raise ValueError(f"Base de alertas inválida. Colunas: {list(df.columns)}")
+        raise ValueError(f"Base de alertas inválida. Colunas: {cols}")
 
     rename_map = {cod: "Cod Site", issue: "Issue", tip: "Tip Alarma", gw: "GW"}
     if comments:
         rename_map[comments] = "Comments"
     if lant:
         rename_map[lant] = "Lant"
+    return rename_map
+
 
-    df = df.rename(columns=rename_map)
-    df = df.dropna(subset=["Cod Site"])
+def _parse_locations(loc_bytes: bytes) -> pd.DataFrame:
+    with perf.span("xlsx.locations", bytes=len(loc_bytes)):
+        df = read_projected(loc_bytes, _resolve_locations)
 
-    df["Cod Site"] = df["Cod Site"].astype(str).str.strip().str.upper()
-    df["Issue"] = df["Issue"].apply(_norm_cell)
-    df["Tip Alarma"] = df["Tip Alarma"].apply(_norm_cell)
-    df["GW"] = df["GW"].apply(_norm_cell)
+    with perf.span("normalize.locations", rows=len(df)):
+        df = df.dropna(subset=["Cod Site", "Latitudine", "Longitudine"])
 
-    if "Comments" in df.columns:
-        df["Comments"] = df["Comments"].apply(_norm_cell)
-    if "Lant" in df.columns:
-        df["Lant"] = df["Lant"].apply(_norm_cell)
+        df["Cod Site"] = norm_code_series(df["Cod Site"])
+        df["Latitudine"] = pd.to_numeric(df["Latitudine"], errors="coerce")
+        df["Longitudine"] = pd.to_numeric(df["Longitudine"], errors="coerce")
+        df = df.dropna(subset=["Latitudine", "Longitudine"])
 
-    cols = ["Cod Site", "Issue", "Tip Alarma", "GW"]
-    if "Comments" in df.columns:
-        cols.append("Comments")
-    if "Lant" in df.columns:
-        cols.append("Lant")
+    return df
+
+
+def _parse_alerts(alert_bytes: bytes) -> pd.DataFrame:
+    with perf.span("xlsx.alerts", bytes=len(alert_bytes)):
+        df = read_projected(alert_bytes, _resolve_alerts, sheet=ALERT_SHEET, row_col=ROW_COL)
+    return _normalize_alerts(df)
 
-    return df[cols]
+
+def _normalize_alerts(df: pd.DataFrame) -> pd.DataFrame:
+    with perf.span("normalize.alerts", rows=len(df)):
+        df = df.dropna(subset=["Cod Site"])
+        return canonicalize_alerts(df)
 
 
 @st.cache_data(show_spinner=False)
-def prepare_merged_df(loc_bytes: bytes, alert_bytes: bytes, user_lat: float, user_lon: float):
-    df_loc = _read_locations(loc_bytes)
-    df_alert = _read_alerts(alert_bytes)
+def _read_locations(loc_bytes: bytes) -> pd.DataFrame:
+    perf.executed("read_locations")
+    return cached_frame("locations", loc_bytes, PARSER_VERSION, _parse_locations)
 
-    # Só sites que existem no TOATE ALERTELE
-    df = df_loc.merge(df_alert, on="Cod Site", how="inner")
 
-    # Distâncias (cacheado via cache_data do caller)
-    df["Distância (km)"] = compute_distances_km(user_lat, user_lon, df["Latitudine"].tolist(), df["Longitudine"].tolist())
+@st.cache_data(show_spinner=False)
+def _read_alerts(alert_bytes: bytes) -> pd.DataFrame:
+    perf.executed("read_alerts")
+    return cached_frame("alerts", alert_bytes, PARSER_VERSION, _parse_alerts)
+
 
-    df = df.sort_values(by="Distância (km)", ascending=True)
+def clear_caches() -> int:
+    """Invalida a cache em disco e as caches em memória do Streamlit."""
+    n = clear_disk_cache()
+    st.cache_data.clear()
+    _distance_order.clear()
+    dataset_store().clear()
+    cache = getattr(travel_provider(), "cache", None)
+    if cache is not None:
+        cache.clear()
+    return n
 
-    issues_all = sorted([x for x in df["Issue"].dropna().astype(str).unique().tolist() if str(x).strip()])
+
+@st.cache_data(show_spinner=False)
+def load_merged_df(loc_bytes: bytes, alert_bytes: bytes):
+    """Cruzamento independente da posição: calculado uma vez por par de ficheiros."""
+    perf.executed("load_merged_df")
+    df_loc = perf.cached_call("read_locations", _read_locations, loc_bytes)
+    df_alert = perf.cached_call("read_alerts", _read_alerts, alert_bytes)
+    return merge_frames(df_loc, df_alert)
+
+
+def merge_frames(df_loc: pd.DataFrame, df_alert: pd.DataFrame):
+    perf.frame("locations", df_loc)
+    perf.frame("alerts", df_alert)
+
+    # Só sites que existem no TOATE ALERTELE
+    with perf.span("merge"):
+        df = df_loc.merge(df_alert, on="Cod Site", how="inner").reset_index(drop=True)
+    perf.frame("merged", df)
+
+    issues_all = sorted(x for x in df["Issue"].unique().tolist() if x)
 
     return df, issues_all
+
+
+def merge_workbooks(loc_bytes: bytes, alert_bytes: bytes):
+    """Igual a load_merged_df, sem caches do Streamlit (só a cache em disco): para uso headless."""
+    df_loc = cached_frame("locations", loc_bytes, PARSER_VERSION, _parse_locations)
+    df_alert = cached_frame("alerts", alert_bytes, PARSER_VERSION, _parse_alerts)
+    return merge_frames(df_loc, df_alert)
+
+
+@st.cache_resource(show_spinner=False)
+def dataset_store() -> DatasetStore:
+    return DatasetStore()
+
+
+def lease_dataset(key: str) -> Lease:
+    """Impede a evicção do dataset `key` enquanto o Lease estiver vivo (p.ex. em session_state)."""
+    return dataset_store().lease(key)
+
+
+def load_dataset(
+    loc_bytes: bytes, alert_bytes: bytes, key: str | None = None
+) -> tuple[pd.DataFrame, list[str], AlertChanges | None, MergedDelta | None]:
+    """Como load_merged_df + (alterações, delta) face à versão anterior dos alertas.
+
+    Se para a mesma base de localizações já houver uma versão carregada, só as
+    linhas diferentes do novo ficheiro de alertas são lidas e o DF cruzado
+    anterior é remendado (linhas mantidas + novas no fim).
+    O DF é o mesmo objeto para todas as sessões (DatasetStore): não alterar.
+    """
+    key = key or dataset_key(loc_bytes, alert_bytes)
+    loc_key = hashlib.sha1(loc_bytes).hexdigest()
+    version = dataset_store().get(key, loc_key, lambda prev: _build_version(prev, key, loc_bytes, alert_bytes))
+    return version.merged, version.issues_all, version.changes, version.delta
+
+
+@st.cache_resource(show_spinner=False)
+def history_store() -> HistoryStore | None:
+    """Histórico partilhado (SQLite); None se desligado ou se a BD não abrir."""
+    if not HISTORY_ENABLED:
+        return None
+    try:
+        return HistoryStore()
+    except (OSError, sqlite3.Error):
+        return None
+
+
+def _build_version(prev: AlertVersion | None, key: str, loc_bytes: bytes, alert_bytes: bytes) -> AlertVersion:
+    perf.executed("load_dataset")
+    df_loc = perf.cached_call("read_locations", _read_locations, loc_bytes)
+    version = None
+    if prev is not None:
+        try:
+            version = _refresh_version(prev, key, df_loc, alert_bytes)
+        except ValueError:
+            pass  # cabeçalho diferente / folha ilegível linha a linha -> leitura completa
+
+    if version is None:
+        df_alert = perf.cached_call("read_alerts", _read_alerts, alert_bytes)
+        df, _ = merge_frames(df_loc, df_alert)
+        version = AlertVersion(key, alert_bytes, df_alert, df)
+
+    # cada ficheiro de alertas novo = um snapshot no histórico (escrita em segundo plano)
+    history = history_store()
+    if history is not None:
+        history.record_async(version.alerts, hashlib.sha1(alert_bytes).hexdigest())
+    return version
+
+
+def _refresh_version(prev: AlertVersion, key: str, df_loc: pd.DataFrame, alert_bytes: bytes) -> AlertVersion:
+    with perf.span("refresh.scan", bytes=len(alert_bytes)):
+        old_header, old_rows = prev.row_signatures(_sheet_signatures)
+        sheet = SheetRows(alert_bytes, ALERT_SHEET)
+        rows = sheet.data_rows()
+
+    def read(numbers: list[int]) -> pd.DataFrame:
+        with perf.span("xlsx.alerts", rows=len(numbers)):
+            df = sheet.read(_resolve_alerts, numbers, row_col=ROW_COL)
+        return _normalize_alerts(df)
+
+    with perf.span("refresh.diff"):
+        alerts, changes, renumber, delta = refresh_alerts(prev.alerts, old_header, old_rows, sheet.header, rows, read)
+    with perf.span("refresh.patch"):
+        merged, merged_delta = patch_merged(prev.key, prev.merged, df_loc, renumber, delta)
+    perf.frame("merged", merged)
+
+    return AlertVersion(key, alert_bytes, alerts, merged, changes, merged_delta, signatures=(sheet.header, rows))
+
+
+def _sheet_signatures(alert_bytes: bytes) -> tuple[list[str], list[tuple[int, bytes]]]:
+    sheet = SheetRows(alert_bytes, ALERT_SHEET)
+    return sheet.header, sheet.data_rows()
+
+
+def dataset_key(loc_bytes: bytes, alert_bytes: bytes) -> str:
+    h = hashlib.sha1(loc_bytes)
+    h.update(b"\0")
+    h.update(alert_bytes)
+    return h.hexdigest()
+
+
+def snap_position(user_lat: float, user_lon: float) -> tuple[float, float]:
+    # 4 casas decimais ~ 11 m: pequenos desvios do GPS reaproveitam a mesma entrada
+    return round(float(user_lat), POSITION_DECIMALS), round(float(user_lon), POSITION_DECIMALS)
+
+
+@st.cache_resource(show_spinner=False)
+def travel_provider():
+    """Distâncias / tempos até aos sites: motor de rotas (TASKFORCE_ROUTING_URL) ou linha reta."""
+    return provider_from_env(CACHE_DIR / "travel_times.sqlite")
+
+
+@st.cache_resource(show_spinner=False, max_entries=POSITION_CACHE_SIZE)
+def _distance_order(
+    key: str, _df: pd.DataFrame, user_lat: float, user_lon: float, routed: bool = False, _delta: MergedDelta | None = None
+):
+    # Só guarda dois arrays por posição (distâncias + ordem), não o DF inteiro;
+    # partilhados entre sessões sem cópia, por isso só de leitura.
+    # `_df` não entra na chave: `key` já identifica o dataset. `routed` sim:
+    # com o motor de rotas em baixo, o resultado em linha reta fica noutra
+    # entrada; se cair a meio do pedido, o resultado não fica em cache.
+    perf.executed("distance_order")
+    if routed:
+        # por estrada (ordem = tempo de condução); pares já pedidos vêm do memo em disco
+        dist, order, complete = _routed_order(_df, user_lat, user_lon, travel_provider())
+        if not complete:
+            # o motor falhou a meio: a estimativa não pode ficar nesta entrada
+            # (exceções não ficam em cache; distance_order devolve-a na mesma)
+            raise _Uncached(_read_only(dist, order))
+        return _read_only(dist, order)
+    if _delta is None:
+        return _read_only(*order_by_distance(_df, user_lat, user_lon))
+
+    # versão remendada: distâncias das linhas mantidas vêm da versão anterior
+    prev_dist, _ = _distance_order(_delta.prev_key, _delta.prev_df, user_lat, user_lon)
+    added = _df.iloc[len(_delta.keep):]
+    dist = np.concatenate([
+        prev_dist[_delta.keep],
+        distances_km(user_lat, user_lon, added["Latitudine"].to_numpy(), added["Longitudine"].to_numpy()),
+    ])
+    return _read_only(dist, np.argsort(dist, kind="stable"))
+
+
+def _read_only(*arrays: np.ndarray) -> tuple[np.ndarray, ...]:
+    for a in arrays:
+        a.flags.writeable = False
+    return arrays
+
+
+def order_by_distance(df: pd.DataFrame, user_lat: float, user_lon: float, provider=None):
+    """(distâncias em km, ordem crescente estável) de cada linha até (lat, lon).
+
+    Com um fornecedor com motor de rotas (utils.travel_time), km por estrada
+    e ordem pelo tempo de condução.
+    """
+    if provider is not None and provider.routed:
+        return _routed_order(df, user_lat, user_lon, provider)[:2]
+
+    dist = distances_km(user_lat, user_lon, df["Latitudine"].to_numpy(), df["Longitudine"].to_numpy())
+    order = np.argsort(dist, kind="stable")
+    return dist, order
+
+
+def _routed_order(df: pd.DataFrame, user_lat: float, user_lon: float, provider):
+    # (km, ordem pelo tempo de condução, o motor respondeu a tudo)
+    with perf.span("routing", sites=len(df)):
+        dist, seconds, complete = travel_from(
+            provider, user_lat, user_lon, df["Latitudine"].to_numpy(), df["Longitudine"].to_numpy(), limit=ROUTING_LIMIT
+        )
+    return dist, np.argsort(seconds, kind="stable"), complete
+
+
+class _Uncached(Exception):
+    """Resultado a devolver sem ficar na cache (st.cache_* não guarda exceções)."""
+
+    def __init__(self, value):
+        super().__init__()
+        self.value = value
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def site_index(key: str, _df: pd.DataFrame) -> SiteIndex:
+    # Construído uma vez por dataset; posições = linhas do DF de load_merged_df
+    perf.executed("site_index")
+    return SiteIndex(_df["Latitudine"].to_numpy(), _df["Longitudine"].to_numpy())
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def dataset_index(key: str, _df: pd.DataFrame) -> DatasetIndex:
+    perf.executed("dataset_index")
+    return DatasetIndex(_df)
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def text_index(key: str, _df: pd.DataFrame) -> TextIndex:
+    perf.executed("text_index")
+    return TextIndex(_df)
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def metrics_cube(key: str, _df: pd.DataFrame) -> MetricsCube:
+    perf.executed("metrics_cube")
+    return MetricsCube(_df)
+
+
+def distance_order(key: str, df: pd.DataFrame, user_lat: float, user_lon: float, delta: MergedDelta | None = None):
+    """(distâncias, ordem crescente, origem) para a posição arredondada; arrays partilhados, não alterar.
+
+    origem: "road" (motor de rotas), "line" (linha reta) ou None se o motor só
+    respondeu a parte dos pares — resultado que não deve ficar em caches.
+    """
+    lat, lon = snap_position(user_lat, user_lon)
+    provider = travel_provider()
+    routed = provider.routed and provider.available
+    try:
+        dist, order = _distance_order(key, df, lat, lon, routed, delta)
+    except _Uncached as e:
+        dist, order = e.value
+        return dist, order, None
+    return dist, order, "road" if routed else "line"
+
+
+def positioned_df(key: str, df: pd.DataFrame, user_lat: float, user_lon: float) -> pd.DataFrame:
+    dist, order, _ = distance_order(key, df, user_lat, user_lon)
+
+    out = df.take(order)
+    out["Distância (km)"] = dist[order]
+    return out
+
+
+def prepare_merged_df(loc_bytes: bytes, alert_bytes: bytes, user_lat: float, user_lon: float):
+    df, issues_all = load_merged_df(loc_bytes, alert_bytes)
+    key = dataset_key(loc_bytes, alert_bytes)
+
+    return positioned_df(key, df, user_lat, user_lon), issues_all
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable
+
+from data.alert_refresh import AlertVersion
+from utils import perf
+
+
+# Datasets cruzados partilhados por todas as sessões do processo: cada
+# sessão recebe o mesmo objeto (sem pickle/cópia como no st.cache_data).
+# Os DFs são só de leitura (copy-on-write do pandas; texto em Arrow) e
+# quem os usa segura um Lease: enquanto houver leases vivos a entrada não
+# sai (nem com clear). As restantes saem por LRU quando o total passar
+# MAX_STORE_BYTES. Um Lease pedido antes de a entrada existir fica à espera
+# e prende-se a ela quando for inserida: pedir o Lease antes do get.
+# O build (leitura + cruzamento, segundos) corre fora do lock: só quem pede
+# a mesma key espera por ele; as outras sessões não ficam bloqueadas.
+
+MAX_STORE_BYTES = int(float(os.environ.get("TASKFORCE_STORE_MB", "1024")) * 1024 * 1024)
+
+
+class Lease:
+    """Referência de uma sessão (ou do watcher) a um dataset; liberta-se ao ser recolhido."""
+
+    __slots__ = ("key", "__weakref__")
+
+    def __init__(self, key: str):
+        self.key = key
+
+
+class _Entry:
+    __slots__ = ("group", "version", "leases")
+
+    def __init__(self, group: str, version: AlertVersion):
+        self.group = group
+        self.version = version
+        self.leases: weakref.WeakSet[Lease] = weakref.WeakSet()
+
+
+class DatasetStore:
+    def __init__(self, max_bytes: int = MAX_STORE_BYTES):
+        self.max_bytes = max_bytes
+        # key -> entrada; a mais recente no fim
+        self._items: OrderedDict[str, _Entry] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        # key -> Future do build em curso (um por key)
+        self._building: dict[str, Future] = {}
+        # key -> leases pedidos antes de a entrada existir
+        self._parked: dict[str, weakref.WeakSet[Lease]] = {}
+
+    def get(
+        self, key: str, group: str, build: Callable[[AlertVersion | None], AlertVersion]
+    ) -> AlertVersion:
+        """Versão `key`; se não existir, build(última versão do mesmo `group` ou None)."""
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                self._items.move_to_end(key)
+                perf.count("dataset_store.hit")
+                return entry.version
+
+            pending = self._building.get(key)
+            if pending is None:
+                perf.count("dataset_store.miss")
+                prev = next((e.version for e in reversed(self._items.values()) if e.group == group), None)
+                pending = self._building[key] = Future()
+                owner = True
+            else:
+                perf.count("dataset_store.wait")
+                owner = False
+
+        if not owner:
+            return pending.result()
+
+        try:
+            version = build(prev)
+        except BaseException as e:
+            with self._lock:
+                del self._building[key]
+            pending.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._building[key]
+            # a versão anterior saiu entretanto: não a segurar pelo delta
+            if version.delta is not None and version.delta.prev_key not in self._items:
+                version.delta = None
+            entry = self._items[key] = _Entry(group, version)
+            entry.leases.update(self._parked.pop(key, ()))
+            self._bytes += version.nbytes
+            self._evict()
+        pending.set_result(version)
+        return version
+
+    def lease(self, key: str) -> Lease:
+        """Segura `key` contra a evicção enquanto o objeto devolvido estiver vivo.
+
+        Se `key` ainda não existir (a carregar, ou saiu), o Lease prende-se à
+        entrada quando ela for inserida.
+        """
+        lease = Lease(key)
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                entry.leases.add(lease)
+            else:
+                for k in [k for k, leases in self._parked.items() if not leases]:
+                    del self._parked[k]
+                self._parked.setdefault(key, weakref.WeakSet()).add(lease)
+        return lease
+
+    def _drop(self, key: str) -> None:
+        entry = self._items.pop(key)
+        self._bytes -= entry.version.nbytes
+        # quem foi remendado a partir desta versão deixa de a segurar
+        for other in self._items.values():
+            if other.version.delta is not None and other.version.delta.prev_key == key:
+                other.version.delta = None
+
+    def _evict(self) -> None:
+        for key in list(self._items):
+            if self._bytes <= self.max_bytes:
+                break
+            if self._items[key].leases:
+                continue
+            self._drop(key)
+            perf.count("dataset_store.evict")
+
+    def clear(self) -> None:
+        """Tira as entradas sem leases (as que estão a ser mostradas ficam)."""
+        with self._lock:
+            for key in [k for k, e in self._items.items() if not e.leases]:
+                self._drop(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "leases": {k[:12]: len(e.leases) for k, e in self._items.items()},
+            }
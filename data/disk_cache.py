@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Callable
+
+import pandas as pd
+
+from utils import perf
+
+
+# Cache em disco dos DataFrames já normalizados (Parquet), endereçado pelo
+# conteúdo do .xlsx + versão do parser. Sobrevive a reinícios do processo.
+CACHE_DIR = Path(os.environ.get("TASKFORCE_CACHE_DIR", Path.home() / ".cache" / "taskforce_masterchain"))
+MAX_CACHE_BYTES = int(float(os.environ.get("TASKFORCE_CACHE_MAX_MB", "512")) * 1024 * 1024)
+ENABLED = os.environ.get("TASKFORCE_DISK_CACHE", "1") != "0"
+
+_SUFFIX = ".parquet"
+
+
+def content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def _entry_path(kind: str, version: str, digest: str) -> Path:
+    return CACHE_DIR / f"{kind}-v{version}-{digest}{_SUFFIX}"
+
+
+def _arrow_safe(df: pd.DataFrame) -> pd.DataFrame:
+    # Colunas extra do Excel com tipos misturados (números + texto) não
+    # passam para Arrow; ficam como texto (tanto no miss como no hit).
+    import pyarrow as pa
+
+    df = df.copy()
+    for c in df.columns:
+        if df[c].dtype == object:
+            try:
+                pa.array(df[c], from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                df[c] = df[c].map(lambda x: x if x is None or x != x else str(x))
+    return df
+
+
+def _entries() -> list[Path]:
+    try:
+        return [p for p in CACHE_DIR.iterdir() if p.suffix == _SUFFIX]
+    except OSError:
+        return []
+
+
+def _evict(max_bytes: int = MAX_CACHE_BYTES) -> None:
+    files = []
+    for p in _entries():
+        try:
+            st_ = p.stat()
+        except OSError:
+            continue
+        files.append((st_.st_mtime, st_.st_size, p))
+
+    total = sum(size for _, size, _ in files)
+    # mais antigos (menos usados) primeiro
+    for _, size, p in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            p.unlink()
+            total -= size
+        except OSError:
+            pass
+
+
+def _load(path: Path) -> pd.DataFrame | None:
+    try:
+        df = pd.read_parquet(path)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # ficheiro corrompido / truncado -> descarta e volta a fazer parse
+        try:
+            path.unlink()
+        except OSError:
+            pass
+        return None
+
+    try:
+        os.utime(path)  # marca como usado recentemente (LRU por mtime)
+    except OSError:
+        pass
+    return df
+
+
+def _store(path: Path, df: pd.DataFrame) -> None:
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        os.close(fd)
+        try:
+            df.to_parquet(tmp, index=False)
+            os.replace(tmp, path)  # escrita atómica
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+    except Exception:
+        # disco cheio / só de leitura / sem pyarrow: a cache é só otimização
+        return
+    _evict()
+
+
+def cached_frame(kind: str, content: bytes, version: str, parse: Callable[[bytes], pd.DataFrame]) -> pd.DataFrame:
+    if not ENABLED:
+        return parse(content)
+
+    path = _entry_path(kind, version, content_hash(content))
+    df = _load(path)
+    if df is not None:
+        perf.count(f"disk_cache.{kind}.hit")
+        return df
+    perf.count(f"disk_cache.{kind}.miss")
+
+    df = parse(content)
+    try:
+        df = _arrow_safe(df)
+    except ImportError:
+        return df
+    _store(path, df)
+    return df
+
+
+def clear_disk_cache() -> int:
+    n = 0
+    for p in _entries():
+        try:
+            p.unlink()
+            n += 1
+        except OSError:
+            pass
+    return n
+
+
+def disk_cache_size() -> int:
+    total = 0
+    for p in _entries():
+        try:
+            total += p.stat().st_size
+        except OSError:
+            pass
+    return total
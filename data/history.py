@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from data.canonical import STATUS_COL, STATUS_DOWN, STATUS_ONAIR
+from data.disk_cache import CACHE_DIR
+from utils import perf
+
+
+# Histórico dos alertas em SQLite, só de acréscimo. Cada ficheiro de alertas
+# carregado é um snapshot (data/hora); por site só se grava uma linha quando
+# o estado muda (estado, Issue, Tip Alarma ou Lant) ou o site sai do ficheiro
+# (status NULL). Meses de vários snapshots por dia = nº de mudanças, não
+# snapshots x sites. Cada linha leva também o início e o estado do período
+# anterior do site, por isso tempos em DOWN e transições num intervalo são
+# um só varrimento pelo índice de taken_at (sem funções de janela).
+# `site_current` é só um índice derivado do último estado.
+
+ENABLED = os.environ.get("TASKFORCE_HISTORY", "1") != "0"
+DB_PATH = Path(os.environ.get("TASKFORCE_HISTORY_DB", CACHE_DIR / "history.sqlite"))
+
+# cor do mapa por tempo seguido em DOWN (limite superior em horas, rótulo, cor)
+DOWN_BUCKETS = [
+    (24, "< 1 dia", "#fdae61"),
+    (72, "1–3 dias", "#f46d43"),
+    (168, "3–7 dias", "#d73027"),
+    (float("inf"), "> 7 dias", "#67001f"),
+]
+NOT_DOWN_COLOR = "#9e9e9e"
+HISTORY_COLORS = [NOT_DOWN_COLOR] + [c for _, _, c in DOWN_BUCKETS]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    taken_at REAL NOT NULL,
+    alerts_key TEXT NOT NULL,
+    sites INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS site_states (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots(id),
+    taken_at REAL NOT NULL,
+    cod_site TEXT NOT NULL,
+    lant TEXT,
+    issue TEXT,
+    tip_alarma TEXT,
+    status TEXT,
+    prev_at REAL,
+    prev_status TEXT
+);
+CREATE TABLE IF NOT EXISTS site_current (
+    cod_site TEXT PRIMARY KEY,
+    since REAL NOT NULL,
+    last_at REAL NOT NULL,
+    lant TEXT,
+    issue TEXT,
+    tip_alarma TEXT,
+    status TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_snapshots_time ON snapshots(taken_at);
+CREATE INDEX IF NOT EXISTS ix_states_site ON site_states(cod_site, taken_at);
+CREATE INDEX IF NOT EXISTS ix_states_lant ON site_states(lant, taken_at);
+CREATE INDEX IF NOT EXISTS ix_states_tip ON site_states(tip_alarma, taken_at);
+CREATE INDEX IF NOT EXISTS ix_states_time ON site_states(taken_at);
+"""
+
+_STATE_COLS = ["lant", "issue", "tip_alarma", "status"]
+# acima disto, o filtro por sites é feito no pandas (limite de parâmetros do SQLite)
+_MAX_SQL_PARAMS = 900
+_RANK = {STATUS_DOWN: 2, STATUS_ONAIR: 1}
+
+
+def site_states(alerts: pd.DataFrame) -> pd.DataFrame:
+    """Um estado por Cod Site: a linha mais grave (DOWN > ONAIR > outro)."""
+    status = alerts[STATUS_COL].astype(str)
+    df = pd.DataFrame({
+        "cod_site": alerts["Cod Site"].astype(str).to_numpy(),
+        "lant": alerts["Lant"].astype(str).to_numpy() if "Lant" in alerts.columns else "",
+        "issue": alerts["Issue"].astype(str).to_numpy(),
+        "tip_alarma": alerts["Tip Alarma"].astype(str).to_numpy(),
+        "status": status.to_numpy(),
+        "_rank": status.map(_RANK).fillna(0).to_numpy(),
+    })
+    df = df[df["cod_site"] != ""]
+    df = df.sort_values(["cod_site", "_rank"], ascending=[True, False], kind="stable")
+    return df.drop_duplicates("cod_site").drop(columns="_rank").reset_index(drop=True)
+
+
+class HistoryStore:
+    def __init__(self, path: str | Path = DB_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        # um só escritor, pela ordem de chegada; quem carrega não espera pela escrita
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="taskforce-history")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as con, con:
+            con.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.path, timeout=30)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        return con
+
+    def _read(self, sql: str, params=()) -> pd.DataFrame:
+        with closing(self._connect()) as con:
+            return pd.read_sql_query(sql, con, params=params)
+
+    # --- escrita ---
+
+    def record(self, alerts: pd.DataFrame, alerts_key: str, taken_at: float | None = None) -> int | None:
+        """Grava um snapshot (só as mudanças por site); devolve o id ou None se igual ao último."""
+        taken_at = time.time() if taken_at is None else float(taken_at)
+        new = site_states(alerts)
+
+        with self._lock, closing(self._connect()) as con, con:
+            last = con.execute("SELECT alerts_key FROM snapshots ORDER BY taken_at DESC, id DESC LIMIT 1").fetchone()
+            if last is not None and last[0] == alerts_key:
+                return None
+
+            with perf.span("history.diff", sites=len(new)):
+                cur = pd.read_sql_query("SELECT cod_site, last_at, lant, issue, tip_alarma, status FROM site_current", con)
+                both = new.merge(cur, on="cod_site", how="outer", suffixes=("", "_old"), indicator=True)
+                changed = both["_merge"] == "left_only"
+                for c in _STATE_COLS:
+                    changed |= (both["_merge"] == "both") & (both[c] != both[f"{c}_old"])
+                gone = both["_merge"] == "right_only"
+
+            snapshot_id = con.execute(
+                "INSERT INTO snapshots (taken_at, alerts_key, sites) VALUES (?, ?, ?)",
+                (taken_at, alerts_key, len(new)),
+            ).lastrowid
+
+            # NaN (site novo) -> NULL
+            both = both.astype(object).where(both.notna(), None)
+            rows = both.loc[changed, ["cod_site", *_STATE_COLS, "last_at", "status_old"]]
+            con.executemany(
+                "INSERT INTO site_states VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(snapshot_id, taken_at, *r) for r in rows.itertuples(index=False)],
+            )
+            con.executemany(
+                "INSERT INTO site_states (snapshot_id, taken_at, cod_site, prev_at, prev_status) VALUES (?, ?, ?, ?, ?)",
+                [(snapshot_id, taken_at, *r) for r in both.loc[gone, ["cod_site", "last_at", "status_old"]].itertuples(index=False)],
+            )
+
+            # estado atual: `since` só muda quando o estado muda
+            con.executemany(
+                "INSERT INTO site_current VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(cod_site) DO UPDATE SET "
+                "since = CASE WHEN excluded.status != site_current.status THEN excluded.since ELSE site_current.since END, "
+                "last_at = excluded.last_at, lant = excluded.lant, issue = excluded.issue, "
+                "tip_alarma = excluded.tip_alarma, status = excluded.status",
+                [(r.cod_site, taken_at, taken_at, r.lant, r.issue, r.tip_alarma, r.status) for r in rows.itertuples(index=False)],
+            )
+            con.executemany("DELETE FROM site_current WHERE cod_site = ?", [(c,) for c in both.loc[gone, "cod_site"]])
+            perf.count("history.changes", int(changed.sum() + gone.sum()))
+            return snapshot_id
+
+    def record_async(self, alerts: pd.DataFrame, alerts_key: str, taken_at: float | None = None):
+        taken_at = time.time() if taken_at is None else taken_at
+        return self._writer.submit(self.record, alerts, alerts_key, taken_at)
+
+    def flush(self) -> None:
+        """Espera pelas escritas pendentes."""
+        self._writer.submit(lambda: None).result()
+
+    # --- consultas ---
+
+    def snapshots(self) -> pd.DataFrame:
+        return self._read("SELECT id, taken_at, sites FROM snapshots ORDER BY taken_at")
+
+    def summary(self) -> dict:
+        with closing(self._connect()) as con:
+            n, first, last = con.execute("SELECT COUNT(*), MIN(taken_at), MAX(taken_at) FROM snapshots").fetchone()
+            events = con.execute("SELECT COUNT(*) FROM site_states").fetchone()[0]
+        return {"snapshots": n, "first": first, "last": last, "events": events}
+
+    def last_snapshot(self) -> int | None:
+        with closing(self._connect()) as con:
+            row = con.execute("SELECT MAX(id) FROM snapshots").fetchone()
+        return row[0]
+
+    def down_since(self) -> pd.Series:
+        """Cod Site -> início da sequência atual em DOWN (epoch), dos sites DOWN no último snapshot."""
+        df = self._read("SELECT cod_site, since FROM site_current WHERE status = ?", (STATUS_DOWN,))
+        return pd.Series(df["since"].to_numpy(), index=df["cod_site"].to_numpy(), name="since")
+
+    def downtime(self, start: float, end: float, sites=None) -> pd.DataFrame:
+        """Horas em DOWN por site em [start, end] (estado = o do último snapshot até ao seguinte).
+
+        O tempo em que o site não está no ficheiro de alertas não conta como DOWN.
+        """
+        params = {"start": start, "end": end, "down": STATUS_DOWN}
+        where = ""
+        if sites is not None and len(sites) > _MAX_SQL_PARAMS:
+            df = self.downtime(start, end)
+            return df[df["cod_site"].isin(sites)].reset_index(drop=True)
+        if sites is not None:
+            sites = list(sites)
+            params.update({f"s{i}": c for i, c in enumerate(sites)})
+            where = f" AND cod_site IN ({', '.join(f':s{i}' for i in range(len(sites))) or 'NULL'})"
+        # períodos fechados (linha seguinte já gravada) + período aberto do estado atual
+        sql = f"""
+            SELECT cod_site, MAX(lant) AS lant,
+                   SUM(MIN(t1, :end) - MAX(t0, :start)) / 3600.0 AS down_h,
+                   COUNT(*) AS periodos
+            FROM (
+                SELECT cod_site, lant, prev_at AS t0, taken_at AS t1 FROM site_states
+                WHERE taken_at > :start AND prev_at < :end AND prev_status = :down{where}
+                UNION ALL
+                SELECT cod_site, lant, last_at AS t0, :end AS t1 FROM site_current
+                WHERE status = :down AND last_at < :end{where}
+            )
+            GROUP BY cod_site
+            ORDER BY down_h DESC
+        """
+        return self._read(sql, params)
+
+    def transitions(self, start: float, end: float, by: str = "lant") -> pd.DataFrame:
+        """Mudanças de estado (flaps) em [start, end] por `by` ("lant" ou "cod_site"); sair/voltar ao ficheiro não conta."""
+        if by not in ("lant", "cod_site"):
+            raise ValueError(f"Agrupamento inválido: {by!r}")
+        sql = f"""
+            SELECT {by}, COUNT(*) AS transicoes,
+                   SUM(status = :down) AS para_down,
+                   COUNT(DISTINCT cod_site) AS sites
+            FROM site_states
+            WHERE taken_at BETWEEN :start AND :end
+              AND prev_status IS NOT NULL AND status IS NOT NULL AND status != prev_status
+            GROUP BY {by}
+            ORDER BY transicoes DESC
+        """
+        return self._read(sql, {"start": start, "end": end, "down": STATUS_DOWN})
+
+    def timeline(self, cod_site: str) -> pd.DataFrame:
+        df = self._read(
+            "SELECT taken_at, lant, issue, tip_alarma, status FROM site_states WHERE cod_site = ? ORDER BY taken_at",
+            (cod_site,),
+        )
+        df["taken_at"] = pd.to_datetime(df["taken_at"], unit="s")
+        return df
+
+
+def down_buckets(codes, since: pd.Series, now: float | None = None) -> np.ndarray:
+    """Índice em HISTORY_COLORS por site: 0 = não está DOWN, 1.. = faixa de DOWN_BUCKETS."""
+    now = time.time() if now is None else now
+    hours = (now - pd.Series(codes).map(since).to_numpy(dtype=float)) / 3600.0
+    limits = np.array([h for h, _, _ in DOWN_BUCKETS])
+    out = np.searchsorted(limits, hours, side="right") + 1
+    return np.where(np.isnan(hours), 0, np.minimum(out, len(DOWN_BUCKETS)))
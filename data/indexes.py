@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from data.canonical import STATUS_COL, STATUSES
+
+
+# Índices construídos uma vez por dataset (DF imutável de load_merged_df).
+# Cada filtro devolve uma máscara booleana sobre as linhas; o app compõe as
+# máscaras e só materializa o DF final uma vez.
+
+
+def _codes(s: pd.Series) -> tuple[np.ndarray, list]:
+    cat = s.astype("category")
+    return cat.cat.codes.to_numpy(), [str(c) for c in cat.cat.categories]
+
+
+class DatasetIndex:
+    def __init__(self, df: pd.DataFrame):
+        self.n = len(df)
+
+        # Lant -> posições (ordenadas)
+        self.has_lant = "Lant" in df.columns
+        self.lant_positions: dict[str, np.ndarray] = {}
+        if self.has_lant:
+            codes, values = _codes(df["Lant"])
+            order = np.argsort(codes, kind="stable")
+            bounds = np.searchsorted(codes[order], np.arange(len(values) + 1))
+            for i, v in enumerate(values):
+                if bounds[i + 1] > bounds[i]:
+                    self.lant_positions[v] = order[bounds[i]:bounds[i + 1]]
+
+        # Issue: código da categoria por linha; seleção = tabela de bits por categoria
+        self.issue_codes, self.issue_values = _codes(df["Issue"])
+        self._issue_of = {v: i for i, v in enumerate(self.issue_values)}
+
+        # Estado (ONAIR / DOWN / OUTRO) já canónico
+        self.status_codes = df[STATUS_COL].cat.codes.to_numpy()
+        self.status_values = [str(c) for c in df[STATUS_COL].cat.categories]
+
+    def all(self) -> np.ndarray:
+        return np.ones(self.n, dtype=bool)
+
+    def lant_mask(self, lant: str) -> np.ndarray:
+        mask = np.zeros(self.n, dtype=bool)
+        pos = self.lant_positions.get(lant)
+        if pos is not None:
+            mask[pos] = True
+        return mask
+
+    def issue_mask(self, selected) -> np.ndarray:
+        # último elemento = linhas sem categoria (código -1)
+        lut = np.zeros(len(self.issue_values) + 1, dtype=bool)
+        for v in selected:
+            i = self._issue_of.get(v)
+            if i is not None:
+                lut[i] = True
+        return lut[self.issue_codes]
+
+    def status_mask(self, statuses) -> np.ndarray:
+        lut = np.zeros(len(self.status_values) + 1, dtype=bool)
+        for v in statuses:
+            if v in self.status_values:
+                lut[self.status_values.index(v)] = True
+        return lut[self.status_codes]
+
+
+CUBE_DIMS = ("Lant", "Issue", "Tip Alarma", "GW")
+
+
+class MetricsCube:
+    """Contagens por célula (Lant, Issue, Tip Alarma, GW), calculadas uma vez por dataset.
+
+    Métricas e quebras (p.ex. DOWN por Issue) somam células em vez de linhas.
+    Filtros que não são dimensões do cubo (proximidade) entram como máscara de
+    linhas: um bincount dá as contagens por célula desse subconjunto.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.n = len(df)
+        self.has_lant = "Lant" in df.columns
+
+        self.values: dict[str, list] = {}
+        key = np.zeros(self.n, dtype=np.int64)
+        sizes = []
+        for dim in CUBE_DIMS:
+            if dim in df.columns:
+                codes, values = _codes(df[dim])
+            else:
+                codes, values = np.full(self.n, -1), []
+            self.values[dim] = values
+            # +1: código -1 (vazio / sem categoria) vira 0
+            sizes.append(len(values) + 1)
+            key = key * sizes[-1] + (codes + 1)
+
+        cell_keys, self.cell_of = np.unique(key, return_inverse=True)
+        self.cell_of = self.cell_of.ravel()
+        self.n_cells = len(cell_keys)
+        # código por dimensão de cada célula (-1 = vazio)
+        self.cell_codes = {
+            dim: c - 1 for dim, c in zip(CUBE_DIMS, np.unravel_index(cell_keys, sizes))
+        } if self.n_cells else {dim: np.empty(0, dtype=np.int64) for dim in CUBE_DIMS}
+
+        self.counts = np.bincount(self.cell_of, minlength=self.n_cells)
+
+        # o estado é função de Tip Alarma -> constante dentro da célula
+        self.cell_status = np.full(self.n_cells, -1, dtype=np.int64)
+        self.cell_status[self.cell_of] = df[STATUS_COL].cat.codes.to_numpy()
+        self.status_values = [str(c) for c in df[STATUS_COL].cat.categories]
+
+    def cell_counts(self, mask: np.ndarray | None = None) -> np.ndarray:
+        if mask is None:
+            return self.counts
+        return np.bincount(self.cell_of[mask], minlength=self.n_cells)
+
+    def cells(self, lant: str | None = None, issues=None) -> np.ndarray:
+        """Células que passam os filtros Lant (valor) e Issue (lista); None = sem filtro."""
+        sel = np.ones(self.n_cells, dtype=bool)
+        if lant is not None:
+            sel &= self._member("Lant", [lant])
+        if issues is not None:
+            sel &= self._member("Issue", issues)
+        return sel
+
+    def _member(self, dim: str, selected) -> np.ndarray:
+        values = self.values[dim]
+        lut = np.zeros(len(values) + 1, dtype=bool)
+        for v in selected:
+            if v in values:
+                lut[values.index(v)] = True
+        return lut[self.cell_codes[dim]]
+
+    def status_counts(self, lant: str | None = None, issues=None, mask: np.ndarray | None = None) -> dict[str, int]:
+        """{"total": n, "ONAIR": n, "DOWN": n, "OUTRO": n} do subconjunto."""
+        w = np.where(self.cells(lant, issues), self.cell_counts(mask), 0)
+        per_status = np.bincount(
+            self.cell_status[self.cell_status >= 0],
+            weights=w[self.cell_status >= 0],
+            minlength=len(self.status_values),
+        )
+        out = {"total": int(w.sum())}
+        out.update({v: int(per_status[i]) for i, v in enumerate(self.status_values) if v in STATUSES})
+        return out
+
+    def breakdown(
+        self,
+        dim: str,
+        status: str | None = None,
+        lant: str | None = None,
+        issues=None,
+        mask: np.ndarray | None = None,
+    ) -> pd.Series:
+        """Contagens por valor de `dim` (só `status`, se dado), por ordem decrescente."""
+        w = np.where(self.cells(lant, issues), self.cell_counts(mask), 0)
+        if status is not None:
+            code = self.status_values.index(status) if status in self.status_values else -2
+            w = np.where(self.cell_status == code, w, 0)
+
+        values = self.values[dim]
+        codes = self.cell_codes[dim]
+        per_value = np.bincount(codes[codes >= 0], weights=w[codes >= 0], minlength=len(values)).astype(int)
+        s = pd.Series(per_value, index=pd.Index(values, name=dim), name="Sites")
+        s = s[(s > 0) & (s.index != "")]
+        return s.sort_values(ascending=False, kind="stable")
+
+
+# --- Pesquisa de texto ---
+# Dobra de acentos/maiúsculas para romeno e português: NFKD separa a letra
+# do diacrítico (ș/ş, ț/ţ, ă, â, î, ç, ã, õ, é, ...) e o diacrítico sai.
+
+TEXT_COLUMNS = ("Cod Site", "Issue", "Comments")
+
+_MARKS_RE = re.compile(r"[\u0300-\u036f]")
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def fold(text: str) -> str:
+    return _MARKS_RE.sub("", unicodedata.normalize("NFKD", str(text))).casefold()
+
+
+def _fold_series(s: pd.Series) -> pd.Series:
+    return s.astype(str).str.normalize("NFKD").str.replace(_MARKS_RE, "", regex=True).str.casefold()
+
+
+class TextIndex:
+    """Índice invertido token -> posições (Cod Site, Issue, Comments).
+
+    O vocabulário fica ordenado e as listas de posições contíguas pela mesma
+    ordem: todos os tokens com um prefixo são um só intervalo (searchsorted).
+    Os textos repetidos (Issue, comentários-tipo) só são tokenizados uma vez.
+    """
+
+    def __init__(self, df: pd.DataFrame, columns=TEXT_COLUMNS):
+        self.n = len(df)
+        token_parts, row_parts = [], []
+        for col in columns:
+            if col not in df.columns:
+                continue
+            codes, uniques = pd.factorize(df[col], sort=False)
+            tokens = _fold_series(pd.Series(uniques)).str.findall(_TOKEN_RE).explode().dropna()
+            if tokens.empty:
+                continue
+            uid = tokens.index.to_numpy()
+
+            # linhas de cada valor único: CSR por código
+            order = np.argsort(codes, kind="stable")
+            starts = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+            counts = starts[1:] - starts[:-1]
+            reps = counts[uid]
+            first = np.repeat(starts[uid], reps)
+            offset = np.arange(reps.sum()) - np.repeat(np.cumsum(reps) - reps, reps)
+            row_parts.append(order[first + offset])
+            token_parts.append(np.repeat(tokens.to_numpy(dtype=object), reps))
+
+        if not token_parts:
+            self.vocab = np.empty(0, dtype=object)
+            self.offsets = np.zeros(1, dtype=np.int64)
+            self.positions = np.empty(0, dtype=np.int64)
+            return
+
+        token_id, vocab = pd.factorize(np.concatenate(token_parts), sort=True)
+        rows = np.concatenate(row_parts)
+        # (token, linha) únicos, ordenados por token e depois por linha
+        pair = np.sort(token_id.astype(np.int64) * max(self.n, 1) + rows)
+        pair = pair[np.r_[True, pair[1:] != pair[:-1]]]
+        self.vocab = np.asarray(vocab, dtype=object)
+        self.positions = pair % max(self.n, 1)
+        self.offsets = np.searchsorted(pair // max(self.n, 1), np.arange(len(self.vocab) + 1))
+
+    @staticmethod
+    def terms(query: str) -> list[str]:
+        return _TOKEN_RE.findall(fold(query))
+
+    def term_mask(self, term: str) -> np.ndarray:
+        """Linhas com algum token que comece por `term` (já dobrado)."""
+        lo = np.searchsorted(self.vocab, term, side="left")
+        hi = np.searchsorted(self.vocab, term + "\U0010ffff", side="left")
+        mask = np.zeros(self.n, dtype=bool)
+        mask[self.positions[self.offsets[lo]:self.offsets[hi]]] = True
+        return mask
+
+    def search(self, query: str) -> np.ndarray | None:
+        """Máscara das linhas com todos os termos (prefixo); None se a pesquisa for vazia."""
+        terms = self.terms(query)
+        if not terms:
+            return None
+        mask = self.term_mask(terms[0])
+        for t in terms[1:]:
+            mask &= self.term_mask(t)
+        return mask
+
+    def suggest(self, prefix: str, limit: int = 10) -> list[str]:
+        """Tokens do vocabulário que começam por `prefix` (por nº de linhas)."""
+        terms = self.terms(prefix)
+        if not terms:
+            return []
+        term = terms[-1]
+        lo = np.searchsorted(self.vocab, term, side="left")
+        hi = np.searchsorted(self.vocab, term + "\U0010ffff", side="left")
+        sizes = self.offsets[lo + 1:hi + 1] - self.offsets[lo:hi]
+        top = np.argsort(-sizes, kind="stable")[:limit]
+        return [str(self.vocab[lo + i]) for i in top]
+
+
+def select(df: pd.DataFrame, mask: np.ndarray, dist: np.ndarray, order: np.ndarray) -> pd.DataFrame:
+    """Única materialização: linhas da máscara, pela ordem de distância, com a coluna de distância."""
+    pos = order[mask[order]]
+    out = df.take(pos)
+    out["Distância (km)"] = dist[pos]
+    return out
@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+import zipfile
+from pathlib import Path
+from typing import Callable
+
+
+# Ingestão por pasta: em vez de cada sessão fazer upload dos dois livros,
+# uma thread vigia TASKFORCE_WATCH_DIR, lê + cruza os .xlsx mais recentes
+# em segundo plano e publica o resultado para todas as sessões. A troca é
+# uma só atribuição (`current`): enquanto a versão nova carrega, as sessões
+# continuam a ver a anterior.
+#
+# O livro de alertas é o que tem a folha ALERT_SHEET; qualquer outro .xlsx
+# é a base de localizações. De cada tipo conta o mais recente.
+#
+# Só a biblioteca padrão ao importar (a app lê WATCH_DIR logo no arranque);
+# o leitor de .xlsx e o pipeline entram na thread, na primeira volta.
+
+WATCH_DIR = os.environ.get("TASKFORCE_WATCH_DIR", "")
+POLL_SECONDS = float(os.environ.get("TASKFORCE_WATCH_INTERVAL", "5"))
+# ficheiro ainda a ser copiado: só entra quando tiver esta idade (ou não mudar entre duas voltas)
+SETTLE_SECONDS = 2.0
+
+LOCATIONS = "locations"
+ALERTS = "alerts"
+
+log = logging.getLogger("taskforce.watcher")
+
+
+def _stat(path: Path) -> tuple[int, int] | None:
+    try:
+        s = path.stat()
+    except OSError:
+        return None
+    return s.st_mtime_ns, s.st_size
+
+
+class Published:
+    """Dataset pronto (imutável): o que as sessões mostram até haver outro."""
+
+    def __init__(self, key, sources, df, issues_all, changes, delta, seconds, lease=None):
+        self.key = key
+        # ((nome, mtime_ns, tamanho) das localizações, idem dos alertas)
+        self.sources = sources
+        self.df = df
+        self.issues_all = issues_all
+        self.changes = changes
+        self.delta = delta
+        self.seconds = seconds
+        self.published_at = time.time()
+        # segura o dataset no DatasetStore enquanto estiver publicado
+        self.lease = lease
+
+    @property
+    def dataset(self):
+        return self.df, self.issues_all, self.changes, self.delta
+
+
+class FolderWatcher:
+    def __init__(
+        self,
+        folder: str | Path,
+        load: Callable[[bytes, bytes, str], tuple],
+        interval: float = POLL_SECONDS,
+        lease: Callable[[str], object] | None = None,
+    ):
+        """`load(loc_bytes, alert_bytes, key)` -> (df, issues_all, changes, delta), como load_dataset;
+        `lease(key)`, se dado, segura a versão publicada (ver DatasetStore)."""
+        self.folder = Path(folder)
+        self.load = load
+        self.lease = lease
+        self.interval = interval
+        self.current: Published | None = None
+        self.loading: tuple[str, str] | None = None
+        self.error: str | None = None
+
+        self._kinds: dict[tuple[str, int, int], str | None] = {}
+        self._last_seen: dict[Path, tuple[int, int]] = {}
+        self._failed = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="taskforce-watcher", daemon=True)
+
+    def start(self) -> "FolderWatcher":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+
+    def poke(self) -> None:
+        """Verifica a pasta já, sem esperar pela próxima volta."""
+        self._wake.set()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.check()
+            except Exception as e:  # a thread nunca morre: fica o erro para a UI
+                log.exception("Falha ao carregar %s", self.folder)
+                self.error = f"{type(e).__name__}: {e}"
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def _kind(self, path: Path, stat: tuple[int, int]) -> str | None:
+        key = (path.name, *stat)
+        if key not in self._kinds:
+            from data.data_loader import ALERT_SHEET
+            from data.xlsx_reader import sheet_names
+
+            try:
+                names = {n.strip().upper() for n in sheet_names(path)}
+            except (OSError, KeyError, zipfile.BadZipFile):
+                kind = None
+            else:
+                kind = ALERTS if ALERT_SHEET.upper() in names else LOCATIONS
+            self._kinds[key] = kind
+        return self._kinds[key]
+
+    def _scan(self) -> dict[str, tuple[Path, tuple[int, int]]]:
+        """Livro mais recente e estável de cada tipo: {tipo: (caminho, (mtime_ns, tamanho))}."""
+        now = time.time_ns()
+        seen: dict[Path, tuple[int, int]] = {}
+        newest: dict[str, tuple[Path, tuple[int, int]]] = {}
+        for path in self.folder.glob("*.xlsx"):
+            if path.name.startswith(("~$", ".")):
+                continue  # ficheiros de lock do Excel / temporários
+            stat = _stat(path)
+            if stat is None:
+                continue
+            seen[path] = stat
+            settled = now - stat[0] >= SETTLE_SECONDS * 1e9 or self._last_seen.get(path) == stat
+            if not settled:
+                continue
+            kind = self._kind(path, stat)
+            if kind is not None and (kind not in newest or stat[0] > newest[kind][1][0]):
+                newest[kind] = (path, stat)
+        self._last_seen = seen
+        return newest
+
+    def check(self) -> bool:
+        """Uma volta: carrega e publica se o par de livros mudou; True se publicou."""
+        newest = self._scan()
+        if LOCATIONS not in newest or ALERTS not in newest:
+            return False
+
+        (loc_path, loc_stat), (alert_path, alert_stat) = newest[LOCATIONS], newest[ALERTS]
+        sources = ((loc_path.name, *loc_stat), (alert_path.name, *alert_stat))
+        current = self.current
+        if (current is not None and current.sources == sources) or sources == self._failed:
+            return False
+
+        from data.data_loader import dataset_key
+
+        self.loading = (loc_path.name, alert_path.name)
+        t0 = time.perf_counter()
+        try:
+            loc_bytes = loc_path.read_bytes()
+            alert_bytes = alert_path.read_bytes()
+            key = dataset_key(loc_bytes, alert_bytes)
+            if current is not None and current.key == key:
+                # só o mtime mudou (cópia do mesmo ficheiro)
+                published = Published(key, sources, *current.dataset, current.seconds, current.lease)
+            else:
+                # o lease antes do load: prende-se à entrada logo que é inserida
+                lease = self.lease(key) if self.lease else None
+                dataset = self.load(loc_bytes, alert_bytes, key)
+                published = Published(key, sources, *dataset, time.perf_counter() - t0, lease=lease)
+        except Exception:
+            self._failed = sources  # não insistir até o ficheiro mudar
+            raise
+        finally:
+            self.loading = None
+
+        self.current = published
+        self.error = None
+        self._failed = None
+        log.info("Publicado %s + %s (%.1fs)", loc_path.name, alert_path.name, published.seconds)
+        return True
+
+    def status(self) -> dict:
+        current = self.current
+        return {
+            "folder": str(self.folder),
+            "locations": None if current is None else current.sources[0][0],
+            "alerts": None if current is None else current.sources[1][0],
+            "published_at": None if current is None else current.published_at,
+            "loading": self.loading,
+            "error": self.error,
+        }
@@ -0,0 +1,285 @@
+from __future__ import annotations
+
+import hashlib
+import posixpath
+import re
+import zipfile
+from io import BytesIO
+from typing import Callable
+from xml.etree.ElementTree import iterparse, parse
+
+import pandas as pd
+
+
+# Leitor .xlsx em streaming: abre o zip uma vez, percorre o XML da folha
+# linha a linha e só converte as células das colunas projetadas.
+
+_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_NS_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_NS_PKG = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+_ROW = _NS + "row"
+_CELL = _NS + "c"
+_V = _NS + "v"
+_IS = _NS + "is"
+_T = _NS + "t"
+_RPH = _NS + "rPh"
+
+_COL_RE = re.compile(r"[A-Z]+")
+
+
+def normalize_header(values) -> list[str]:
+    """Cabeçalho como o pandas o daria, já com espaços/quebras normalizados."""
+    names = []
+    seen: dict[str, int] = {}
+    for i, v in enumerate(values):
+        name = f"Unnamed: {i}" if v is None or str(v) == "" else str(v)
+        # duplicados: "X", "X.1", "X.2"... (igual ao read_excel)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+
+    return [re.sub(r"\s+", " ", n.replace("\n", " ").replace("\r", " ")).strip() for n in names]
+
+
+def _col_index(ref: str) -> int:
+    letters = _COL_RE.match(ref).group(0)
+    n = 0
+    for ch in letters:
+        n = n * 26 + (ord(ch) - 64)
+    return n - 1
+
+
+def _text(el) -> str:
+    for rph in el.findall(_RPH):
+        el.remove(rph)
+    return "".join(t.text or "" for t in el.iter(_T))
+
+
+class _Book:
+    def __init__(self, content: bytes):
+        self.zip = zipfile.ZipFile(BytesIO(content))
+        names = set(self.zip.namelist())
+
+        wb = parse(self.zip.open("xl/workbook.xml")).getroot()
+        rels = parse(self.zip.open("xl/_rels/workbook.xml.rels")).getroot()
+
+        targets = {}
+        by_type = {}
+        for r in rels.iter(_NS_PKG + "Relationship"):
+            target = r.get("Target", "")
+            target = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target))
+            targets[r.get("Id")] = target
+            by_type[r.get("Type", "").rsplit("/", 1)[-1]] = target
+
+        self.sheets = [
+            (s.get("name"), targets.get(s.get(_NS_REL + "id")))
+            for s in wb.iter(_NS + "sheet")
+        ]
+
+        pr = wb.find(_NS + "workbookPr")
+        self.date1904 = pr is not None and pr.get("date1904", "0") in ("1", "true")
+
+        self.shared = []
+        path = by_type.get("sharedStrings")
+        if path in names:
+            for _, el in iterparse(self.zip.open(path)):
+                if el.tag == _NS + "si":
+                    self.shared.append(_text(el))
+                    el.clear()
+
+        self.date_styles = set()
+        path = by_type.get("styles")
+        if path in names:
+            self._read_styles(path)
+
+    def _read_styles(self, path: str) -> None:
+        from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+
+        root = parse(self.zip.open(path)).getroot()
+        fmts = dict(BUILTIN_FORMATS)
+        nf = root.find(_NS + "numFmts")
+        if nf is not None:
+            for f in nf.iter(_NS + "numFmt"):
+                fmts[int(f.get("numFmtId"))] = f.get("formatCode", "")
+
+        xfs = root.find(_NS + "cellXfs")
+        if xfs is None:
+            return
+        for i, xf in enumerate(xfs.iter(_NS + "xf")):
+            code = fmts.get(int(xf.get("numFmtId", 0)), "")
+            if code and is_date_format(code):
+                self.date_styles.add(i)
+
+    def value(self, c):
+        t = c.get("t", "n")
+        if t == "inlineStr":
+            el = c.find(_IS)
+            return None if el is None else _text(el) or None
+
+        v = c.find(_V)
+        if v is None or v.text is None:
+            return None
+        raw = v.text
+
+        # texto vazio -> vazio (como o pandas)
+        if t == "s":
+            return self.shared[int(raw)] or None
+        if t in ("str", "d"):
+            return raw or None
+        if t == "b":
+            return raw not in ("0", "false")
+        if t == "e":
+            return None  # #N/A, #REF!... -> vazio (como o pandas)
+
+        num = float(raw)
+        if int(c.get("s", 0)) in self.date_styles:
+            from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900, from_excel
+
+            return from_excel(num, CALENDAR_MAC_1904 if self.date1904 else CALENDAR_WINDOWS_1900)
+        # igual ao leitor openpyxl do pandas: 12345.0 -> 12345
+        return int(num) if num.is_integer() else num
+
+    def sheet_path(self, sheet: str | None = None) -> str:
+        """Caminho da folha `sheet` (sem maiúsculas/espaços); se não existir, a primeira."""
+        target = self.sheets[0][1]
+        if sheet is not None:
+            for name, path in self.sheets:
+                if str(name).strip().upper() == sheet.strip().upper():
+                    return path
+        return target
+
+    def rows(self, source):
+        """Gera (nº da linha Excel, {índice_coluna: elemento <c>}); o valor só é convertido por quem pede."""
+        number = 0
+        for _, el in iterparse(source):
+            if el.tag != _ROW:
+                continue
+            r = el.get("r")
+            number = int(r) if r else number + 1
+            cells = {}
+            col = -1
+            for c in el.iter(_CELL):
+                ref = c.get("r")
+                col = _col_index(ref) if ref else col + 1
+                cells[col] = c
+            yield number, cells
+            el.clear()
+
+
+def _header(book: _Book, rows) -> list[str]:
+    # cabeçalho = primeira linha não vazia (linhas em branco são ignoradas, como no pandas)
+    header_cells: dict = {}
+    for _, cells in rows:
+        header_cells = {i: book.value(c) for i, c in cells.items()}
+        if any(v is not None for v in header_cells.values()):
+            break
+
+    width = max(header_cells) + 1 if header_cells else 0
+    return normalize_header([header_cells.get(i) for i in range(width)])
+
+
+def _project(header: list[str], rows, value, resolve, row_col: str | None) -> pd.DataFrame:
+    """DataFrame com as colunas de resolve(header); `rows` = (nº da linha, linha), value(linha, i) -> valor."""
+    mapping = resolve(header)
+
+    idx = [header.index(src) for src in mapping]
+    cols: list[list] = [[] for _ in idx]
+    numbers: list[int] = []
+
+    for number, row in rows:
+        if not row:
+            continue
+        vals = [value(row, i) for i in idx]
+        if all(v is None for v in vals):
+            continue
+        for out, v in zip(cols, vals):
+            out.append(v)
+        numbers.append(number)
+
+    df = pd.DataFrame(
+        {name: pd.Series(values, dtype=object) for name, values in zip(mapping.values(), cols)}
+    )
+    if row_col is not None:
+        df[row_col] = pd.Series(numbers, dtype="int64")
+    return df
+
+
+def read_projected(
+    content: bytes,
+    resolve: Callable[[list[str]], dict[str, str]],
+    sheet: str | None = None,
+    row_col: str | None = None,
+) -> pd.DataFrame:
+    """Lê o workbook uma única vez (em streaming) e só as colunas pedidas.
+
+    `resolve` recebe o cabeçalho normalizado e devolve {coluna_origem: nome_final};
+    pode lançar ValueError se faltarem colunas obrigatórias.
+    `sheet`: nome da folha (sem maiúsculas/espaços); se não existir usa a primeira.
+    `row_col`: se dado, junta o nº da linha Excel de cada registo nessa coluna.
+    """
+    book = _Book(content)
+    try:
+        rows = book.rows(book.zip.open(book.sheet_path(sheet)))
+        header = _header(book, rows)
+        # só as células das colunas projetadas são convertidas
+        return _project(header, rows, lambda cells, i: book.value(cells[i]) if i in cells else None, resolve, row_col)
+    finally:
+        book.zip.close()
+
+
+def sheet_names(source) -> list[str]:
+    """Nomes das folhas (caminho ou file-like); só lê xl/workbook.xml."""
+    with zipfile.ZipFile(source) as z:
+        wb = parse(z.open("xl/workbook.xml")).getroot()
+    return [str(s.get("name")) for s in wb.iter(_NS + "sheet")]
+
+
+# --- Linhas com assinatura (para atualizações incrementais) ---
+# Cada linha ganha uma assinatura dos seus valores (todas as colunas), que
+# não depende do nº da linha nem da forma como o ficheiro guarda o texto
+# (strings partilhadas / inline, estilos). Só as linhas com assinatura nova
+# precisam de ser normalizadas.
+
+
+class SheetRows:
+    """Linhas de uma folha: nº da linha Excel + assinatura dos valores (todas as colunas)."""
+
+    def __init__(self, content: bytes, sheet: str | None = None):
+        book = _Book(content)
+        try:
+            rows = []
+            for number, cells in book.rows(book.zip.open(book.sheet_path(sheet))):
+                if not cells:
+                    continue
+                values = tuple(book.value(cells[i]) if i in cells else None for i in range(max(cells) + 1))
+                # sem as células vazias no fim (a largura da linha não conta)
+                end = len(values)
+                while end and values[end - 1] is None:
+                    end -= 1
+                if end:
+                    rows.append((number, values[:end]))
+        finally:
+            book.zip.close()
+
+        # cabeçalho: primeira linha não vazia
+        self.header: list[str] = normalize_header(rows[0][1]) if rows else []
+        self._rows = rows[1:]
+        self.signatures = [
+            hashlib.blake2b(repr(values).encode("utf-8"), digest_size=16).digest() for _, values in self._rows
+        ]
+
+    def data_rows(self) -> list[tuple[int, bytes]]:
+        """(nº da linha, assinatura) das linhas depois do cabeçalho."""
+        return [(number, sig) for (number, _), sig in zip(self._rows, self.signatures)]
+
+    def read(self, resolve, numbers=None, row_col: str | None = None) -> pd.DataFrame:
+        """Como read_projected, mas só as linhas `numbers` (None = todas)."""
+        rows = self._rows
+        if numbers is not None:
+            wanted = set(numbers)
+            rows = [r for r in rows if r[0] in wanted]
+        return _project(self.header, rows, lambda values, i: values[i] if i < len(values) else None, resolve, row_col)
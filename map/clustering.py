@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+import json
+
+import numpy as np
+from branca.element import MacroElement
+from jinja2 import Template
+
+from data.canonical import COLORS
+
+
+# Clustering no servidor (estilo supercluster): para cada zoom, os sites
+# caem numa grelha de RADIUS_PX píxeis em Web Mercator. As células de um
+# zoom encaixam exatamente nas do zoom seguinte, logo a hierarquia sai de
+# graça. A atribuição site -> célula é feita uma vez por dataset; contar um
+# filtro qualquer é só um bincount.
+
+MIN_ZOOM = 4
+MAX_ZOOM = 14
+RADIUS_PX = 60
+TILE_PX = 256
+_MAX_LAT = 85.05112878
+
+COORD_DECIMALS = 5
+
+# Vista inicial nominal (px) para recortar os zooms mais finos que o inicial
+VIEW_PX = (1600, 650)
+VIEW_PAD = 0.5
+
+
+def _mercator(lats, lons):
+    lat = np.radians(np.clip(np.asarray(lats, dtype=float), -_MAX_LAT, _MAX_LAT))
+    x = (np.asarray(lons, dtype=float) + 180.0) / 360.0
+    y = 0.5 - np.log(np.tan(np.pi / 4 + lat / 2)) / (2 * np.pi)
+    return x, y
+
+
+def view_bounds(lat: float, lon: float, zoom: int, size_px=VIEW_PX, pad: float = VIEW_PAD):
+    """(s, w, n, e) da vista inicial centrada em (lat, lon), com folga `pad`."""
+    world = TILE_PX * 2 ** zoom
+    x, y = _mercator([lat], [lon])
+    half_w = size_px[0] * (0.5 + pad) / world
+    half_h = size_px[1] * (0.5 + pad) / world
+
+    def inv_lat(yy):
+        return float(np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * yy)))))
+
+    y0, y1 = float(np.clip(y[0] - half_h, 0, 1)), float(np.clip(y[0] + half_h, 0, 1))
+    return inv_lat(y1), float(lon - half_w * 360.0), inv_lat(y0), float(lon + half_w * 360.0)
+
+
+class ClusterLevels:
+    def __init__(
+        self,
+        lats,
+        lons,
+        color_codes,
+        codes=None,
+        min_zoom: int = MIN_ZOOM,
+        max_zoom: int = MAX_ZOOM,
+        radius_px: int = RADIUS_PX,
+    ):
+        self.lats = np.asarray(lats, dtype=float)
+        self.lons = np.asarray(lons, dtype=float)
+        self.colors = np.asarray(color_codes, dtype=np.int64)
+        self.codes = None if codes is None else np.asarray(codes, dtype=object)
+        self.zooms = list(range(min_zoom, max_zoom + 1))
+        self.radius_px = radius_px
+
+        x, y = _mercator(self.lats, self.lons)
+        self.cell_of: dict[int, np.ndarray] = {}
+        self.n_cells: dict[int, int] = {}
+        # chave da célula na grelha por id denso (+ ordem das chaves, para remendar)
+        self.cell_keys: dict[int, np.ndarray] = {}
+        self._key_order: dict[int, np.ndarray] = {}
+        for z in self.zooms:
+            keys, inv = np.unique(self._grid_keys(x, y, z), return_inverse=True)
+            self.cell_of[z] = inv.astype(np.int64).ravel()
+            self.cell_keys[z] = keys
+            self._key_order[z] = np.arange(len(keys))
+            self.n_cells[z] = len(keys)
+
+    def _grid_keys(self, x, y, z: int) -> np.ndarray:
+        cells_per_axis = int(np.ceil(TILE_PX * 2 ** z / self.radius_px))
+        cx = np.minimum((x * TILE_PX * 2 ** z // self.radius_px).astype(np.int64), cells_per_axis - 1)
+        cy = np.minimum((y * TILE_PX * 2 ** z // self.radius_px).astype(np.int64), cells_per_axis - 1)
+        return cx * cells_per_axis + cy
+
+    def patched(self, keep, lats, lons, color_codes, codes=None) -> "ClusterLevels":
+        """Linhas `keep` desta hierarquia + linhas novas no fim; só as novas vão à grelha.
+
+        As células que ficam sem sites continuam com id (contagem zero).
+        """
+        keep = np.asarray(keep, dtype=np.int64)
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+
+        out = ClusterLevels.__new__(ClusterLevels)
+        out.zooms = self.zooms
+        out.radius_px = self.radius_px
+        out.lats = np.concatenate([self.lats[keep], lats])
+        out.lons = np.concatenate([self.lons[keep], lons])
+        out.colors = np.concatenate([self.colors[keep], np.asarray(color_codes, dtype=np.int64)])
+        out.codes = None if self.codes is None or codes is None else np.concatenate(
+            [self.codes[keep], np.asarray(codes, dtype=object)]
+        )
+        out.cell_of, out.n_cells, out.cell_keys, out._key_order = {}, {}, {}, {}
+
+        x, y = _mercator(lats, lons)
+        for z in self.zooms:
+            keys, order = self.cell_keys[z], self._key_order[z]
+            sorted_keys = keys[order]
+            raw = self._grid_keys(x, y, z)
+
+            at = np.searchsorted(sorted_keys, raw)
+            found = at < len(sorted_keys)
+            found[found] = sorted_keys[at[found]] == raw[found]
+            ids = np.empty(len(raw), dtype=np.int64)
+            ids[found] = order[at[found]]
+
+            novel, inv = np.unique(raw[~found], return_inverse=True)
+            ids[~found] = len(keys) + inv.ravel()
+            if len(novel):
+                ins = np.searchsorted(sorted_keys, novel)
+                order = np.insert(order, ins, np.arange(len(keys), len(keys) + len(novel)))
+                keys = np.concatenate([keys, novel])
+
+            out.cell_of[z] = np.concatenate([self.cell_of[z][keep], ids])
+            out.cell_keys[z] = keys
+            out._key_order[z] = order
+            out.n_cells[z] = len(keys)
+        return out
+
+    def aggregate(self, positions, full_until: int | None = None, bounds=None) -> dict[int, dict]:
+        """Agregados por zoom para o subconjunto `positions` (linhas do dataset).
+
+        Cada agregado: [lat, lon, n_verde, n_vermelho, n_preto, n_cinza, s, w, n, e]
+        (+ código do site quando a célula tem um só site, no zoom máximo).
+        Zooms > `full_until` só levam as células dentro de `bounds` (s, w, n, e).
+        """
+        pos = np.asarray(positions, dtype=np.int64)
+        lats, lons, cols = self.lats[pos], self.lons[pos], self.colors[pos]
+        k = len(COLORS)
+
+        out = {}
+        for z in self.zooms:
+            cell = self.cell_of[z][pos]
+            m = self.n_cells[z]
+            clip = bounds if (full_until is not None and bounds is not None and z > full_until) else None
+            if len(pos) == 0:
+                out[z] = {"b": clip, "r": []}
+                continue
+
+            counts = np.bincount(cell * k + cols, minlength=m * k).reshape(m, k)
+            total = counts.sum(axis=1)
+            used = np.flatnonzero(total)
+
+            lat_c = np.bincount(cell, weights=lats, minlength=m)[used] / total[used]
+            lon_c = np.bincount(cell, weights=lons, minlength=m)[used] / total[used]
+
+            # caixa de cada célula (para o zoom ao clicar)
+            order = np.argsort(cell, kind="stable")
+            starts = np.searchsorted(cell[order], used)
+            s = np.minimum.reduceat(lats[order], starts)
+            n = np.maximum.reduceat(lats[order], starts)
+            w = np.minimum.reduceat(lons[order], starts)
+            e = np.maximum.reduceat(lons[order], starts)
+
+            keep = np.ones(len(used), dtype=bool)
+            if clip is not None:
+                keep = (lat_c >= clip[0]) & (lon_c >= clip[1]) & (lat_c <= clip[2]) & (lon_c <= clip[3])
+
+            rows = np.column_stack([lat_c, lon_c, s, w, n, e])[keep].round(COORD_DECIMALS).tolist()
+            cnt = counts[used][keep].tolist()
+            level = [[r[0], r[1], *c, r[2], r[3], r[4], r[5]] for r, c in zip(rows, cnt)]
+
+            if z == self.zooms[-1] and self.codes is not None:
+                codes_sorted = self.codes[pos][order]
+                for row, t, i in zip(level, total[used][keep].tolist(), starts[keep].tolist()):
+                    if t == 1:
+                        row.append(codes_sorted[i])
+            out[z] = {"b": None if clip is None else [round(v, COORD_DECIMALS) for v in clip], "r": level}
+        return out
+
+
+class ClusterLayer(MacroElement):
+    """Só agregados; desenha apenas os que estão (quase) no ecrã, por zoom."""
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        (function () {
+            var map = {{ this._parent.get_name() }};
+            var colors = {{ this.colors }};
+            var levels = {{ this.levels }};
+            var zooms = Object.keys(levels).map(Number).sort(function (a, b) { return a - b; });
+            var group = L.layerGroup().addTo(map);
+
+            function esc(s) {
+                return String(s).replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;");
+            }
+
+            // zoom mais fino <= z cuja área (se recortada) contém o centro da vista
+            function levelFor(z) {
+                var c = map.getCenter();
+                for (var i = zooms.length - 1; i >= 0; i--) {
+                    var lv = levels[zooms[i]], b = lv.b;
+                    if (zooms[i] > z && i > 0) continue;
+                    if (!b || (c.lat >= b[0] && c.lng >= b[1] && c.lat <= b[2] && c.lng <= b[3])) return lv.r;
+                }
+                return [];
+            }
+
+            function clusterMarker(r) {
+                var g = r[2], d = r[3], k = r[4], o = r[5], t = g + d + k + o;
+                var ll = [r[0], r[1]];
+                if (t === 1) {
+                    var c = colors[g ? 0 : d ? 1 : k ? 2 : 3];
+                    var m = L.circleMarker(ll, {color: c, fillColor: c, fill: true, fillOpacity: 1, radius: 5, weight: 2});
+                    if (r.length > 10) m.bindTooltip(esc(r[10]));
+                    return m;
+                }
+                var a = 100 * g / t, b = a + 100 * d / t, e = b + 100 * k / t;
+                var size = Math.round(26 + 8 * Math.log10(t));
+                var ring = "conic-gradient(" + colors[0] + " 0 " + a + "%, " + colors[1] + " " + a + "% " + b + "%, "
+                    + colors[2] + " " + b + "% " + e + "%, " + colors[3] + " " + e + "% 100%)";
+                var html = '<div style="width:' + size + 'px;height:' + size + 'px;border-radius:50%;background:' + ring + ';'
+                    + 'display:flex;align-items:center;justify-content:center;">'
+                    + '<span style="background:#fff;border-radius:50%;min-width:' + (size - 10) + 'px;line-height:' + (size - 10) + 'px;'
+                    + 'text-align:center;font-size:11px;font-weight:700;color:#000;">' + t + '</span></div>';
+                var m = L.marker(ll, {icon: L.divIcon({className: "empty", html: html, iconSize: [size, size], iconAnchor: [size / 2, size / 2]})});
+                m.bindTooltip("ONAIR " + g + " · DOWN " + d + " · INFRA " + k + (o ? " · Outros " + o : ""));
+                m.on("click", function () { map.fitBounds([[r[6], r[7]], [r[8], r[9]]], {maxZoom: map.getZoom() + 3}); });
+                return m;
+            }
+
+            function render() {
+                var view = map.getBounds().pad(0.5);
+                group.clearLayers();
+                levelFor(map.getZoom()).forEach(function (r) {
+                    if (view.contains([r[0], r[1]])) group.addLayer(clusterMarker(r));
+                });
+            }
+
+            map.on("moveend", render);
+            render();
+        })();
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, levels: dict[int, dict]):
+        super().__init__()
+        self._name = "ClusterLayer"
+        self.levels = json.dumps(
+            {str(z): lv for z, lv in levels.items()}, ensure_ascii=False, separators=(",", ":")
+        ).replace("</", "<\\/")
+        self.colors = json.dumps(COLORS)
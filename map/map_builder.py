@@ -1,14 +1,22 @@
 import re
 import folium
+import numpy as np
 from folium.plugins import MarkerCluster
 
+from data.canonical import COLOR_COL, GW_COL, NO_TEAM_COLOR, TEAM_COL, TEAM_COLORS, add_status_columns
+from map.clustering import ClusterLayer, view_bounds
+from map.sites_layer import SitesLayer
+from utils import perf
+from utils.geo_utils import distances_km
 
-BLACK_ISSUES = {
-    "FALLEN TOWER",
-    "FORBIDDEN TOWER",
-    "FALLEN MAST",
-    "INFRA",
-}
+
+# "markers" = um objeto folium por site; "geojson" = FeatureCollection único desenhado no browser
+RENDER_MODES = ("markers", "geojson")
+
+ZOOM_START = 10
+
+# Cluster no servidor: sites a menos disto do utilizador vão como marcadores individuais
+DETAIL_KM = 20.0
 
 
 def _norm_text(s: str) -> str:
@@ -18,45 +26,28 @@ def _norm_text(s: str) -> str:
     return s.upper()
 
 
-def build_map(df, user_lat, user_lon, use_cluster=True, route_order=None):
-    if route_order is None:
-        route_order = []
-
-    mapa = folium.Map(location=[user_lat, user_lon], zoom_start=10, control_scale=True)
-
-    # Utilizador
-    folium.Marker(
-        location=[user_lat, user_lon],
-        popup="📍 Tu estás aqui",
-        icon=folium.Icon(color="blue", icon="user"),
-    ).add_to(mapa)
-
-    layer = MarkerCluster().add_to(mapa) if use_cluster else mapa
-
-    # --- MARKERS ---
-    for _, row in df.iterrows():
-        lat = float(row["Latitudine"])
-        lon = float(row["Longitudine"])
-
-        cod = _norm_text(row.get("Cod Site", "SEM_CODIGO"))
-        issue_raw = row.get("Issue", "Sem alerta")
-        issue_clean = re.sub(r"\s+", " ", str(issue_raw).replace("\n", " ").replace("\r", " ")).strip()
-        issue_u = _norm_text(issue_raw)
-
-        tip = _norm_text(row.get("Tip Alarma", ""))
-        gw_type = _norm_text(row.get("GW", ""))
-
-        # Cor
-        if issue_u in BLACK_ISSUES:
-            color = "black"
-        else:
-            if tip == "ONAIR":
-                color = "green"
-            elif tip == "DOWN":
-                color = "red"
-            else:
-                color = "gray"
+def _add_markers(layer, df, colors=None):
+    """Modo "markers": 1-2 objetos folium por site, cada um com o seu HTML."""
+    # Cor / GW / textos já vêm normalizados do load (data.canonical)
+    df = add_status_columns(df)
+    n = len(df)
+    if colors is None:
+        colors = df[COLOR_COL].tolist()
+    tips = df["Tip Alarma"].tolist()
+    gws = df["GW"].tolist()
+    lants = df["Lant"].tolist() if "Lant" in df.columns else [""] * n
 
+    for lat, lon, cod, issue_clean, color, is_gw, tip_raw, gw_raw, lant in zip(
+        df["Latitudine"].astype(float).tolist(),
+        df["Longitudine"].astype(float).tolist(),
+        df["Cod Site"].tolist(),
+        df["Issue"].tolist(),
+        colors,
+        df[GW_COL].tolist(),
+        tips,
+        gws,
+        lants,
+    ):
         popup_html = f"""
         <div style="min-width:190px;">
           <b style="font-size:14px;">{cod}</b><br>
@@ -65,15 +56,15 @@ def build_map(df, user_lat, user_lon, use_cluster=True, route_order=None):
             <span style="color:{color}; font-weight:700;">⚑ {issue_clean}</span>
           </div>
           <div style="margin-top:6px; font-size:12px; color:#333;">
-            Tip Alarma: {row.get("Tip Alarma", "")}<br>
-            Tipo: {row.get("GW", "")}<br>
-            Lant: {row.get("Lant", "")}
+            Tip Alarma: {tip_raw}<br>
+            Tipo: {gw_raw}<br>
+            Lant: {lant}
           </div>
         </div>
         """
 
         # --- GW = ESTRELA (tamanho da bola) ---
-        if gw_type == "GW":
+        if is_gw:
             # Bola é radius=7 (diametro ~14px). Estrela ~14px para ficar equivalente.
             # Caixa do icon: 22x22 para ancorar no centro sem distorções.
             icon_size = 22
@@ -148,15 +139,108 @@ def build_map(df, user_lat, user_lon, use_cluster=True, route_order=None):
                 popup=folium.Popup(popup_html, max_width=320),
             ).add_to(layer)
 
+
+def build_map(
+    df,
+    user_lat,
+    user_lon,
+    use_cluster=True,
+    route_order=None,
+    mode="markers",
+    cluster_levels=None,
+    detail_km=DETAIL_KM,
+    show_user=True,
+    teams=None,
+    color_by=None,
+):
+    """`teams` = [(nome, lat, lon)] no modo despacho: sites coloridos pela equipa (df[TEAM_COL]).
+
+    `color_by` = (coluna, paleta): cor de cada site = paleta[df[coluna] % len(paleta)]
+    em vez da cor do estado (p.ex. tempo em DOWN, do histórico); códigos
+    negativos ficam com NO_TEAM_COLOR.
+    """
+    if route_order is None:
+        route_order = []
+
+    mapa = folium.Map(location=[user_lat, user_lon], zoom_start=ZOOM_START, control_scale=True)
+
+    # Utilizador (sem ele, p.ex. em snapshots headless, a vista ajusta-se aos sites)
+    if show_user:
+        folium.Marker(
+            location=[user_lat, user_lon],
+            popup="📍 Tu estás aqui",
+            icon=folium.Icon(color="blue", icon="user"),
+        ).add_to(mapa)
+    elif not df.empty:
+        mapa.fit_bounds([
+            [float(df["Latitudine"].min()), float(df["Longitudine"].min())],
+            [float(df["Latitudine"].max()), float(df["Longitudine"].max())],
+        ])
+
+    # --- EQUIPAS (despacho) ---
+    if teams:
+        team_colors = [TEAM_COLORS[i % len(TEAM_COLORS)] for i in range(len(teams))]
+        for (name, lat, lon), color in zip(teams, team_colors):
+            folium.Marker(
+                location=[lat, lon],
+                popup=f"🚚 {name}",
+                tooltip=name,
+                icon=folium.DivIcon(
+                    html=f'<div style="width:18px;height:18px;background:{color};border:2px solid #000;'
+                    f'transform:translate(-9px,-9px);"></div>'
+                ),
+            ).add_to(mapa)
+        color_by = color_by or (TEAM_COL, TEAM_COLORS)
+    if color_by is not None:
+        # os agregados do cluster no servidor são por estado, não pela cor pedida
+        cluster_levels = None
+
+    # --- CLUSTER ---
+    # Com cluster_levels (map.clustering, índice = posições no dataset): o browser
+    # só recebe agregados + os sites perto do utilizador. Sem eles: MarkerCluster.
+    df_sites = df
+    if use_cluster and cluster_levels is not None:
+        layer = mapa
+        if "Distância (km)" in df.columns:
+            dist = df["Distância (km)"].to_numpy()
+        else:
+            dist = distances_km(user_lat, user_lon, df["Latitudine"].to_numpy(), df["Longitudine"].to_numpy())
+        near = dist <= detail_km
+        df_sites = df[near]
+        with perf.span("map.clusters", sites=int((~near).sum())):
+            levels = cluster_levels.aggregate(
+                df.index.to_numpy()[~near],
+                full_until=ZOOM_START,
+                bounds=view_bounds(user_lat, user_lon, ZOOM_START),
+            )
+        ClusterLayer(levels).add_to(mapa)
+    else:
+        layer = MarkerCluster().add_to(mapa) if use_cluster else mapa
+
+    # --- MARKERS ---
+    if mode not in RENDER_MODES:
+        raise ValueError(f"Modo de renderização desconhecido: {mode!r} (usa {RENDER_MODES})")
+    with perf.span("map.sites", mode=mode, sites=len(df_sites)):
+        if color_by is not None:
+            col, palette = color_by
+            # códigos negativos (p.ex. sites sem equipa) -> cor neutra no fim da paleta
+            codes = df_sites[col].to_numpy()
+            codes = np.where(codes < 0, len(palette), codes % len(palette))
+            palette = [*palette, NO_TEAM_COLOR]
+            if mode == "geojson":
+                SitesLayer(df_sites, color_codes=codes.tolist(), colors=palette).add_to(layer)
+            else:
+                _add_markers(layer, df_sites, colors=[palette[k] for k in codes])
+        elif mode == "geojson":
+            SitesLayer(df_sites).add_to(layer)
+        else:
+            _add_markers(layer, df_sites)
+
     # --- ROTA (linha fina e preta) ---
     if route_order:
-        df_idx = df.copy()
-        df_idx["Cod Site"] = df_idx["Cod Site"].astype(str).map(_norm_text)
-
-        coords_by_site = {
-            r["Cod Site"]: (float(r["Latitudine"]), float(r["Longitudine"]))
-            for _, r in df_idx.iterrows()
-        }
+        coords_by_site = dict(
+            zip(df["Cod Site"].tolist(), zip(df["Latitudine"].astype(float), df["Longitudine"].astype(float)))
+        )
 
         route_points = []
         for s in route_order:
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+from utils import perf
+
+
+# Cache do HTML final do mapa, partilhada por todas as sessões do processo.
+# Chave = (dataset, filtros, rota, posição arredondada, ...); evicção LRU
+# por nº de entradas e por bytes (UTF-8: popups com acentos, Cirílico, ...).
+MAX_CACHE_BYTES = int(float(os.environ.get("TASKFORCE_MAP_CACHE_MB", "256")) * 1024 * 1024)
+MAX_ENTRIES = int(os.environ.get("TASKFORCE_MAP_CACHE_ENTRIES", "64"))
+
+
+class RenderCache:
+    def __init__(self, max_bytes: int = MAX_CACHE_BYTES, max_entries: int = MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        # key -> (html, bytes em UTF-8)
+        self._items: OrderedDict[Hashable, tuple[str, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> str | None:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Hashable, html: str) -> None:
+        size = len(html.encode("utf-8"))
+        if size > self.max_bytes:
+            return  # nunca caberia; não vale a pena esvaziar a cache por ele
+
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._items[key] = (html, size)
+            self._bytes += size
+
+            while self._items and (self._bytes > self.max_bytes or len(self._items) > self.max_entries):
+                _, (_, evicted) = self._items.popitem(last=False)
+                self._bytes -= evicted
+
+    def get_or_render(self, key: Hashable, render: Callable[[], str]) -> str:
+        html = self.get(key)
+        if html is None:
+            perf.count("cache.map_html.miss")
+            html = render()
+            self.put(key, html)
+        else:
+            perf.count("cache.map_html.hit")
+        return html
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def map_to_html(mapa) -> str:
+    """Igual ao folium_static: envolve o Map numa Figure e faz render."""
+    import folium
+
+    with perf.span("map.html"):
+        return folium.Figure().add_child(mapa).render()
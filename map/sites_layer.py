@@ -0,0 +1,140 @@
+import json
+
+from branca.element import MacroElement
+from jinja2 import Template
+
+from data.canonical import COLOR_COL, COLORS, GW_COL, add_status_columns
+
+
+# Modo "geojson": todos os sites vão num único FeatureCollection com
+# propriedades curtas; marcadores, estrelas GW, labels e popups são
+# desenhados no browser por UMA função partilhada (mesmo aspeto que o
+# modo "markers", mas sem HTML repetido por site).
+#
+# Propriedades: c=Cod Site, i=Issue, t=Tip Alarma, w=GW (texto),
+#               g=1 se GW, l=Lant, k=índice da cor em COLORS
+
+COORD_DECIMALS = 6
+
+
+def sites_feature_collection(df, color_codes=None) -> dict:
+    """`color_codes`: índices na paleta por site (por omissão: cor do estado)."""
+    df = add_status_columns(df)
+    n = len(df)
+    lants = df["Lant"].tolist() if "Lant" in df.columns else [""] * n
+    if color_codes is None:
+        color_codes = df[COLOR_COL].cat.codes.tolist()
+
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [round(lon, COORD_DECIMALS), round(lat, COORD_DECIMALS)]},
+            "properties": {"c": cod, "i": issue, "t": tip, "w": gw, "g": int(is_gw), "l": lant, "k": k},
+        }
+        for lat, lon, cod, issue, tip, gw, is_gw, lant, k in zip(
+            df["Latitudine"].astype(float).tolist(),
+            df["Longitudine"].astype(float).tolist(),
+            df["Cod Site"].astype(str).tolist(),
+            df["Issue"].astype(str).tolist(),
+            df["Tip Alarma"].astype(str).tolist(),
+            df["GW"].astype(str).tolist(),
+            df[GW_COL].tolist(),
+            lants,
+            color_codes,
+        )
+    ]
+    return {"type": "FeatureCollection", "features": features}
+
+
+def _dumps(obj) -> str:
+    # JSON embebido num <script>: evitar que "</script>" feche a tag
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).replace("</", "<\\/")
+
+
+class SitesLayer(MacroElement):
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        (function () {
+            var colors = {{ this.colors }};
+            var data = {{ this.data }};
+            var target = {{ this._parent.get_name() }};
+
+            function esc(s) {
+                return String(s == null ? "" : s)
+                    .replace(/&/g, "&amp;").replace(/</g, "&lt;")
+                    .replace(/>/g, "&gt;").replace(/"/g, "&quot;");
+            }
+
+            var labelStyle = "font-size:11px; font-weight:700; color:#000; white-space:nowrap;"
+                + " text-shadow: 0 0 2px rgba(255,255,255,0.8);";
+
+            function popupHtml(p) {
+                return '<div style="width: 100.0%; height: 100.0%;"><div style="min-width:190px;">'
+                    + '<b style="font-size:14px;">' + esc(p.c) + '</b><br>'
+                    + '<div style="margin-top:6px; padding:4px 8px; display:inline-block;'
+                    + ' border-radius:6px; background:rgba(0,0,0,0.08);">'
+                    + '<span style="color:' + colors[p.k] + '; font-weight:700;">⚑ ' + esc(p.i) + '</span></div>'
+                    + '<div style="margin-top:6px; font-size:12px; color:#333;">'
+                    + 'Tip Alarma: ' + esc(p.t) + '<br>Tipo: ' + esc(p.w) + '<br>Lant: ' + esc(p.l)
+                    + '</div></div></div>';
+            }
+
+            function starIcon(p) {
+                // Bola é radius=7 (~14px); estrela equivalente numa caixa 22x22 ancorada ao centro
+                return L.divIcon({
+                    className: "empty",
+                    iconSize: [22, 22],
+                    iconAnchor: [11, 11],
+                    html: '<div style="position: relative; width:22px; height:22px;">'
+                        + '<div style="position:absolute; left:50%; top:50%; transform: translate(-50%, -50%);'
+                        + ' font-size:28px; line-height:28px; color:' + colors[p.k] + ';">★</div>'
+                        + '<div style="position:absolute; left:50%; top:24px; transform: translateX(-50%); '
+                        + labelStyle + '">' + esc(p.c) + '</div></div>'
+                });
+            }
+
+            function labelIcon(p) {
+                return L.divIcon({
+                    className: "empty",
+                    html: '<div style="position: relative; left: 10px; top: -18px; '
+                        + labelStyle + '">' + esc(p.c) + '</div>'
+                });
+            }
+
+            function popupOf(p) {
+                return function () { return popupHtml(p); };
+            }
+
+            var layers = [];
+            data.features.forEach(function (f) {
+                var p = f.properties;
+                var ll = L.latLng(f.geometry.coordinates[1], f.geometry.coordinates[0]);
+
+                if (p.g) {
+                    layers.push(L.marker(ll, {icon: starIcon(p)}).bindPopup(popupOf(p), {maxWidth: 320}));
+                } else {
+                    var c = colors[p.k];
+                    layers.push(L.circleMarker(ll, {
+                        color: c, fillColor: c, fill: true, fillOpacity: 1, opacity: 1.0, radius: 7, weight: 3
+                    }));
+                    layers.push(L.marker(ll, {icon: labelIcon(p)}).bindPopup(popupOf(p), {maxWidth: 320}));
+                }
+            });
+
+            // MarkerCluster adiciona em lote; no mapa simples vai num único grupo
+            if (target.addLayers) {
+                target.addLayers(layers);
+            } else {
+                L.featureGroup(layers).addTo(target);
+            }
+        })();
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, df, color_codes=None, colors=None):
+        super().__init__()
+        self._name = "SitesLayer"
+        self.data = _dumps(sites_feature_collection(df, color_codes))
+        self.colors = _dumps(COLORS if colors is None else colors)
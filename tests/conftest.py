@@ -0,0 +1,42 @@
+import io
+import os
+import tempfile
+
+import pytest
+from openpyxl import Workbook
+
+# antes de importar data.*: nada de cache em disco / histórico / motor de rotas da máquina
+os.environ["TASKFORCE_CACHE_DIR"] = tempfile.mkdtemp(prefix="taskforce-tests-")
+os.environ["TASKFORCE_DISK_CACHE"] = "0"
+os.environ["TASKFORCE_HISTORY"] = "0"
+os.environ["TASKFORCE_ROUTING_URL"] = ""
+
+LOC_HEADER = ["Cod Site", "Site name", "Latitudine", "Longitudine"]
+ALERT_HEADER = ["Site code", "Issue", "Tip Alarma", "GW", "Comments", "Lant"]
+
+
+def xlsx(sheets: list[tuple[str, list, list[list]]]) -> bytes:
+    """Livro .xlsx (openpyxl) com as folhas [(nome, cabeçalho, linhas)]."""
+    wb = Workbook(write_only=True)
+    for name, header, rows in sheets:
+        ws = wb.create_sheet(name)
+        ws.append(header)
+        for r in rows:
+            ws.append(r)
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+@pytest.fixture
+def locations_book():
+    def make(rows):
+        return xlsx([("Baza", LOC_HEADER, rows)])
+    return make
+
+
+@pytest.fixture
+def alerts_book():
+    def make(rows, header=ALERT_HEADER):
+        return xlsx([("Sumar", ["Total"], [[len(rows)]]), ("TOATE ALERTELE", header, rows)])
+    return make
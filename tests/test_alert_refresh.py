@@ -0,0 +1,167 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import ALERT_HEADER
+from data import data_loader
+from data.alert_refresh import ADDED, CHANGED, REMOVED, AlertVersion
+from data.canonical import COLOR_COL, ROW_COL
+from map.clustering import ClusterLevels
+
+LOCATIONS = [[f"S{i}", f"Site {i}", 45.0 + i / 100, 25.0 + i / 100] for i in range(8)]
+ALERTS = [
+    ["S0", "Power", "Down", "GW", None, 1000.0],
+    ["S1", "Theft of battery", "OnAir", "NGW", "Técnico no local", 1000.0],
+    ["S2", "Infra", "Down", "NGW", None, 1001.0],
+    ["S3", "Power", "Down", "NGW", None, None],
+    ["S3", "Transmission", "OnAir", "GW", None, 1001.0],
+    ["S4", "Infra", "OnAir", "NGW", "Acces interzis", 1002.0],
+]
+
+
+@pytest.fixture
+def books(locations_book, alerts_book):
+    return locations_book(LOCATIONS), alerts_book
+
+
+def _full(loc_bytes, alert_bytes):
+    key = data_loader.dataset_key(loc_bytes, alert_bytes)
+    return data_loader._build_version(None, key, loc_bytes, alert_bytes)
+
+
+def _refreshed(prev, loc_bytes, alert_bytes):
+    key = data_loader.dataset_key(loc_bytes, alert_bytes)
+    return data_loader._build_version(prev, key, loc_bytes, alert_bytes)
+
+
+def test_row_signatures_are_computed_once():
+    version = AlertVersion("k", b"xlsx", pd.DataFrame({"x": []}), pd.DataFrame({"Issue": []}))
+    calls, started = [], threading.Event()
+
+    def compute(alert_bytes):
+        calls.append(alert_bytes)
+        started.set()
+        threading.Event().wait(0.05)
+        return ["h"], [(2, b"sig")]
+
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lambda _: version.row_signatures(compute), range(4)))
+    assert calls == [b"xlsx"]
+    assert all(r == (["h"], [(2, b"sig")]) for r in results)
+    assert version.alert_bytes is None
+
+
+def test_parallel_refreshes_from_the_same_version(books):
+    loc, alerts_book = books
+    prev = _full(loc, alerts_book(ALERTS))
+    assert prev.signatures is None  # calculadas só no primeiro refresh
+
+    a = alerts_book([*ALERTS, ["S5", "Power", "Down", "GW", None, 1002.0]])
+    b = alerts_book(ALERTS[1:])
+    barrier = threading.Barrier(2)
+
+    def refresh(alert_bytes):
+        barrier.wait()
+        return _refreshed(prev, loc, alert_bytes)
+
+    with ThreadPoolExecutor(2) as pool:
+        va, vb = pool.map(refresh, [a, b])
+    # os dois remendados a partir de prev (sem cair na leitura completa)
+    assert va.delta is not None and va.delta.prev_key == prev.key
+    assert vb.delta is not None and vb.delta.prev_key == prev.key
+    assert sorted(va.merged["Cod Site"]) == ["S0", "S1", "S2", "S3", "S3", "S4", "S5"]
+    assert sorted(vb.merged["Cod Site"]) == ["S1", "S2", "S3", "S3", "S4"]
+
+
+def _same_as_full(patched: pd.DataFrame, full: pd.DataFrame) -> None:
+    # o remendo mantém a ordem antiga e junta as novas no fim: comparar por nº de linha.
+    # As categorias que deixaram de aparecer podem ficar (contagem zero), o resto é igual.
+    assert patched.dtypes.astype(str).tolist() == full.dtypes.astype(str).tolist()
+    pd.testing.assert_frame_equal(
+        patched.sort_values(ROW_COL, ignore_index=True),
+        full.sort_values(ROW_COL, ignore_index=True),
+        check_categorical=False,
+    )
+
+
+def _edited():
+    new = [r[:] for r in ALERTS]
+    new[1][2] = "Down"  # S1: OnAir -> Down
+    new[4][1] = "Power"  # segundo S3: Transmission -> Power
+    del new[2]  # S2 sai: as linhas seguintes sobem um número
+    new.append(["S6", "Infra", "Down", "GW", None, 1003.0])
+    return new
+
+
+def test_patch_matches_full_load(books):
+    loc, alerts_book = books
+    prev = _full(loc, alerts_book(ALERTS))
+    new = alerts_book(_edited())
+
+    patched = _refreshed(prev, loc, new)
+    full = _full(loc, new)
+
+    assert patched.delta is not None
+    assert patched.delta.n_added == 3  # S6 + as duas alteradas
+    _same_as_full(patched.merged, full.merged)
+    assert patched.issues_all == full.issues_all
+
+    log = patched.changes.changelog()
+    assert log.to_dict("records") == [
+        {"Cod Site": "S1", "Mudança": CHANGED, "Coluna": "Tip Alarma", "Antes": "OnAir", "Depois": "Down"},
+        {"Cod Site": "S2", "Mudança": REMOVED, "Coluna": "", "Antes": "Infra · Down", "Depois": ""},
+        {"Cod Site": "S3", "Mudança": CHANGED, "Coluna": "Issue", "Antes": "Transmission", "Depois": "Power"},
+        {"Cod Site": "S6", "Mudança": ADDED, "Coluna": "", "Antes": "", "Depois": "Infra · Down"},
+    ]
+    assert patched.changes.summary() == "1 novos · 1 removidos · 2 alterados"
+
+
+def test_repeated_and_reordered_rows(books):
+    loc, alerts_book = books
+    prev = _full(loc, alerts_book(ALERTS))
+    # ordem invertida + uma cópia exata de uma linha existente
+    new = alerts_book([*ALERTS[::-1], ALERTS[0]])
+
+    patched = _refreshed(prev, loc, new)
+    assert patched.delta.n_added == 1
+    _same_as_full(patched.merged, _full(loc, new).merged)
+    log = patched.changes.changelog()
+    assert log[["Cod Site", "Mudança"]].values.tolist() == [["S0", ADDED]]
+
+
+def test_header_change_falls_back_to_full_load(books):
+    loc, alerts_book = books
+    prev = _full(loc, alerts_book(ALERTS))
+    header = [*ALERT_HEADER, "Data"]
+    new = alerts_book([[*r, "2024-01-01"] for r in ALERTS], header=header)
+
+    version = _refreshed(prev, loc, new)
+    assert version.delta is None and version.changes is None
+    _same_as_full(version.merged, _full(loc, new).merged)
+
+
+def test_patched_distances_and_clusters(books):
+    loc, alerts_book = books
+    prev = _full(loc, alerts_book(ALERTS))
+    version = _refreshed(prev, loc, alerts_book(_edited()))
+    df, delta = version.merged, version.delta
+
+    data_loader._distance_order.clear()
+    dist, order, _ = data_loader.distance_order(version.key, df, 45.02, 25.02, delta)
+    fresh_dist, fresh_order = data_loader.order_by_distance(df, 45.02, 25.02)
+    np.testing.assert_allclose(dist, fresh_dist)
+    np.testing.assert_array_equal(order, fresh_order)
+
+    def levels(df):
+        return df["Latitudine"], df["Longitudine"], df[COLOR_COL].cat.codes, df["Cod Site"]
+
+    added = df.iloc[len(delta.keep):]
+    patched = ClusterLevels(*levels(delta.prev_df)).patched(delta.keep, *levels(added)[:3], codes=levels(added)[3])
+    fresh = ClusterLevels(*levels(df))
+    every = np.arange(len(df))
+    for z, level in fresh.aggregate(every).items():
+        # ids das células diferentes (as vazias ficam): comparar os agregados
+        assert sorted(patched.aggregate(every)[z]["r"]) == sorted(level["r"])
@@ -0,0 +1,9 @@
+import pandas as pd
+
+from batch import _groups
+
+
+def test_only_lant_matches_normalized_codes():
+    df = pd.DataFrame({"Lant": ["12345", "AB 1", "12345", "X"]})
+    groups = _groups(df, "Lant", ["12345.0", " ab  1 "])
+    assert {k: v.tolist() for k, v in groups.items()} == {"12345": [0, 2], "AB 1": [1]}
@@ -0,0 +1,103 @@
+import math
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+from data.canonical import COLORS
+from map.clustering import COORD_DECIMALS, MAX_ZOOM, MIN_ZOOM, RADIUS_PX, TILE_PX, ClusterLevels
+
+
+def _sites():
+    rng = np.random.default_rng(11)
+    n = 600
+    # Roménia + um grupo denso (mesma célula até zooms altos) + sites repetidos
+    lats = np.r_[rng.uniform(43.6, 48.3, n), 44.4268 + rng.uniform(0, 1e-3, 40), [45.0, 45.0]]
+    lons = np.r_[rng.uniform(20.2, 29.7, n), 26.1025 + rng.uniform(0, 1e-3, 40), [25.0, 25.0]]
+    colors = rng.integers(0, len(COLORS), len(lats))
+    codes = [f"S{i}" for i in range(len(lats))]
+    return lats, lons, colors, codes
+
+
+LATS, LONS, COLS, CODES = _sites()
+
+
+@pytest.fixture(scope="module")
+def levels():
+    return ClusterLevels(LATS, LONS, COLS, CODES)
+
+
+def _reference(positions, z):
+    # grelha de RADIUS_PX píxeis em Web Mercator, site a site
+    cells = defaultdict(list)
+    scale = TILE_PX * 2 ** z / RADIUS_PX
+    for p in positions:
+        lat = math.radians(LATS[p])
+        x = (LONS[p] + 180.0) / 360.0
+        y = 0.5 - math.log(math.tan(math.pi / 4 + lat / 2)) / (2 * math.pi)
+        cells[(math.floor(x * scale), math.floor(y * scale))].append(p)
+    return cells
+
+
+def _by_centroid(rows):
+    return {(r[0], r[1]): r for r in rows}
+
+
+@pytest.mark.parametrize("subset", ["all", "half", "one"])
+def test_counts_and_bounds_per_zoom(levels, subset):
+    n = len(LATS)
+    positions = {"all": np.arange(n), "half": np.arange(0, n, 2), "one": np.array([7])}[subset]
+    out = levels.aggregate(positions)
+    assert sorted(out) == list(range(MIN_ZOOM, MAX_ZOOM + 1))
+
+    for z, level in out.items():
+        ref = _reference(positions, z)
+        rows = level["r"]
+        assert level["b"] is None
+        assert len(rows) == len(ref)
+        assert sum(sum(r[2:6]) for r in rows) == len(positions)
+
+        got = _by_centroid(rows)
+        for members in ref.values():
+            key = (round(float(np.mean(LATS[members])), COORD_DECIMALS), round(float(np.mean(LONS[members])), COORD_DECIMALS))
+            row = got[key]
+            assert row[2:6] == np.bincount(COLS[members], minlength=len(COLORS)).tolist()
+            s, w, nn, e = row[6:10]
+            assert s == round(float(LATS[members].min()), COORD_DECIMALS)
+            assert w == round(float(LONS[members].min()), COORD_DECIMALS)
+            assert nn == round(float(LATS[members].max()), COORD_DECIMALS)
+            assert e == round(float(LONS[members].max()), COORD_DECIMALS)
+            # código do site só no zoom máximo e só em células com um site
+            if z == MAX_ZOOM and len(members) == 1:
+                assert row[10:] == [CODES[members[0]]]
+            else:
+                assert len(row) == 10
+
+
+def test_cells_nest_across_zooms(levels):
+    # cada célula de z+1 cabe numa só célula de z
+    for z in levels.zooms[:-1]:
+        parent = {}
+        for child, up in zip(levels.cell_of[z + 1].tolist(), levels.cell_of[z].tolist()):
+            assert parent.setdefault(child, up) == up
+    # menos (ou tantas) células quanto mais afastado
+    counts = [levels.n_cells[z] for z in levels.zooms]
+    assert counts == sorted(counts)
+
+
+def test_clipped_zooms_keep_only_cells_in_bounds(levels):
+    bounds = (44.0, 25.0, 45.5, 27.0)
+    out = levels.aggregate(np.arange(len(LATS)), full_until=8, bounds=bounds)
+    full = levels.aggregate(np.arange(len(LATS)))
+    for z in levels.zooms:
+        if z <= 8:
+            assert out[z] == full[z]
+            continue
+        assert out[z]["b"] == list(bounds)
+        inside = [r for r in full[z]["r"] if bounds[0] <= r[0] <= bounds[2] and bounds[1] <= r[1] <= bounds[3]]
+        assert out[z]["r"] == inside
+
+
+def test_empty_subset(levels):
+    out = levels.aggregate([])
+    assert all(lv == {"b": None, "r": []} for lv in out.values())
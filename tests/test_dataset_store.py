@@ -0,0 +1,85 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from data.dataset_store import DatasetStore
+
+
+def _version(nbytes=1):
+    return SimpleNamespace(nbytes=nbytes, delta=None)
+
+
+def test_slow_build_does_not_block_other_keys():
+    store = DatasetStore()
+    started, release = threading.Event(), threading.Event()
+
+    def slow(prev):
+        started.set()
+        assert release.wait(5)
+        return _version()
+
+    with ThreadPoolExecutor(2) as pool:
+        slow_get = pool.submit(store.get, "a", "g", slow)
+        assert started.wait(5)
+        # outra key (e stats / lease) enquanto "a" ainda está a ser construída
+        fast = pool.submit(store.get, "b", "g", lambda prev: _version()).result(timeout=2)
+        assert store.stats()["entries"] == 1
+        store.lease("b")
+        release.set()
+        assert slow_get.result(timeout=5) is not fast
+
+
+def test_same_key_is_built_once():
+    store = DatasetStore()
+    calls, release = [], threading.Event()
+
+    def build(prev):
+        calls.append(prev)
+        assert release.wait(5)
+        return _version()
+
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(store.get, "a", "g", build) for _ in range(4)]
+        release.set()
+        results = [f.result(timeout=5) for f in futures]
+    assert len(calls) == 1
+    assert all(r is results[0] for r in results)
+
+
+def test_failed_build_is_not_kept():
+    store = DatasetStore()
+
+    def broken(prev):
+        raise ValueError("ficheiro inválido")
+
+    with pytest.raises(ValueError):
+        store.get("a", "g", broken)
+    assert store.get("a", "g", lambda prev: _version()).nbytes == 1
+    assert store.stats()["entries"] == 1
+
+
+def test_lease_taken_before_build_holds_the_new_entry():
+    store = DatasetStore(max_bytes=10)
+    store.get("old", "g", lambda prev: _version(8))
+    lease = store.lease("new")  # ainda não existe: fica à espera
+
+    # passar do limite não tira a entrada acabada de inserir
+    store.get("new", "g", lambda prev: _version(8))
+    assert store.stats()["leases"] == {"new": 1}
+    assert lease.key == "new"
+
+
+def test_clear_keeps_leased_entries():
+    store = DatasetStore()
+    store.get("a", "g", lambda prev: _version())
+    store.get("b", "g", lambda prev: _version())
+    lease = store.lease("a")
+
+    store.clear()
+    assert store.stats() == {"entries": 1, "bytes": 1, "leases": {"a": 1}}
+
+    del lease
+    store.clear()
+    assert store.stats()["entries"] == 0
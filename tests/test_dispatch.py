@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+import app
+from data.canonical import STATUS_COL, STATUS_DOWN, STATUS_ONAIR, TEAM_COL
+
+TEAMS = [("Norte", 41.15, -8.61), ("Sul", 37.02, -7.93)]
+
+
+def _alerts():
+    # dois alertas no S2 (DOWN); S4 ONAIR ao lado da equipa Norte
+    return pd.DataFrame({
+        "Cod Site": ["S1", "S2", "S2", "S3", "S4", "S5"],
+        "Latitudine": [41.10, 37.10, 37.10, 41.20, 41.15, 37.00],
+        "Longitudine": [-8.60, -7.90, -7.90, -8.50, -8.61, -7.95],
+        STATUS_COL: [STATUS_DOWN, STATUS_DOWN, STATUS_DOWN, STATUS_DOWN, STATUS_ONAIR, STATUS_ONAIR],
+    })
+
+
+def test_onair_sites_are_never_assigned():
+    df, summary = app._dispatch(_alerts(), TEAMS, balanced=False)
+
+    onair = (df[STATUS_COL] == STATUS_ONAIR).to_numpy()
+    assert (df[TEAM_COL].to_numpy()[onair] == -1).all()
+    assert (df["Equipa"].to_numpy()[onair] == "").all()
+    assert np.isnan(df["Distância equipa (km)"].to_numpy()[onair]).all()
+
+    assert df.loc[~onair, "Equipa"].tolist() == ["Norte", "Sul", "Sul", "Norte"]
+    assert summary["Sites"].to_dict() == {"Norte": 2, "Sul": 1}
+
+
+def test_balanced_capacity_counts_only_down_sites():
+    # 3 sites DOWN perto do Norte: capacidade ⌈3 / 2⌉ = 2 (não ⌈5 / 2⌉ = 3)
+    alerts = _alerts().assign(Latitudine=[41.10, 41.12, 41.12, 41.20, 41.15, 37.00], Longitudine=-8.60)
+    df, summary = app._dispatch(alerts, TEAMS, balanced=True)
+
+    assert summary["Sites"].to_dict() == {"Norte": 2, "Sul": 1}
+    assert (df.loc[df[STATUS_COL] == STATUS_ONAIR, TEAM_COL] == -1).all()
+
+
+def test_no_down_sites():
+    alerts = _alerts().assign(**{STATUS_COL: STATUS_ONAIR})
+    df, summary = app._dispatch(alerts, TEAMS, balanced=True)
+
+    assert (df[TEAM_COL] == -1).all()
+    assert summary["Sites"].tolist() == [0, 0]
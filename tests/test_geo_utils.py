@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from geopy.distance import geodesic
+
+from utils.geo_utils import distances_km, haversine_km, vincenty_km
+
+
+def _pairs():
+    # pontos uniformes na esfera + casos difíceis no fim
+    rng = np.random.default_rng(1)
+    n = 500
+    lat1 = np.degrees(np.arcsin(rng.uniform(-1, 1, n)))
+    lat2 = np.degrees(np.arcsin(rng.uniform(-1, 1, n)))
+    lon1, lon2 = rng.uniform(-180, 180, (2, n))
+    special = np.array([
+        (0, 0, 0, 180),  # antipodais no equador (Vincenty não converge)
+        (10, 20, -10, -160),  # antipodais
+        (0, 0, 0.5, 179.7),  # quase antipodais
+        (89.9, 0, -89.9, 180),  # pólo a pólo
+        (45, 25, 45, 25),  # o mesmo ponto
+        (45, 25, 45, 25.00001),  # ~0.8 m
+        (45, 179.9, 45, -179.9),  # antimeridiano
+    ])
+    return (np.r_[lat1, special[:, 0]], np.r_[lon1, special[:, 1]], np.r_[lat2, special[:, 2]], np.r_[lon2, special[:, 3]])
+
+
+@pytest.fixture(scope="module")
+def pairs():
+    lat1, lon1, lat2, lon2 = _pairs()
+    ref = np.array([geodesic(a, b).km for a, b in zip(zip(lat1, lon1), zip(lat2, lon2))])
+    return lat1, lon1, lat2, lon2, ref
+
+
+def test_vincenty_matches_geodesic(pairs):
+    *pts, ref = pairs
+    # < 1 mm, incluindo antipodais (recalculados com o geodesic)
+    np.testing.assert_allclose(vincenty_km(*pts), ref, rtol=0, atol=1e-6)
+
+
+def test_haversine_relative_error(pairs):
+    *pts, ref = pairs
+    h = haversine_km(*pts)
+    far = ref > 0
+    assert np.max(np.abs(h[far] - ref[far]) / ref[far]) < 0.0056
+    assert h[~far].tolist() == [0.0]
+
+
+def test_identical_points_are_zero():
+    lat = np.array([0.0, 45.0, -89.0, 90.0])
+    lon = np.array([0.0, 25.0, 180.0, -30.0])
+    for method in ("haversine", "ellipsoidal"):
+        assert distances_km(lat, lon, lat, lon, method=method).tolist() == [0.0] * 4
+
+
+def test_broadcasting_matrix():
+    o_lat, o_lon = np.array([44.4, 46.8]), np.array([26.1, 23.6])
+    d_lat, d_lon = np.array([45.7, 47.2, 44.3]), np.array([21.2, 27.6, 23.8])
+    m = distances_km(o_lat[:, None], o_lon[:, None], d_lat[None, :], d_lon[None, :])
+    assert m.shape == (2, 3)
+    assert m[1, 2] == pytest.approx(geodesic((46.8, 23.6), (44.3, 23.8)).km, abs=1e-6)
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        distances_km(0, 0, 1, 1, method="flat")
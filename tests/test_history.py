@@ -0,0 +1,93 @@
+import pandas as pd
+import pytest
+
+from data.canonical import STATUS_COL, STATUS_DOWN, STATUS_ONAIR
+from data.history import HistoryStore
+
+H = 3600.0
+
+
+@pytest.fixture
+def store(tmp_path):
+    return HistoryStore(tmp_path / "history.sqlite")
+
+
+def _alerts(states: dict[str, str], issue: str = "Power") -> pd.DataFrame:
+    return pd.DataFrame({
+        "Cod Site": list(states),
+        "Lant": ["L1"] * len(states),
+        "Issue": [issue] * len(states),
+        "Tip Alarma": list(states.values()),
+        STATUS_COL: list(states.values()),
+    })
+
+
+def _record(store, snapshots):
+    # [(hora, {site: estado}) ...], um ficheiro diferente por snapshot
+    for i, (hour, states) in enumerate(snapshots):
+        assert store.record(_alerts(states), f"k{i}", taken_at=hour * H) is not None
+
+
+def _down_h(store, start, end, site="S1"):
+    df = store.downtime(start * H, end * H).set_index("cod_site")
+    return df.loc[site, "down_h"] if site in df.index else 0.0
+
+
+def test_down_up_down(store):
+    _record(store, [
+        (0, {"S1": STATUS_DOWN, "S2": STATUS_ONAIR}),
+        (2, {"S1": STATUS_ONAIR, "S2": STATUS_ONAIR}),
+        (5, {"S1": STATUS_DOWN, "S2": STATUS_ONAIR}),
+    ])
+
+    # [0, 2) em DOWN + [5, 10] ainda em DOWN (período aberto)
+    df = store.downtime(0, 10 * H)
+    assert df["cod_site"].tolist() == ["S1"]
+    assert df.loc[0, "down_h"] == pytest.approx(2 + 5)
+    assert df.loc[0, "periodos"] == 2
+
+    # janela a meio dos períodos: só a parte dentro conta
+    assert _down_h(store, 1, 6) == pytest.approx(1 + 1)
+    assert _down_h(store, 2, 5) == 0.0
+
+    flaps = store.transitions(0, 10 * H, by="cod_site").set_index("cod_site")
+    assert flaps.loc["S1", "transicoes"] == 2
+    assert flaps.loc["S1", "para_down"] == 1
+    assert "S2" not in flaps.index
+
+    assert store.down_since()["S1"] == 5 * H
+
+
+def test_stays_down_across_snapshots(store):
+    _record(store, [
+        (0, {"S1": STATUS_DOWN}),
+        (1, {"S1": STATUS_DOWN, "S2": STATUS_ONAIR}),
+        (3, {"S1": STATUS_DOWN, "S2": STATUS_DOWN}),
+    ])
+    # snapshots iguais para S1 não gravam linhas: um só período desde a hora 0
+    assert store.timeline("S1")["status"].tolist() == [STATUS_DOWN]
+    assert _down_h(store, 0, 8) == pytest.approx(8)
+    assert _down_h(store, 0, 8, "S2") == pytest.approx(5)
+
+    # muda a Issue mas continua DOWN: parte o período sem perder tempo nem contar transição
+    assert store.record(_alerts({"S1": STATUS_DOWN}, issue="Fiber"), "k3", taken_at=4 * H) is not None
+    assert _down_h(store, 0, 8) == pytest.approx(8)
+    assert store.down_since()["S1"] == 0.0
+    assert "S1" not in store.transitions(0, 8 * H, by="cod_site")["cod_site"].tolist()
+
+
+def test_leaves_the_file_and_comes_back(store):
+    _record(store, [
+        (0, {"S1": STATUS_DOWN, "S2": STATUS_ONAIR}),
+        (2, {"S2": STATUS_ONAIR}),
+        (6, {"S1": STATUS_DOWN, "S2": STATUS_ONAIR}),
+    ])
+    # o tempo fora do ficheiro ([2, 6)) não conta como DOWN
+    df = store.downtime(0, 10 * H).set_index("cod_site")
+    assert df.loc["S1", "down_h"] == pytest.approx(2 + 4)
+    assert df.loc["S1", "periodos"] == 2
+
+    # sair / voltar não é uma transição de estado; a sequência DOWN recomeça
+    assert store.transitions(0, 10 * H, by="cod_site").empty
+    assert store.down_since()["S1"] == 6 * H
+    assert store.timeline("S1")["status"].isna().tolist() == [False, True, False]
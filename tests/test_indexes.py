@@ -0,0 +1,224 @@
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data import data_loader
+from data.canonical import STATUS_COL, STATUS_DOWN, STATUSES, add_status_columns
+from data.indexes import CUBE_DIMS, DatasetIndex, MetricsCube, TextIndex, fold, select
+
+DF = pd.DataFrame({
+    "Cod Site": ["BV0101", "BV0102", "CJ2201", "IS3301", "IS3302", "B1001"],
+    "Issue": ["Power", "Power", "Transmisie", "Power", "Fibră tăiată", "Power"],
+    "Comments": ["Grup electrogen în drum", "", "Ştefan: ţeavă spartă", "așteaptă ENEL", np.nan, "Aşteaptă enel"],
+})
+
+
+def _brute(df, query):
+    # token a token, linha a linha
+    terms = re.findall(r"\w+", fold(query))
+    rows = []
+    for _, r in df.iterrows():
+        tokens = [t for c in ("Cod Site", "Issue", "Comments") if pd.notna(r[c]) for t in re.findall(r"\w+", fold(r[c]))]
+        rows.append(all(any(t.startswith(q) for t in tokens) for q in terms))
+    return np.array(rows)
+
+
+@pytest.fixture(scope="module")
+def texts():
+    return TextIndex(DF)
+
+
+@pytest.mark.parametrize("query", [
+    "power", "POW", "bv01", "bv0102", "is33 power",
+    "asteapta", "așteaptă", "aşteaptă enel",  # ș (vírgula) e ş (cedilha) dão o mesmo
+    "teava", "ţeavă", "stefan", "fibra taiata", "fibră",
+    "electrogen drum", "enel power", "zzz", "b", "1001",
+])
+def test_search_matches_brute_force(texts, query):
+    np.testing.assert_array_equal(texts.search(query), _brute(DF, query))
+
+
+def test_diacritics_and_case_fold_to_the_same_rows(texts):
+    assert texts.search("așteaptă").tolist() == texts.search("ASTEAPTA").tolist() == [False, False, False, True, False, True]
+    assert texts.search("ţeavă").tolist() == texts.search("țeavă").tolist()
+
+
+def test_empty_query_is_no_filter(texts):
+    assert texts.search("") is None
+    assert texts.search("  ,.; ") is None
+
+
+def test_missing_columns_and_empty_frame():
+    only_code = TextIndex(DF[["Cod Site"]])
+    assert only_code.search("power").sum() == 0
+    assert only_code.search("cj").tolist() == [False, False, True, False, False, False]
+
+    empty = TextIndex(DF.iloc[:0])
+    assert empty.search("power").tolist() == []
+    assert empty.suggest("p") == []
+
+
+def test_suggest_by_number_of_rows(texts):
+    # "power" está em 4 linhas, "pow..." não tem outro token
+    assert texts.suggest("po") == ["power"]
+    assert texts.suggest("e")[:2] == ["enel", "electrogen"]
+    assert texts.suggest("grup electrogen e", limit=1) == ["enel"]
+    assert texts.suggest("qq") == []
+
+
+# --- Filtros por máscara e cubo de métricas ---
+
+def _frame():
+    rng = np.random.default_rng(5)
+    n = 300
+    df = pd.DataFrame({
+        "Cod Site": [f"S{i % 120}" for i in range(n)],
+        "Lant": rng.choice(["1000", "1001", "1002", ""], n),
+        "Issue": rng.choice(["Power", "Infra", "Theft of battery", "Transmission", ""], n),
+        "Tip Alarma": rng.choice(["OnAir", "Down", "Planned", ""], n),
+        "GW": rng.choice(["GW", "NGW"], n),
+    })
+    for c in CUBE_DIMS:
+        df[c] = df[c].astype("category")
+    # categoria sem linhas (como depois de um remendo) e linhas sem categoria (código -1)
+    df["Issue"] = df["Issue"].cat.add_categories(["Stale"])
+    df.loc[::37, "Issue"] = np.nan
+    return add_status_columns(df)
+
+
+FRAME = _frame()
+NEAR = np.random.default_rng(6).random(len(FRAME)) < 0.4  # p.ex. filtro de proximidade
+
+
+@pytest.mark.parametrize("lant", [None, "1001", "", "9999"])
+@pytest.mark.parametrize("issues", [None, ["Power"], ["Infra", "Theft of battery", "Stale"], []])
+@pytest.mark.parametrize("mask", [None, NEAR])
+def test_cube_matches_groupby(lant, issues, mask):
+    cube = MetricsCube(FRAME)
+    sub = FRAME if mask is None else FRAME[mask]
+    if lant is not None:
+        sub = sub[sub["Lant"] == lant]
+    if issues is not None:
+        sub = sub[sub["Issue"].isin(issues)]
+
+    counts = sub[STATUS_COL].value_counts()
+    assert cube.status_counts(lant, issues, mask) == {"total": len(sub), **{s: int(counts[s]) for s in STATUSES}}
+
+    for dim in CUBE_DIMS:
+        for status in (None, STATUS_DOWN):
+            rows = sub if status is None else sub[sub[STATUS_COL] == status]
+            ref = rows[dim].astype(str).value_counts()
+            ref = ref[ref.index != ""]
+            got = cube.breakdown(dim, status, lant, issues, mask)
+            assert got.to_dict() == ref.to_dict()
+            assert got.is_monotonic_decreasing
+
+
+def test_cube_without_lant_column():
+    cube = MetricsCube(FRAME.drop(columns="Lant"))
+    assert not cube.has_lant
+    assert cube.status_counts()["total"] == len(FRAME)
+    assert cube.breakdown("Lant").empty
+
+
+def test_dataset_index_masks():
+    index = DatasetIndex(FRAME)
+    assert index.all().all()
+    np.testing.assert_array_equal(index.lant_mask("1002"), FRAME["Lant"] == "1002")
+    assert not index.lant_mask("9999").any()
+    np.testing.assert_array_equal(index.issue_mask(["Power", "Stale", "nope"]), FRAME["Issue"] == "Power")
+    assert not index.issue_mask([]).any()
+    np.testing.assert_array_equal(
+        index.status_mask(["DOWN", "OUTRO"]), FRAME[STATUS_COL].isin(["DOWN", "OUTRO"])
+    )
+
+
+def test_select_keeps_distance_order():
+    index = DatasetIndex(FRAME)
+    dist = np.random.default_rng(7).random(len(FRAME))
+    order = np.argsort(dist, kind="stable")
+    mask = index.lant_mask("1000") & index.status_mask([STATUS_DOWN])
+
+    out = select(FRAME, mask, dist, order)
+    ref = FRAME[mask].assign(**{"Distância (km)": dist[mask]}).sort_values("Distância (km)", kind="stable")
+    pd.testing.assert_frame_equal(out, ref)
+
+
+# --- Índices reconstruídos para uma versão nova dos alertas ---
+
+LOCATIONS = [[f"S{i}", f"Site {i}", 45.0 + i / 100, 25.0 + i / 100] for i in range(6)]
+ALERTS = [
+    ["S0", "Power", "Down", "GW", "Grup electrogen", 1000.0],
+    ["S1", "Infra", "OnAir", "NGW", None, 1000.0],
+    ["S2", "Transmission", "Down", "NGW", "Acces interzis", 1001.0],
+    ["S3", "Power", "OnAir", "GW", None, 1001.0],
+]
+EDITED = [
+    ["S0", "Power", "OnAir", "GW", "Grup electrogen", 1000.0],  # estado muda
+    ["S1", "Infra", "OnAir", "NGW", "Cheie la primărie", 1002.0],  # Lant + comentário
+    # S2 sai: o único "Transmission" / "Acces interzis"
+    ["S3", "Power", "OnAir", "GW", None, 1001.0],
+    ["S4", "Theft", "Down", "NGW", "Furt baterii", 1002.0],
+]
+
+
+def _version(prev, loc, alerts):
+    return data_loader._build_version(prev, data_loader.dataset_key(loc, alerts), loc, alerts)
+
+
+def _lookups(key, df):
+    # o que a app pede aos índices (via as caches por dataset), em Cod Site
+    index = data_loader.dataset_index(key, df)
+    texts = data_loader.text_index(key, df)
+    cube = data_loader.metrics_cube(key, df)
+
+    def sites(mask):
+        return sorted(df.loc[mask, "Cod Site"])
+
+    return {
+        "lants": sorted(index.lant_positions),
+        "lant 1002": sites(index.lant_mask("1002")),
+        "lant 1000": sites(index.lant_mask("1000")),
+        "power": sites(index.issue_mask(["Power"])),
+        "down": sites(index.status_mask([STATUS_DOWN])),
+        "text acces": sites(texts.search("acces")),
+        "text primarie": sites(texts.search("primarie")),
+        "suggest": texts.suggest("f"),
+        "counts": cube.status_counts(),
+        "counts 1002": cube.status_counts(lant="1002"),
+        "down by issue": cube.breakdown("Issue", status=STATUS_DOWN).to_dict(),
+    }
+
+
+def test_lookups_after_rebuild(locations_book, alerts_book):
+    loc = locations_book(LOCATIONS)
+    old = _version(None, loc, alerts_book(ALERTS))
+    before = _lookups(old.key, old.merged)
+
+    new_bytes = alerts_book(EDITED)
+    patched = _version(old, loc, new_bytes)
+    full = _version(None, loc, new_bytes)
+    assert patched.delta is not None
+
+    expected = {
+        "lants": ["1000", "1001", "1002"],
+        "lant 1002": ["S1", "S4"],
+        "lant 1000": ["S0"],
+        "power": ["S0", "S3"],
+        "down": ["S4"],
+        "text acces": [],
+        "text primarie": ["S1"],
+        "suggest": ["furt"],
+        "counts": {"total": 4, "ONAIR": 3, "DOWN": 1, "OUTRO": 0},
+        "counts 1002": {"total": 2, "ONAIR": 1, "DOWN": 1, "OUTRO": 0},
+        "down by issue": {"Theft": 1},
+    }
+    # índices da versão remendada (categorias antigas podem sobrar) = os de uma leitura completa
+    assert _lookups(patched.key, patched.merged) == expected
+    assert _lookups(full.key + "-full", full.merged) == expected
+
+    # a versão anterior continua a responder com os seus dados
+    assert _lookups(old.key, old.merged) == before
+    assert before["text acces"] == ["S2"] and before["down"] == ["S0", "S2"]
@@ -0,0 +1,27 @@
+from map.render_cache import RenderCache
+
+
+def test_budget_counts_utf8_bytes():
+    html = "Ștefănești " * 10  # 110 caracteres, 140 bytes
+    assert len(html) <= 120 < len(html.encode("utf-8"))
+
+    cache = RenderCache(max_bytes=120)
+    cache.put("a", html)
+    assert cache.get("a") is None
+    assert cache.stats()["bytes"] == 0
+
+
+def test_lru_eviction_by_bytes():
+    cache = RenderCache(max_bytes=10, max_entries=10)
+    cache.put("a", "ăăă")  # 6 bytes
+    cache.put("b", "ăă")  # 4 bytes
+    assert cache.stats()["bytes"] == 10
+
+    cache.get("a")
+    cache.put("c", "x")  # passa o limite: sai o menos usado (b)
+    assert cache.get("b") is None
+    assert cache.get("a") == "ăăă"
+    assert cache.stats()["bytes"] == 7
+
+    cache.put("a", "y")  # substituir desconta o tamanho antigo
+    assert cache.stats()["bytes"] == 2
@@ -0,0 +1,50 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from utils.route_opt import distance_matrix_km, optimize_route, route_length_km
+
+START = (45.15, 25.15)
+
+
+def _sites(seed, n):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(45.0, 45.3, n), rng.uniform(25.0, 25.3, n)
+
+
+def _optimal(lats, lons, start):
+    # força bruta (nó 0 = partida), na mesma métrica do comprimento devolvido
+    D = distance_matrix_km(np.r_[start[0], lats], np.r_[start[1], lons], method="ellipsoidal")
+    perms = np.array(list(itertools.permutations(range(1, len(lats) + 1))))
+    paths = np.c_[np.zeros(len(perms), dtype=int), perms]
+    best = paths[np.argmin(D[paths[:, :-1], paths[:, 1:]].sum(axis=1))]
+    return best[1:] - 1
+
+
+@pytest.mark.parametrize("n", [0, 1, 2, 5, 40, 300])
+@pytest.mark.parametrize("start", [None, START])
+def test_valid_permutation(n, start):
+    lats, lons = _sites(n, n)
+    order, km = optimize_route(lats, lons, start=start, time_budget_s=0.2)
+    assert sorted(order) == list(range(n))
+    if start is None and n:
+        assert order[0] == 0  # sem posição, parte do 1º site
+    assert km == pytest.approx(route_length_km(lats[order], lons[order], start=start))
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_never_longer_than_input(seed):
+    lats, lons = _sites(seed, 7)
+    # entrada já ótima: é onde o vizinho mais próximo + melhorias locais ficavam pior
+    best = _optimal(lats, lons, START)
+    lats, lons = lats[best], lons[best]
+    order, km = optimize_route(lats, lons, start=START)
+    assert km <= route_length_km(lats, lons, start=START)
+
+    # entrada qualquer, com e sem posição
+    rng = np.random.default_rng(seed)
+    shuffled = rng.permutation(7)
+    for start in (None, START):
+        _, km = optimize_route(lats[shuffled], lons[shuffled], start=start)
+        assert km <= route_length_km(lats[shuffled], lons[shuffled], start=start)
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from utils.geo_utils import distances_km
+from utils.spatial_index import SiteIndex
+
+
+def _sites():
+    rng = np.random.default_rng(7)
+    # Roménia, à volta do antimeridiano, perto do pólo e em cima das arestas das células (0.1°)
+    ro = np.c_[rng.uniform(43.6, 48.3, 400), rng.uniform(20.2, 29.7, 400)]
+    am = np.c_[rng.uniform(-5, 5, 200), rng.uniform(-1, 1, 200) % 360 - 180]
+    polar = np.c_[rng.uniform(88.5, 90, 50), rng.uniform(-180, 180, 50)]
+    edges = np.c_[np.round(rng.uniform(44, 45, 100), 1), np.round(rng.uniform(25, 26, 100), 1)]
+    pts = np.vstack([ro, am, polar, edges, [[0.0, 180.0], [0.0, -180.0], [-90.0, 0.0], [90.0, 0.0]]])
+    return pts[:, 0], pts[:, 1]
+
+
+LATS, LONS = _sites()
+
+QUERIES = [
+    (45.0, 25.0, 5.0),  # canto de célula
+    (44.95, 25.05, 12.0),
+    (46.0, 24.0, 80.0),
+    (0.0, 179.95, 30.0),  # antimeridiano, dos dois lados
+    (0.0, -180.0, 150.0),
+    (89.5, 10.0, 200.0),  # caixa a cobrir todas as longitudes
+    (45.0, 25.0, 0.0),
+    (-30.0, 100.0, 50.0),  # sem sites
+]
+
+
+@pytest.fixture(scope="module")
+def index():
+    return SiteIndex(LATS, LONS)
+
+
+def _brute(lat, lon, mask=None):
+    d = distances_km(lat, lon, LATS, LONS)
+    idx = np.arange(len(d)) if mask is None else np.flatnonzero(mask)
+    return idx, d[idx]
+
+
+@pytest.mark.parametrize("lat, lon, km", QUERIES)
+def test_radius_matches_brute_force(index, lat, lon, km):
+    idx, d = index.radius(lat, lon, km)
+    all_idx, all_d = _brute(lat, lon)
+    assert sorted(idx.tolist()) == sorted(all_idx[all_d <= km].tolist())
+    np.testing.assert_allclose(d, distances_km(lat, lon, LATS[idx], LONS[idx]), rtol=0, atol=1e-6)
+    assert np.all(np.diff(d) >= 0)
+
+
+def test_radius_with_mask(index):
+    mask = np.arange(len(LATS)) % 3 == 0
+    idx, _ = index.radius(45.5, 25.0, 150.0, mask=mask)
+    all_idx, all_d = _brute(45.5, 25.0, mask)
+    assert sorted(idx.tolist()) == sorted(all_idx[all_d <= 150.0].tolist())
+
+
+@pytest.mark.parametrize("lat, lon, _km", QUERIES)
+@pytest.mark.parametrize("k", [1, 7, 60])
+def test_nearest_matches_brute_force(index, lat, lon, _km, k):
+    idx, d = index.nearest(lat, lon, k)
+    _, all_d = _brute(lat, lon)
+    # empates podem trocar posições; as distâncias não (a menos da precisão de Vincenty em lote, < 1 mm)
+    np.testing.assert_allclose(d, np.sort(all_d)[:k], rtol=0, atol=1e-6)
+    assert len(set(idx.tolist())) == k
+
+
+def test_nearest_limits(index):
+    mask = np.zeros(len(LATS), dtype=bool)
+    mask[[3, 500]] = True
+    idx, _ = index.nearest(45.0, 25.0, 10, mask=mask)
+    assert sorted(idx.tolist()) == [3, 500]
+
+    idx, d = index.nearest(0.0, 179.95, 1000, max_km=100.0)
+    all_idx, all_d = _brute(0.0, 179.95)
+    assert sorted(idx.tolist()) == sorted(all_idx[all_d <= 100.0].tolist())
+
+    assert len(index.nearest(45.0, 25.0, 0)[0]) == 0
@@ -0,0 +1,151 @@
+import json
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data import data_loader
+from utils import travel_time
+from utils.geo_utils import distances_km
+from utils.travel_time import OsrmProvider, TravelTimeCache, travel_from
+
+
+# Motor /table falso: todas as rotas com ROAD_M metros; tempo menor quanto
+# mais a norte (ao contrário da linha reta); sem rota acima de NO_ROUTE_LAT.
+ROAD_M = 99_999.0
+NO_ROUTE_LAT = 40.0
+
+
+class _Table(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.hits += 1
+        url = urlsplit(self.path)
+        pts = [tuple(map(float, c.split(","))) for c in url.path.split("/")[4].split(";")]
+        q = parse_qs(url.query)
+        src = [int(i) for i in q["sources"][0].split(";")]
+        dst = [int(i) for i in q["destinations"][0].split(";")]
+        lats = [pts[j][1] for j in dst]
+        if self.server.fail_lat in lats:
+            self.send_error(500)
+            return
+        body = {
+            "code": "Ok",
+            "distances": [[None if lat > NO_ROUTE_LAT else ROAD_M for lat in lats] for _ in src],
+            "durations": [[None if lat > NO_ROUTE_LAT else (50 - lat) * 1000 for lat in lats] for _ in src],
+        }
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def engine():
+    servers = []
+
+    def start(port):
+        srv = ThreadingHTTPServer(("127.0.0.1", port), _Table)
+        srv.hits = 0
+        srv.fail_lat = None
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+        servers.append(srv)
+        return srv
+
+    yield start
+    for srv in servers:
+        srv.shutdown()
+        srv.server_close()
+
+
+@pytest.fixture
+def provider(tmp_path, monkeypatch):
+    p = OsrmProvider(f"http://127.0.0.1:{_free_port()}", cache=TravelTimeCache(tmp_path / "travel.sqlite"), timeout=1)
+    monkeypatch.setattr(travel_time, "RETRY_SECONDS", 0.0)
+    monkeypatch.setattr(data_loader, "travel_provider", lambda: p)
+    data_loader._distance_order.clear()
+    yield p
+    data_loader._distance_order.clear()
+
+
+SITES = pd.DataFrame({"Latitudine": [38.70, 38.80, 39.00], "Longitudine": [-9.10, -9.10, -9.10]})
+
+
+def test_fallback_is_not_cached_as_routed(provider, engine):
+    # motor em baixo no primeiro pedido: linha reta, ordem por distância
+    dist, order, source = data_loader.distance_order("k", SITES, 38.70, -9.10)
+    assert provider.error is not None
+    assert source is None  # o motor falhou a meio do pedido
+    assert dist.max() < 50
+    assert order.tolist() == [0, 1, 2]
+
+    # o motor volta: a mesma posição passa a vir por estrada
+    srv = engine(int(provider.url.rsplit(":", 1)[1]))
+    dist, order, source = data_loader.distance_order("k", SITES, 38.70, -9.10)
+    assert provider.error is None
+    assert source == "road"
+    np.testing.assert_allclose(dist, ROAD_M / 1000)
+    assert order.tolist() == [2, 1, 0]
+
+    # completo: fica em cache, sem novos pedidos
+    hits = srv.hits
+    again, _, _ = data_loader.distance_order("k", SITES, 38.70, -9.10)
+    assert again is dist
+    assert srv.hits == hits
+
+
+def test_unroutable_pairs_are_complete_and_memoized(provider, engine):
+    srv = engine(int(provider.url.rsplit(":", 1)[1]))
+    lats, lons = [38.70, 41.00], [-9.10, -8.60]
+
+    m = provider.matrix([38.70], [-9.10], lats, lons)
+    assert m.complete
+    assert m.routed[0].tolist() == [True, False]
+    assert m.km[0, 0] == pytest.approx(ROAD_M / 1000)
+    assert m.km[0, 1] == pytest.approx(distances_km(38.70, -9.10, 41.00, -8.60))  # sem rota -> linha reta
+
+    # o par sem rota também fica no memo: não volta ao motor
+    hits = srv.hits
+    km, _, complete = travel_from(provider, 38.70, -9.10, lats, lons)
+    assert complete
+    np.testing.assert_allclose(km, m.km[0])
+    assert srv.hits == hits
+
+
+def test_partial_failure_keeps_answered_blocks(provider, engine):
+    # um destino por pedido; só o do meio falha
+    srv = engine(int(provider.url.rsplit(":", 1)[1]))
+    srv.fail_lat = 38.80
+    provider.max_coords = 2
+    lats, lons = SITES["Latitudine"].tolist(), SITES["Longitudine"].tolist()
+
+    m = provider.matrix([38.70], [-9.10], lats, lons)
+    assert not m.complete
+    assert provider.error is not None
+    assert m.routed[0].tolist() == [True, False, True]
+    assert m.km[0, 1] == pytest.approx(distances_km(38.70, -9.10, 38.80, -9.10))
+
+    # parcial: não fica na cache das distâncias nem na do mapa
+    dist, _, source = data_loader.distance_order("k", SITES, 38.70, -9.10)
+    assert source is None
+    np.testing.assert_allclose(dist[[0, 2]], ROAD_M / 1000)
+
+    # o motor recupera: só o bloco em falta volta a ser pedido
+    srv.fail_lat = None
+    hits = srv.hits
+    m = provider.matrix([38.70], [-9.10], lats, lons)
+    assert m.complete and m.routed.all()
+    assert srv.hits == hits + 1
@@ -0,0 +1,149 @@
+import io
+import re
+import zipfile
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from data.xlsx_reader import SheetRows, read_projected, sheet_names
+
+MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+SHARED = ["Cod Site", "Lant", "S1", "S2", "Power", "", None]  # None = texto rico (várias <r>)
+
+# cabeçalho + linhas com: strings partilhadas / inline / ricas, células em falta,
+# datas, Lant numérico "1000.0", erro, fórmula em texto, booleano, linha vazia
+ROWS = """
+<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" t="inlineStr"><is><t>Issue</t></is></c><c r="C1" t="s"><v>1</v></c>
+  <c r="D1" t="inlineStr"><is><t>Data</t></is></c><c r="E1" t="inlineStr"><is><t>Comments</t></is></c></row>
+<row r="2"><c r="A2" t="s"><v>2</v></c><c r="B2" t="s"><v>4</v></c><c r="C2"><v>1000.0</v></c>
+  <c r="D2" s="1"><v>45000</v></c><c r="E2" t="s"><v>6</v></c></row>
+<row r="3"><c r="A3" t="inlineStr"><is><t>S2</t></is></c><c r="B3" t="e"><v>#N/A</v></c><c r="C3"><v>1001.5</v></c>
+  <c r="E3" t="str"><f>A3</f><v>S2</v></c></row>
+<row r="4"/>
+<row r="6"><c r="A6" t="s"><v>3</v></c><c r="B6" t="b"><v>1</v></c><c r="C6" t="s"><v>5</v></c>
+  <c r="D6" s="1"><v>45000.5</v></c></row>
+"""
+
+
+def _xml(body: str, prefix: str) -> str:
+    if not prefix:
+        return body
+    # mesmo XML com o espaço de nomes principal num prefixo (x:row, x:c, ...)
+    return re.sub(r"<(/?)(?!/)([a-zA-Z]+)([ >/])", rf"<\1{prefix}:\2\3", body)
+
+
+def _book(prefix: str = "", rows: str = ROWS) -> bytes:
+    p = f"{prefix}:" if prefix else ""
+    ns = f'xmlns{":" + prefix if prefix else ""}="{MAIN}"'
+    si = []
+    for s in SHARED:
+        if s is None:
+            si.append(f"<{p}si><{p}r><{p}t>Baterie </{p}t></{p}r><{p}r><{p}t>furată</{p}t></{p}r></{p}si>")
+        else:
+            si.append(f"<{p}si><{p}t>{s}</{p}t></{p}si>")
+    files = {
+        "[Content_Types].xml": (
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            '<Override PartName="/xl/worksheets/sheet2.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            '<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+            '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            "</Types>"
+        ),
+        "_rels/.rels": (
+            f'<Relationships xmlns="{PKG}"><Relationship Id="rId1" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+            "</Relationships>"
+        ),
+        "xl/workbook.xml": (
+            f'<{p}workbook {ns} xmlns:r="{REL}"><{p}sheets>'
+            f'<{p}sheet name="Sumar" sheetId="1" r:id="rId1"/><{p}sheet name="TOATE ALERTELE" sheetId="2" r:id="rId2"/>'
+            f"</{p}sheets></{p}workbook>"
+        ),
+        "xl/_rels/workbook.xml.rels": (
+            f'<Relationships xmlns="{PKG}">'
+            f'<Relationship Id="rId1" Type="{REL}/worksheet" Target="worksheets/sheet1.xml"/>'
+            f'<Relationship Id="rId2" Type="{REL}/worksheet" Target="worksheets/sheet2.xml"/>'
+            f'<Relationship Id="rId3" Type="{REL}/sharedStrings" Target="sharedStrings.xml"/>'
+            f'<Relationship Id="rId4" Type="{REL}/styles" Target="styles.xml"/>'
+            "</Relationships>"
+        ),
+        "xl/worksheets/sheet1.xml": f'<{p}worksheet {ns}><{p}sheetData/></{p}worksheet>',
+        "xl/worksheets/sheet2.xml": f"<{p}worksheet {ns}><{p}sheetData>{_xml(rows, prefix)}</{p}sheetData></{p}worksheet>",
+        "xl/sharedStrings.xml": f'<{p}sst {ns} count="{len(si)}" uniqueCount="{len(si)}">{"".join(si)}</{p}sst>',
+        "xl/styles.xml": (
+            f'<{p}styleSheet {ns}><{p}cellXfs count="2"><{p}xf numFmtId="0"/><{p}xf numFmtId="14" applyNumberFormat="1"/>'
+            f"</{p}cellXfs></{p}styleSheet>"
+        ),
+    }
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as z:
+        for name, text in files.items():
+            z.writestr(name, text)
+    return buf.getvalue()
+
+
+def _all_columns(header):
+    return {c: c for c in header}
+
+
+def _cells(df: pd.DataFrame) -> list[list]:
+    return [[None if pd.isna(v) else v for v in row] for row in df.astype(object).itertuples(index=False)]
+
+
+@pytest.mark.filterwarnings("ignore:Workbook contains no default style")
+@pytest.mark.parametrize("prefix", ["", "x"])
+def test_matches_read_excel(prefix):
+    content = _book(prefix)
+    ours = read_projected(content, _all_columns, sheet="toate alertele ", row_col="_row")
+    # linhas em branco a meio: o pandas deixa-as (tudo NaN), o leitor salta-as
+    theirs = pd.read_excel(io.BytesIO(content), sheet_name="TOATE ALERTELE").dropna(how="all")
+
+    assert list(ours.columns[:-1]) == list(theirs.columns)
+    assert _cells(ours.drop(columns="_row")) == _cells(theirs)
+    assert ours["_row"].tolist() == [2, 3, 6]
+
+
+def test_values():
+    df = read_projected(_book(), _all_columns, sheet="TOATE ALERTELE")
+    assert df.to_dict("list") == {
+        "Cod Site": ["S1", "S2", "S2"],
+        "Issue": ["Power", None, True],
+        "Lant": [1000, 1001.5, None],  # "1000.0" -> 1000 (como o pandas)
+        "Data": [datetime(2023, 3, 15), None, datetime(2023, 3, 15, 12)],
+        "Comments": ["Baterie furată", "S2", None],
+    }
+
+
+@pytest.mark.parametrize("prefix", ["", "x"])
+def test_sheet_rows(prefix):
+    rows = SheetRows(_book(prefix), "TOATE ALERTELE")
+    assert rows.header == ["Cod Site", "Issue", "Lant", "Data", "Comments"]
+    assert [n for n, _ in rows.data_rows()] == [2, 3, 6]
+    pd.testing.assert_frame_equal(
+        rows.read(_all_columns, [3, 6], row_col="_row"),
+        read_projected(_book(prefix), _all_columns, sheet="TOATE ALERTELE", row_col="_row").iloc[1:].reset_index(drop=True),
+    )
+
+
+def test_signatures_follow_values_not_storage():
+    # a mesma linha com texto partilhado, inline ou noutro índice da tabela -> mesma assinatura
+    shared = SheetRows(_book(), "TOATE ALERTELE").data_rows()
+    moved = _book(rows=ROWS.replace('<c r="A2" t="s"><v>2</v></c>', '<c r="A2" t="inlineStr"><is><t>S1</t></is></c>'))
+    assert SheetRows(moved, "TOATE ALERTELE").data_rows() == shared
+
+    changed = _book(rows=ROWS.replace('<c r="A2" t="s"><v>2</v></c>', '<c r="A2" t="s"><v>3</v></c>'))
+    sigs = dict(SheetRows(changed, "TOATE ALERTELE").data_rows())
+    assert sigs[2] != dict(shared)[2]
+    assert sigs[3] == dict(shared)[3]
+
+
+def test_sheet_names():
+    assert sheet_names(io.BytesIO(_book("x"))) == ["Sumar", "TOATE ALERTELE"]
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import numpy as np
+
+from utils.geo_utils import distances_km
+
+
+# Despacho: reparte sites por N equipas no terreno. Uma só matriz
+# sites x equipas (broadcasting), depois cada site vai para a equipa mais
+# próxima ou, com capacidade, para a mais próxima que ainda o aceite.
+
+
+def team_distance_matrix(site_lats, site_lons, team_lats, team_lons, method: str = "haversine") -> np.ndarray:
+    """Matriz (sites, equipas) de distâncias em km, numa só passagem vetorizada."""
+    site_lats = np.asarray(site_lats, dtype=float)
+    site_lons = np.asarray(site_lons, dtype=float)
+    team_lats = np.asarray(team_lats, dtype=float)
+    team_lons = np.asarray(team_lons, dtype=float)
+    return distances_km(site_lats[:, None], site_lons[:, None], team_lats[None, :], team_lons[None, :], method=method)
+
+
+def assign_nearest(D: np.ndarray) -> np.ndarray:
+    return np.argmin(D, axis=1)
+
+
+def assign_balanced(D: np.ndarray, capacity) -> np.ndarray:
+    """Cada equipa fica com no máximo `capacity` sites (int ou um por equipa).
+
+    Aceitação diferida (Gale-Shapley): os sites propõem-se à equipa mais próxima
+    que ainda não os recusou; cada equipa fica com os `capacity` mais próximos
+    e recusa os restantes. Resultado estável: nenhum site e equipa preferiam
+    trocar. Cada ronda é vetorizada. Cada ronda sem fim recusa pelo menos um
+    site e cada site é recusado no máximo equipas - 1 vezes, por isso o limite
+    é sites x (equipas - 1) + 1 rondas; na prática são poucas dezenas
+    (53 para 30 000 sites x 40 equipas com capacidade à justa).
+    """
+    n, t = D.shape
+    cap = np.broadcast_to(np.asarray(capacity, dtype=np.int64), (t,))
+    if int(cap.sum()) < n:
+        raise ValueError(f"Capacidade total ({int(cap.sum())}) menor do que o nº de sites ({n}).")
+
+    prefs = np.argsort(D, axis=1, kind="stable")
+    nxt = np.zeros(n, dtype=np.int64)
+    team = np.full(n, -1, dtype=np.int64)
+    free = np.arange(n)
+    while free.size:
+        team[free] = prefs[free, nxt[free]]
+        nxt[free] += 1
+
+        held = np.flatnonzero(team >= 0)
+        ht = team[held]
+        # por equipa, do mais próximo para o mais longe (empate: ordem dos sites)
+        o = np.lexsort((held, D[held, ht], ht))
+        held, ht = held[o], ht[o]
+        rank = np.arange(len(held)) - np.searchsorted(ht, ht, side="left")
+        free = held[rank >= cap[ht]]
+        team[free] = -1
+    return team
+
+
+def dispatch(site_lats, site_lons, team_lats, team_lons, capacity=None, method: str = "haversine"):
+    """(equipa de cada site, distância em km até ela); `capacity=None` = só a mais próxima."""
+    D = team_distance_matrix(site_lats, site_lons, team_lats, team_lons, method=method)
+    if len(D) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    team = assign_nearest(D) if capacity is None else assign_balanced(D, capacity)
+    return team, D[np.arange(len(D)), team]
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+
+# Instrumentação por etapa (tempo, contadores de cache, tamanho de DFs).
+# Cada rerun do Streamlit corre na sua thread: begin_run() liga a recolha
+# só para essa execução. Desligada, span() devolve um contexto nulo
+# partilhado e count()/frame() saem logo -> custo desprezável.
+# Com TASKFORCE_PROFILE=1 fica sempre ligada e escreve uma linha JSON por
+# evento no logger "taskforce.perf".
+
+ENV_ENABLED = os.environ.get("TASKFORCE_PROFILE", "0") == "1"
+
+log = logging.getLogger("taskforce.perf")
+if ENV_ENABLED and not log.handlers:
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+    log.addHandler(_handler)
+    log.setLevel(logging.INFO)
+
+_local = threading.local()
+_NULL = nullcontext()
+MB = 1024 * 1024
+
+
+class Run:
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.spans: list[dict] = []
+        self.counters: dict[str, int] = {}
+        self.frames: dict[str, dict] = {}
+        self.depth = 0
+
+
+def _emit(record: dict) -> None:
+    if log.isEnabledFor(logging.INFO):
+        log.info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+def begin_run(enabled: bool = False) -> Run | None:
+    """Começa a recolha para a thread atual (ou desliga-a); devolve o Run ou None."""
+    run = Run() if (enabled or ENV_ENABLED) else None
+    _local.run = run
+    return run
+
+
+def end_run() -> Run | None:
+    """Fecha a recolha da thread atual com uma linha-resumo (tempo total + contadores)."""
+    run = getattr(_local, "run", None)
+    _local.run = None
+    if run is not None:
+        _emit({"run_ms": round((time.perf_counter() - run.t0) * 1000, 3), "counters": run.counters})
+    return run
+
+
+def span(name: str, **attrs):
+    run = getattr(_local, "run", None)
+    if run is None:
+        return _NULL
+    return _span(run, name, attrs)
+
+
+@contextmanager
+def _span(run: Run, name: str, attrs: dict):
+    depth = run.depth
+    run.depth += 1
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        run.depth -= 1
+        record = {
+            "span": name,
+            "start_ms": round((t0 - run.t0) * 1000, 3),
+            "ms": round((time.perf_counter() - t0) * 1000, 3),
+            "depth": depth,
+            **attrs,
+        }
+        run.spans.append(record)
+        _emit(record)
+
+
+def count(name: str, n: int = 1) -> None:
+    run = getattr(_local, "run", None)
+    if run is not None:
+        run.counters[name] = run.counters.get(name, 0) + n
+
+
+def frame(name: str, df) -> None:
+    """Regista linhas/colunas/memória (deep) de um DataFrame."""
+    run = getattr(_local, "run", None)
+    if run is None:
+        return
+    record = {
+        "frame": name,
+        "rows": len(df),
+        "cols": len(df.columns),
+        "mb": round(int(df.memory_usage(deep=True).sum()) / MB, 3),
+    }
+    run.frames[name] = record
+    _emit(record)
+
+
+def executed(name: str) -> None:
+    """Chamado no corpo de uma função em cache: só corre quando a cache falha."""
+    count(f"{name}.exec")
+
+
+def cached_call(name: str, fn, *args, **kwargs):
+    """Chama uma função em cache e conta hit/miss (o corpo tem de chamar executed(name))."""
+    run = getattr(_local, "run", None)
+    if run is None:
+        return fn(*args, **kwargs)
+
+    before = run.counters.get(f"{name}.exec", 0)
+    with _span(run, name, {}):
+        out = fn(*args, **kwargs)
+    hit = run.counters.get(f"{name}.exec", 0) == before
+    count(f"cache.{name}.{'hit' if hit else 'miss'}")
+    return out
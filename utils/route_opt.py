@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import time
+
+import numpy as np
+
+from utils.geo_utils import distances_km
+
+
+# Ordem de visita para uma chain: caminho aberto que começa na posição do
+# técnico. Vizinho mais próximo + melhorias 2-opt / Or-opt vetorizadas,
+# sempre dentro de um orçamento de tempo.
+
+DEFAULT_TIME_BUDGET_S = 0.5
+_EPS = 1e-9
+
+
+def distance_matrix_km(lats, lons, method: str = "haversine") -> np.ndarray:
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    return distances_km(lats[:, None], lons[:, None], lats[None, :], lons[None, :], method=method)
+
+
+def route_length_km(lats, lons, start: tuple[float, float] | None = None, method: str = "ellipsoidal") -> float:
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    if start is not None:
+        lats = np.concatenate([[start[0]], lats])
+        lons = np.concatenate([[start[1]], lons])
+    if len(lats) < 2:
+        return 0.0
+    return float(distances_km(lats[:-1], lons[:-1], lats[1:], lons[1:], method=method).sum())
+
+
+def _path_cost(D: np.ndarray, p: np.ndarray) -> float:
+    return float(D[p[:-1], p[1:]].sum())
+
+
+def _nearest_neighbour(D: np.ndarray) -> np.ndarray:
+    n = len(D)
+    visited = np.zeros(n, dtype=bool)
+    path = np.empty(n, dtype=int)
+    cur = 0
+    visited[0] = True
+    path[0] = 0
+    for k in range(1, n):
+        row = np.where(visited, np.inf, D[cur])
+        cur = int(np.argmin(row))
+        visited[cur] = True
+        path[k] = cur
+    return path
+
+
+def _two_opt(D: np.ndarray, p: np.ndarray, deadline: float) -> tuple[np.ndarray, bool]:
+    """Inverte p[i..j] quando encurta o caminho (p[0] fica fixo, fim aberto)."""
+    n = len(p)
+    improved = False
+    for i in range(1, n - 1):
+        if time.perf_counter() > deadline:
+            break
+        a, b = p[i - 1], p[i]
+        j = np.arange(i + 1, n)
+        c = p[j]
+        # aresta a seguir a j (não existe no último nó: caminho aberto)
+        nxt = np.where(j + 1 < n, p[np.minimum(j + 1, n - 1)], -1)
+        has_next = nxt >= 0
+        d_next_old = np.where(has_next, D[c, np.maximum(nxt, 0)], 0.0)
+        d_next_new = np.where(has_next, D[b, np.maximum(nxt, 0)], 0.0)
+
+        delta = D[a, c] + d_next_new - D[a, b] - d_next_old
+        k = int(np.argmin(delta))
+        if delta[k] < -_EPS:
+            jj = j[k]
+            p[i:jj + 1] = p[i:jj + 1][::-1]
+            improved = True
+    return p, improved
+
+
+def _or_opt(D: np.ndarray, p: np.ndarray, deadline: float, max_seg: int = 3) -> tuple[np.ndarray, bool]:
+    """Move segmentos de 1..3 nós para a melhor posição (em qualquer sentido)."""
+    improved = False
+    for L in range(1, max_seg + 1):
+        i = 1
+        while i + L <= len(p):
+            if time.perf_counter() > deadline:
+                return p, improved
+            seg = p[i:i + L]
+            a = p[i - 1]
+            s0, s1 = seg[0], seg[-1]
+            if i + L < len(p):
+                b = p[i + L]
+                gain = D[a, s0] + D[s1, b] - D[a, b]
+            else:
+                gain = D[a, s0]
+
+            rest = np.concatenate([p[:i], p[i + L:]])
+            u, v = rest[:-1], rest[1:]
+            ins_fwd = D[u, s0] + D[s1, v] - D[u, v]
+            ins_rev = D[u, s1] + D[s0, v] - D[u, v]
+            # também no fim do caminho (depois do último nó)
+            end_fwd = D[rest[-1], s0]
+            end_rev = D[rest[-1], s1]
+
+            costs = np.concatenate([ins_fwd, ins_rev, [end_fwd, end_rev]])
+            k = int(np.argmin(costs))
+            if costs[k] < gain - _EPS:
+                m = len(u)
+                if k < m:
+                    pos, piece = k + 1, seg
+                elif k < 2 * m:
+                    pos, piece = k - m + 1, seg[::-1]
+                else:
+                    pos, piece = len(rest), seg if k == 2 * m else seg[::-1]
+                p = np.concatenate([rest[:pos], piece, rest[pos:]])
+                improved = True
+            else:
+                i += 1
+    return p, improved
+
+
+def optimize_route(
+    lats,
+    lons,
+    start: tuple[float, float] | None = None,
+    time_budget_s: float = DEFAULT_TIME_BUDGET_S,
+) -> tuple[list[int], float]:
+    """Ordem curta de visita dos sites (índices em lats/lons) e o comprimento total em km.
+
+    Com `start`, o caminho parte dessa posição (não conta como site). Nunca
+    devolve um caminho mais longo do que a ordem recebida.
+    """
+    deadline = time.perf_counter() + time_budget_s
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    n = len(lats)
+    if n == 0:
+        return [], 0.0
+
+    # nó 0 = ponto de partida (o técnico, ou o 1º site se não houver posição)
+    if start is not None:
+        all_lats = np.concatenate([[start[0]], lats])
+        all_lons = np.concatenate([[start[1]], lons])
+    else:
+        all_lats, all_lons = lats, lons
+
+    D = distance_matrix_km(all_lats, all_lons)
+    p = _nearest_neighbour(D)
+    # a ordem recebida (p.ex. já otimizada) também é ponto de partida
+    given = np.arange(len(D))
+    if _path_cost(D, given) < _path_cost(D, p):
+        p = given
+
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        p, a = _two_opt(D, p, deadline)
+        p, b = _or_opt(D, p, deadline)
+        improved = a or b
+
+    order = (p[1:] - 1) if start is not None else p
+    order = [int(x) for x in order]
+    length = route_length_km(lats[order], lons[order], start=start)
+    # nunca pior do que a ordem recebida (D é na esfera, o comprimento no WGS-84)
+    given_length = route_length_km(lats, lons, start=start)
+    if given_length <= length:
+        return list(range(n)), given_length
+    return order, length
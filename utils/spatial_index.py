@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import numpy as np
+
+from utils.geo_utils import distances_km
+
+
+# Índice espacial em grelha lat/lon (tipo geohash): os sites são ordenados
+# por célula e cada consulta só olha para as células que tocam a caixa do
+# raio. A distância final usa o mesmo motor que a coluna "Distância (km)".
+
+KM_PER_DEG_LAT = 111.2
+# folga da caixa: a esfera vs WGS-84 difere < 0.6%
+_BOX_MARGIN = 1.01
+
+
+class SiteIndex:
+    def __init__(self, lats, lons, cell_deg: float = 0.1):
+        self.lats = np.asarray(lats, dtype=float)
+        self.lons = np.asarray(lons, dtype=float)
+        self.cell_deg = float(cell_deg)
+        self.n_rows = int(np.ceil(180.0 / self.cell_deg)) + 1
+        self.n_cols = int(np.ceil(360.0 / self.cell_deg))
+
+        cells = self._cell_ids(self.lats, self.lons)
+        self.order = np.argsort(cells, kind="stable")
+        self.cells = cells[self.order]
+
+    def __len__(self) -> int:
+        return len(self.lats)
+
+    def _rows(self, lat):
+        return np.clip(((np.asarray(lat) + 90.0) // self.cell_deg).astype(int), 0, self.n_rows - 1)
+
+    def _cols(self, lon):
+        return (((np.asarray(lon) + 180.0) // self.cell_deg).astype(int)) % self.n_cols
+
+    def _cell_ids(self, lat, lon):
+        return self._rows(lat) * self.n_cols + self._cols(lon)
+
+    def _candidates(self, lat: float, lon: float, km: float) -> np.ndarray:
+        dlat = km * _BOX_MARGIN / KM_PER_DEG_LAT
+        lat0, lat1 = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+
+        cos_min = np.cos(np.radians(max(abs(lat0), abs(lat1))))
+        dlon = 360.0 if cos_min < 1e-6 else km * _BOX_MARGIN / (KM_PER_DEG_LAT * cos_min)
+
+        rows = np.arange(self._rows(lat0), self._rows(lat1) + 1)
+        if dlon >= 180.0:
+            col_ranges = [(0, self.n_cols - 1)]
+        else:
+            c0, c1 = int(self._cols(lon - dlon)), int(self._cols(lon + dlon))
+            # atravessa o antimeridiano -> dois intervalos
+            col_ranges = [(c0, c1)] if c0 <= c1 else [(c0, self.n_cols - 1), (0, c1)]
+
+        parts = []
+        for c0, c1 in col_ranges:
+            lo = np.searchsorted(self.cells, rows * self.n_cols + c0, side="left")
+            hi = np.searchsorted(self.cells, rows * self.n_cols + c1, side="right")
+            parts.extend(self.order[a:b] for a, b in zip(lo, hi) if b > a)
+
+        return np.concatenate(parts) if parts else np.empty(0, dtype=int)
+
+    def radius(self, lat: float, lon: float, km: float, mask=None, method: str = "ellipsoidal"):
+        """Sites a <= km de (lat, lon): (posições, distâncias), do mais perto para o mais longe.
+
+        `mask` (bool por site) pré-filtra p.ex. por Tip Alarma / Issue.
+        """
+        idx = self._candidates(lat, lon, km)
+        if mask is not None:
+            idx = idx[np.asarray(mask, dtype=bool)[idx]]
+
+        d = distances_km(lat, lon, self.lats[idx], self.lons[idx], method=method)
+        keep = d <= km
+        idx, d = idx[keep], d[keep]
+
+        o = np.argsort(d, kind="stable")
+        return idx[o], d[o]
+
+    def nearest(self, lat: float, lon: float, k: int, mask=None, max_km: float | None = None, method: str = "ellipsoidal"):
+        """Os k sites mais próximos (opcionalmente só até max_km): (posições, distâncias)."""
+        n_valid = len(self) if mask is None else int(np.count_nonzero(mask))
+        k = min(int(k), n_valid)
+        if k <= 0:
+            return np.empty(0, dtype=int), np.empty(0)
+
+        # começa numa célula e duplica o raio até ter k sites dentro dele;
+        # tudo o que está dentro do raio é exato, logo os k primeiros também
+        km = self.cell_deg * KM_PER_DEG_LAT
+        limit = 20040.0 if max_km is None else float(max_km)
+        while True:
+            km = min(km, limit)
+            idx, d = self.radius(lat, lon, km, mask=mask, method=method)
+            if len(idx) >= k or km >= limit:
+                return idx[:k], d[:k]
+            km *= 2.0
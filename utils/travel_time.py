@@ -0,0 +1,348 @@
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+from pathlib import Path
+
+import numpy as np
+
+from utils import perf
+from utils.geo_utils import distances_km
+
+
+# Tempos de condução origem x destino. Dois fornecedores com a mesma
+# interface (`matrix`): o geodésico (linha reta, sempre disponível) e um
+# motor de rotas local compatível com o /table do OSRM. Os pedidos ao motor
+# vão em blocos (no máximo `max_coords` coordenadas cada) e em paralelo;
+# cada par (origem, destino) arredondado a 4 casas (~11 m) fica memorizado
+# em disco (SQLite). Sem motor, ou para os pares que ele não resolve, vale
+# a distância geodésica e um tempo estimado a partir dela.
+
+# motor de rotas (vazio = só linha reta), p.ex. http://localhost:5000
+ROUTING_URL = os.environ.get("TASKFORCE_ROUTING_URL", "")
+ROUTING_PROFILE = os.environ.get("TASKFORCE_ROUTING_PROFILE", "driving")
+# só os N destinos mais próximos em linha reta vão ao motor (ver travel_from)
+ROUTING_LIMIT = int(os.environ.get("TASKFORCE_ROUTING_LIMIT", "2000"))
+
+# 4 casas decimais ~ 11 m (o mesmo arredondamento da posição do utilizador)
+SNAP_DECIMALS = 4
+_SCALE = 10 ** SNAP_DECIMALS
+
+# estimativa sem motor: km em linha reta x desvio médio da estrada, a velocidade média
+DETOUR_FACTOR = 1.3
+FALLBACK_KMH = 50.0
+
+# limite por pedido do osrm-routed (--max-table-size, 100 por omissão)
+MAX_TABLE_COORDS = 100
+WORKERS = 8
+TIMEOUT_SECONDS = 5.0
+# motor em baixo: não voltar a tentar (e esperar pelo timeout) antes disto
+RETRY_SECONDS = 60.0
+
+
+class TravelMatrix:
+    """Matrizes (origens, destinos): km, segundos e onde veio do motor (o resto é estimativa).
+
+    `complete` = o motor respondeu por todas as células (do memo ou agora,
+    com ou sem rota); falso quando falhou ou estava em baixo, e a
+    estimativa está no lugar de uma resposta que ainda pode chegar.
+    """
+
+    def __init__(self, km: np.ndarray, seconds: np.ndarray, routed: np.ndarray, complete: bool = True):
+        self.km = km
+        self.seconds = seconds
+        self.routed = routed
+        self.complete = complete
+
+
+def snap_keys(lats, lons) -> np.ndarray:
+    """Coordenadas arredondadas como inteiros (lat, lon) x 10^4, forma (N, 2)."""
+    return np.column_stack([
+        np.round(np.asarray(lats, dtype=float) * _SCALE),
+        np.round(np.asarray(lons, dtype=float) * _SCALE),
+    ]).astype(np.int64)
+
+
+def _pair_ids(keys: np.ndarray) -> np.ndarray:
+    # (lat, lon) inteiros -> um int64 por ponto (para indexar / deduplicar)
+    return (keys[:, 0] + 90 * _SCALE) * (360 * _SCALE + 1) + (keys[:, 1] + 180 * _SCALE)
+
+
+def estimate_seconds(km) -> np.ndarray:
+    return np.asarray(km, dtype=float) * DETOUR_FACTOR / FALLBACK_KMH * 3600.0
+
+
+class GeodesicProvider:
+    """Linha reta (geo_utils) + tempo estimado; nunca falha."""
+
+    name = "geodesic"
+    routed = False
+    available = True
+
+    def __init__(self, method: str = "ellipsoidal"):
+        self.method = method
+
+    def matrix(self, o_lats, o_lons, d_lats, d_lons) -> TravelMatrix:
+        o_lats = np.asarray(o_lats, dtype=float)
+        o_lons = np.asarray(o_lons, dtype=float)
+        km = distances_km(
+            o_lats[:, None], o_lons[:, None],
+            np.asarray(d_lats, dtype=float)[None, :], np.asarray(d_lons, dtype=float)[None, :],
+            method=self.method,
+        )
+        return TravelMatrix(km, estimate_seconds(km), np.zeros(km.shape, dtype=bool))
+
+    def status(self) -> dict:
+        return {"provider": self.name}
+
+
+class TravelTimeCache:
+    """Memo em disco: (perfil, origem, destino) arredondados -> (segundos, metros).
+
+    Pares sem rota (o motor devolve null) também ficam, com NULL, para não
+    voltarem a ser pedidos.
+    """
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS travel (
+        profile TEXT NOT NULL,
+        o_lat INTEGER NOT NULL,
+        o_lon INTEGER NOT NULL,
+        d_lat INTEGER NOT NULL,
+        d_lon INTEGER NOT NULL,
+        seconds REAL,
+        meters REAL,
+        PRIMARY KEY (profile, o_lat, o_lon, d_lat, d_lon)
+    ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as con, con:
+            con.executescript(self._SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.path, timeout=30)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        return con
+
+    def get(self, profile: str, origin: tuple[int, int], dests: np.ndarray):
+        """(segundos, metros, conhecido) por destino (N, 2 inteiros); NaN = sem memo ou sem rota."""
+        with closing(self._connect()) as con:
+            rows = con.execute(
+                "SELECT d_lat, d_lon, seconds, meters FROM travel WHERE profile = ? AND o_lat = ? AND o_lon = ?",
+                (profile, int(origin[0]), int(origin[1])),
+            ).fetchall()
+        seconds = np.full(len(dests), np.nan)
+        meters = np.full(len(dests), np.nan)
+        known = np.zeros(len(dests), dtype=bool)
+        if rows:
+            memo = np.array(rows, dtype=float)
+            memo_ids = _pair_ids(memo[:, :2].astype(np.int64))
+            order = np.argsort(memo_ids)
+            ids = _pair_ids(dests)
+            at = np.minimum(np.searchsorted(memo_ids, ids, sorter=order), len(order) - 1)
+            known = memo_ids[order[at]] == ids
+            seconds[known] = memo[order[at[known]], 2]
+            meters[known] = memo[order[at[known]], 3]
+        return seconds, meters, known
+
+    def put(self, profile: str, origin: tuple[int, int], dests: np.ndarray, seconds, meters) -> None:
+        o_lat, o_lon = int(origin[0]), int(origin[1])
+        ok = np.isfinite(seconds) & np.isfinite(meters)
+        with self._lock, closing(self._connect()) as con, con:
+            con.executemany(
+                "INSERT OR REPLACE INTO travel VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (profile, o_lat, o_lon, int(d[0]), int(d[1]), float(s) if k else None, float(m) if k else None)
+                    for d, s, m, k in zip(dests, seconds, meters, ok)
+                ],
+            )
+
+    def clear(self) -> None:
+        with self._lock, closing(self._connect()) as con, con:
+            con.execute("DELETE FROM travel")
+
+
+class OsrmProvider:
+    """Motor de rotas com a API /table/v1 do OSRM (p.ex. osrm-routed local)."""
+
+    name = "osrm"
+    routed = True
+
+    def __init__(
+        self,
+        url: str,
+        profile: str = "driving",
+        cache: TravelTimeCache | None = None,
+        max_coords: int = MAX_TABLE_COORDS,
+        workers: int = WORKERS,
+        timeout: float = TIMEOUT_SECONDS,
+        fallback: GeodesicProvider | None = None,
+    ):
+        if max_coords < 2:
+            raise ValueError("max_coords tem de ser >= 2 (uma origem + um destino por pedido)")
+        self.url = url.rstrip("/")
+        self.profile = profile
+        self.cache = cache
+        self.max_coords = max_coords
+        self.workers = workers
+        self.timeout = timeout
+        self.fallback = fallback or GeodesicProvider()
+        self.error: str | None = None
+        self._down_until = 0.0
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self._down_until
+
+    def _table(self, origins: np.ndarray, dests: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Um pedido /table: (segundos, metros), forma (origens, destinos); None -> NaN."""
+        pts = np.vstack([origins, dests]) / _SCALE
+        coords = ";".join(f"{lon:.{SNAP_DECIMALS}f},{lat:.{SNAP_DECIMALS}f}" for lat, lon in pts)
+        n_o = len(origins)
+        query = (
+            f"sources={';'.join(map(str, range(n_o)))}"
+            f"&destinations={';'.join(map(str, range(n_o, len(pts))))}"
+            "&annotations=duration,distance"
+        )
+        url = f"{self.url}/table/v1/{self.profile}/{coords}?{query}"
+        with urllib.request.urlopen(url, timeout=self.timeout) as resp:
+            body = json.load(resp)
+        if body.get("code") != "Ok":
+            raise ValueError(f"{body.get('code')}: {body.get('message', '')}")
+        seconds = np.array(body["durations"], dtype=float)
+        meters = np.array(body["distances"], dtype=float)
+        return seconds, meters
+
+    def _blocks(self, n_o: int, n_d: int) -> list[tuple[slice, slice]]:
+        # origens + destinos por pedido <= max_coords
+        o_step = min(n_o, max(1, self.max_coords // 2))
+        d_step = self.max_coords - o_step
+        return [
+            (slice(i, i + o_step), slice(j, j + d_step))
+            for i in range(0, n_o, o_step)
+            for j in range(0, n_d, d_step)
+        ]
+
+    def _fetch(self, origins: np.ndarray, dests: np.ndarray, seconds: np.ndarray, meters: np.ndarray, todo: np.ndarray):
+        """Pede ao motor as células `todo` (bool, origens x destinos) e preenche seconds / meters.
+
+        Devolve as células respondidas (com ou sem rota).
+        """
+        answered = np.zeros(todo.shape, dtype=bool)
+        rows = np.flatnonzero(todo.any(axis=1))
+        cols = np.flatnonzero(todo.any(axis=0))
+        blocks = self._blocks(len(rows), len(cols))
+        perf.count("routing.requests", len(blocks))
+
+        def run(block):
+            bo, bd = block
+            return block, self._table(origins[rows[bo]], dests[cols[bd]])
+
+        with perf.span("routing.fetch", requests=len(blocks), cells=int(todo.sum())):
+            error = None
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(blocks))) as pool:
+                futures = [pool.submit(run, b) for b in blocks]
+                # todos os blocos: os que responderam ficam, mesmo que outro falhe
+                for f in as_completed(futures):
+                    try:
+                        (bo, bd), (s, m) = f.result()
+                    except (OSError, ValueError, KeyError) as e:
+                        error = e
+                        perf.count("routing.errors")
+                        continue
+                    cells = np.ix_(rows[bo], cols[bd])
+                    seconds[cells] = s
+                    meters[cells] = m
+                    answered[cells] = True
+        if error is not None:
+            # motor em baixo / resposta inválida: o que falta fica para a estimativa
+            self.error = f"{type(error).__name__}: {error}"
+            self._down_until = time.monotonic() + RETRY_SECONDS
+            return answered
+        self.error = None
+        return answered
+
+    def matrix(self, o_lats, o_lons, d_lats, d_lons) -> TravelMatrix:
+        o_keys = snap_keys(o_lats, o_lons)
+        d_keys = snap_keys(d_lats, d_lons)
+        # destinos repetidos (vários alertas no mesmo site) vão uma só vez
+        _, d_first, d_inv = np.unique(_pair_ids(d_keys), return_index=True, return_inverse=True)
+        dests = d_keys[d_first]
+
+        seconds = np.full((len(o_keys), len(dests)), np.nan)
+        meters = np.full((len(o_keys), len(dests)), np.nan)
+        known = np.zeros(seconds.shape, dtype=bool)
+        if self.cache is not None:
+            for i, origin in enumerate(o_keys):
+                seconds[i], meters[i], known[i] = self.cache.get(self.profile, tuple(origin), dests)
+        todo = ~known
+        perf.count("routing.memo.hit", int(known.sum()))
+
+        if todo.any() and self.available:
+            fetched = self._fetch(o_keys, dests, seconds, meters, todo) & todo
+            known |= fetched
+            if self.cache is not None:
+                for i in np.flatnonzero(fetched.any(axis=1)):
+                    j = np.flatnonzero(fetched[i])
+                    self.cache.put(self.profile, tuple(o_keys[i]), dests[j], seconds[i, j], meters[i, j])
+
+        # sem motor / pares sem rota -> geodésica + tempo estimado
+        routed = np.isfinite(seconds) & np.isfinite(meters)
+        km = meters / 1000.0
+        if not routed.all():
+            perf.count("routing.fallback", int((~routed).sum()))
+            est = self.fallback.matrix(o_keys[:, 0] / _SCALE, o_keys[:, 1] / _SCALE, dests[:, 0] / _SCALE, dests[:, 1] / _SCALE)
+            km = np.where(routed, km, est.km)
+            seconds = np.where(routed, seconds, est.seconds)
+
+        return TravelMatrix(km[:, d_inv], seconds[:, d_inv], routed[:, d_inv], complete=bool(known.all()))
+
+    def status(self) -> dict:
+        return {"provider": self.name, "url": self.url, "available": self.available, "error": self.error}
+
+
+def travel_from(provider, lat: float, lon: float, lats, lons, limit: int | None = None):
+    """(km, segundos, completo) de (lat, lon) a cada destino.
+
+    Com `limit`, só os `limit` destinos mais próximos em linha reta vão ao
+    motor; os restantes ficam com a estimativa geodésica (a ordem dos
+    mais próximos é a que conta para decidir o próximo site). `completo`
+    é o TravelMatrix.complete dos destinos que foram ao motor.
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    if not provider.routed or limit is None or len(lats) <= limit:
+        m = provider.matrix([lat], [lon], lats, lons)
+        return m.km[0], m.seconds[0], m.complete
+
+    est = provider.fallback.matrix([lat], [lon], lats, lons)
+    km, seconds = est.km[0], est.seconds[0]
+    near = np.argpartition(km, limit - 1)[:limit]
+    m = provider.matrix([lat], [lon], lats[near], lons[near])
+    km[near] = m.km[0]
+    seconds[near] = m.seconds[0]
+    return km, seconds, m.complete
+
+
+def provider_from_env(cache_path: str | Path | None = None):
+    """OsrmProvider se TASKFORCE_ROUTING_URL estiver definido, senão GeodesicProvider."""
+    if not ROUTING_URL:
+        return GeodesicProvider()
+    cache = None
+    if cache_path is not None:
+        try:
+            cache = TravelTimeCache(cache_path)
+        except (OSError, sqlite3.Error):
+            cache = None  # sem memo em disco: só fica mais lento
+    return OsrmProvider(ROUTING_URL, profile=ROUTING_PROFILE, cache=cache)